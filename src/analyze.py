@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from core import COLORS, HEIGHT, Color, Move, MoveResult, State
+
+# statistics over as many game records (see records.py) as you like: who
+# wins, how long games go, how they end, how often turns get skipped, and
+# how well each opening, early position and move does. the files are split
+# into shards of whole lines that worker processes read one game at a time,
+# so memory doesn't grow with the number of games: every table is keyed by
+# something there are only so many of (moves, bots, positions in the first
+# few plies), and the workers' tables are added together at the end
+
+SHARD_BYTES = 16 << 20
+
+
+class Stats:
+    def __init__(self, plies: int = 4):
+        # openings and positions are only kept for the first this many plies
+        self.plies = plies
+        self.games = 0
+        self.crashed = 0
+        # records whose moves don't replay to the result they claim
+        self.bad = 0
+        self.wins = Counter()
+        # games by length in plies
+        self.lengths = Counter()
+        # how games ended: "escape", "blocked" or "forfeit"
+        self.endings = Counter()
+        # turns skipped, by kind (see State._make_move)
+        self.skips = Counter()
+        # games and wins for each (bot, color)
+        self.bots: dict[tuple[str, str], list[int]] = {}
+        # games and white wins for each sequence of opening moves, and for
+        # each position (State.to_text) reached in the opening
+        self.openings: dict[str, list[int]] = {}
+        self.positions: dict[str, list[int]] = {}
+        # times played and games the mover went on to win, for each (color, move)
+        self.moves: dict[tuple[str, str], list[int]] = {}
+
+    def add(self, record: dict) -> None:
+        if record["error"] is not None:
+            self.crashed += 1
+            return
+        tokens = record["moves"].split()
+        state = State()
+        seen = []
+        movers = []
+        for (i, token) in enumerate(tokens):
+            if i < self.plies:
+                seen.append(state.to_text())
+            try:
+                move = Move.from_token(state.next_move[0], token)
+            except ValueError:
+                self.bad += 1
+                return
+            result, _ = state.try_move(move)
+            if result in (MoveResult.MOVE_FAILURE, MoveResult.ALREADY_OVER):
+                self.bad += 1
+                return
+            movers.append(move.player)
+        if record.get("forfeit") is not None and state.winner is None:
+            state.forfeit(Color(record["forfeit"]))
+        if state.winner is None or state.winner != record["result"]:
+            self.bad += 1
+            return
+
+        winner = state.winner
+        white_won = int(winner == Color.WHITE)
+        self.games += 1
+        self.wins[winner.value] += 1
+        self.lengths[len(tokens)] += 1
+        if state.forfeited is not None:
+            self.endings["forfeit"] += 1
+        elif tokens and int(tokens[-1][2:]) not in range(HEIGHT):
+            self.endings["escape"] += 1
+        else:
+            self.endings["blocked"] += 1
+        self.skips.update(state.skips)
+        for color in COLORS:
+            counts = self.bots.setdefault((record[color.value], color.value), [0, 0])
+            counts[0] += 1
+            counts[1] += int(winner == color)
+        for i in range(1, min(self.plies, len(tokens)) + 1):
+            counts = self.openings.setdefault(" ".join(tokens[:i]), [0, 0])
+            counts[0] += 1
+            counts[1] += white_won
+        for position in seen:
+            counts = self.positions.setdefault(position, [0, 0])
+            counts[0] += 1
+            counts[1] += white_won
+        for (player, token) in zip(movers, tokens):
+            counts = self.moves.setdefault((player.value, token), [0, 0])
+            counts[0] += 1
+            counts[1] += int(winner == player)
+
+    def merge(self, other: "Stats") -> None:
+        self.games += other.games
+        self.crashed += other.crashed
+        self.bad += other.bad
+        for name in ("wins", "lengths", "endings", "skips"):
+            getattr(self, name).update(getattr(other, name))
+        for name in ("bots", "openings", "positions", "moves"):
+            table = getattr(self, name)
+            for (key, (n, wins)) in getattr(other, name).items():
+                counts = table.setdefault(key, [0, 0])
+                counts[0] += n
+                counts[1] += wins
+
+
+def shards(paths: list[str], shard_bytes: int = SHARD_BYTES) -> list[tuple[str, int, int]]:
+    # (path, start, end) byte ranges covering every file
+    return [
+        (path, start, min(start + shard_bytes, size))
+        for path in paths
+        for size in [os.path.getsize(path)]
+        for start in range(0, size, shard_bytes)
+    ]
+
+
+def analyze_shard(path: str, start: int, end: int, plies: int) -> Stats:
+    # every line that starts in [start, end); the one that starts before it
+    # and runs over belongs to the shard before
+    stats = Stats(plies)
+    with open(path, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            if line.strip():
+                stats.add(json.loads(line))
+    return stats
+
+
+def analyze(paths: list[str], plies: int = 4, jobs: int = 1, shard_bytes: int = SHARD_BYTES) -> Stats:
+    stats = Stats(plies)
+    work = shards(paths, shard_bytes)
+    if jobs == 1:
+        for shard in work:
+            stats.merge(analyze_shard(*shard, plies))
+        return stats
+    with ProcessPoolExecutor(jobs) as pool:
+        for future in as_completed([pool.submit(analyze_shard, *shard, plies) for shard in work]):
+            stats.merge(future.result())
+    return stats
+
+
+def _rate(wins: int, games: int) -> str:
+    return f"{wins / games:.0%}" if games else "-"
+
+
+def write_tables(stats: Stats, directory: str) -> None:
+    # one tab-separated file per table, most common rows first
+    os.makedirs(directory, exist_ok=True)
+    tables = {
+        "lengths": (("plies", "games"), sorted(((length, n) for (length, n) in stats.lengths.items()))),
+        "bots": (("bot", "color", "games", "wins"), [(*key, *counts) for (key, counts) in stats.bots.items()]),
+        "openings": (
+            ("moves", "games", "white_wins"),
+            [(key, *counts) for (key, counts) in stats.openings.items()],
+        ),
+        "positions": (
+            ("position", "games", "white_wins"),
+            [(key, *counts) for (key, counts) in stats.positions.items()],
+        ),
+        "moves": (("color", "move", "played", "mover_wins"), [(*key, *counts) for (key, counts) in stats.moves.items()]),
+        "summary": (
+            ("stat", "count"),
+            [("games", stats.games), ("crashed", stats.crashed), ("bad", stats.bad)]
+            + [(f"{color}_wins", n) for (color, n) in sorted(stats.wins.items())]
+            + [(f"{ending}_endings", n) for (ending, n) in sorted(stats.endings.items())]
+            + [(f"{kind}_skips", n) for (kind, n) in sorted(stats.skips.items())],
+        ),
+    }
+    for (name, (header, rows)) in tables.items():
+        if name not in ("lengths", "summary"):
+            rows.sort(key=lambda row: row[-2], reverse=True)
+        with open(os.path.join(directory, f"{name}.tsv"), "w") as f:
+            f.write("\t".join(header) + "\n")
+            for row in rows:
+                f.write("\t".join(map(str, row)) + "\n")
+
+
+def print_summary(stats: Stats, top: int) -> None:
+    games = stats.games
+    print(f"{games} games ({stats.crashed} crashed and {stats.bad} that don't replay left out)")
+    if not games:
+        return
+    print(f"white won {_rate(stats.wins['white'], games)}, black {_rate(stats.wins['black'], games)}")
+    total = sum(length * n for (length, n) in stats.lengths.items())
+    print(f"games last {total / games:.1f} plies on average ({min(stats.lengths)} to {max(stats.lengths)})")
+    print("ended by: " + ", ".join(f"{ending} {_rate(n, games)}" for (ending, n) in stats.endings.most_common()))
+    print("skipped turns per game: " + ", ".join(f"{kind} {stats.skips[kind] / games:.2f}" for kind in ("response", "free", "deadlock")))
+
+    print("BOTS:")
+    for ((bot, color), (n, wins)) in sorted(stats.bots.items(), key=lambda item: item[1][0], reverse=True)[:top]:
+        print(f"- {bot} as {color}: won {wins} of {n} ({_rate(wins, n)})")
+    print(f"OPENINGS (first {stats.plies} plies, white's win rate):")
+    for (moves, (n, wins)) in sorted(stats.openings.items(), key=lambda item: item[1][0], reverse=True)[:top]:
+        print(f"- {moves}: {n} games, {_rate(wins, n)}")
+    print("MOVES (the mover's win rate):")
+    for ((color, move), (n, wins)) in sorted(stats.moves.items(), key=lambda item: item[1][0], reverse=True)[:top]:
+        print(f"- {color} {move}: played {n} times, {_rate(wins, n)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize game records written with --records.")
+    parser.add_argument("files", nargs="+", help="record files")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--plies", type=int, default=4, help="how deep into the game openings and positions are counted")
+    parser.add_argument("--top", type=int, default=10, help="rows of each table to print")
+    parser.add_argument("--out", metavar="DIR", help="write every table in full to DIR as tab-separated files")
+    parser.add_argument(
+        "--shard-mb", type=float, default=SHARD_BYTES / (1 << 20), help="megabytes of records each worker reads at a time"
+    )
+    args = parser.parse_args()
+
+    stats = analyze(args.files, args.plies, args.jobs, int(args.shard_mb * (1 << 20)))
+    print_summary(stats, args.top)
+    if args.out:
+        write_tables(stats, args.out)
+        print(f"tables written to {args.out}")
@@ -1,16 +1,72 @@
 #!/usr/bin/env python3
 
+import argparse
+import logging
 import sys
-from move_getters import get_from_bot
+import profiling
+from book import PositionTable
+from move_getters import get_from_spec
 from play_game import play_game
 
+parser = argparse.ArgumentParser(description="Play one game between two bots.")
+parser.add_argument("white", help="path to the white player's executable, or builtin:<name>")
+parser.add_argument("black", help="path to the black player's executable, or builtin:<name>")
+parser.add_argument(
+    "--persistent",
+    action="store_true",
+    help="keep each bot running for the whole game (see the README)",
+)
+parser.add_argument(
+    "--move-timeout",
+    type=float,
+    default=None,
+    help="seconds a bot gets per move before it forfeits the game",
+)
+parser.add_argument(
+    "--game-time-limit",
+    type=float,
+    default=None,
+    help="seconds a bot gets for all its moves in a game before it forfeits",
+)
+parser.add_argument(
+    "--book",
+    action="append",
+    default=[],
+    metavar="FILE",
+    help="an opening book or tablebase from book.py for the bots to use (can be given more than once)",
+)
+parser.add_argument(
+    "--profile",
+    action="store_true",
+    help="count calls to the referee's hot paths and bot i/o and time them (also on with ZENER_PROFILE=1)",
+)
+parser.add_argument(
+    "--profile-dump",
+    metavar="FILE",
+    help="also run every game under cProfile and save the stats to FILE (pstats format, e.g. for snakeviz or flameprof)",
+)
+args = parser.parse_args()
+if args.profile or args.profile_dump:
+    profiling.enable(cprofile=args.profile_dump is not None)
+profiling.enable_from_env()
+logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+
+tables = [PositionTable(path) for path in args.book]
+get_white_move = get_from_spec(args.white, args.persistent, args.move_timeout, tables)
+get_black_move = get_from_spec(args.black, args.persistent, args.move_timeout, tables)
 
+profiler = profiling.start_game()
 winner = play_game(
-    get_white_move=get_from_bot(sys.argv[1]),
-    get_black_move=get_from_bot(sys.argv[2]),
+    get_white_move=get_white_move,
+    get_black_move=get_black_move,
     verbose=True,
     sleep_time=0.25,
     draw_over=True,
+    move_time_limit=args.move_timeout,
+    game_time_limit=args.game_time_limit,
 )
+get_white_move.close()
+get_black_move.close()
 
 print(f"Game is over! Winner: {winner}")
+profiling.print_report(profiling.RunProfile(), args.profile_dump, profiler=profiler)
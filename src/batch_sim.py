@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+import time
+from core import COLORS, DESTINATIONS, HEIGHT, PIECE_COUNT, SHAPES, SQUARE_COUNT, WIDTH, Move, State
+
+# plays lots of games at once for statistics (first-move advantage and the
+# like), with every game's state held in numpy arrays and all of them
+# advanced one ply per step. numpy is only needed for this script
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("batch_sim.py needs numpy (pip install numpy)")
+
+# moves are numbered shape * 4 + direction, in this order
+DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+MOVE_COUNT = len(SHAPES) * len(DIRECTIONS)
+
+
+def _make_dest_table():
+    # DEST[color, square, direction] is the square a piece ends up on, or -1
+    # if it can't go that way (same rules as core.DESTINATIONS)
+    table = np.full((len(COLORS), SQUARE_COUNT, len(DIRECTIONS)), -1, dtype=np.int64)
+    for c in range(len(COLORS)):
+        for square in range(SQUARE_COUNT):
+            x, y = square % WIDTH, square // WIDTH - 1
+            for (d, (dir_x, dir_y)) in enumerate(DIRECTIONS):
+                if (x + dir_x, y + dir_y) in DESTINATIONS[c][square]:
+                    table[c, square, d] = (y + dir_y + 1) * WIDTH + x + dir_x
+    return table
+
+
+DEST = _make_dest_table()
+# how far along each square is for each color; escaping counts as HEIGHT
+PROGRESS = np.array(
+    [[square // WIDTH - 1 for square in range(SQUARE_COUNT)], [HEIGHT - square // WIDTH for square in range(SQUARE_COUNT)]]
+)
+# SHAPE_OK[required + 1, prev + 1] is which shapes the mover may pick
+SHAPE_OK = np.array(
+    [
+        [[shape != prev - 1 for shape in range(len(SHAPES))] for prev in range(len(SHAPES) + 1)]
+        if required == 0
+        else [[shape == required - 1 for shape in range(len(SHAPES))]] * (len(SHAPES) + 1)
+        for required in range(len(SHAPES) + 1)
+    ]
+)
+# the color of each piece, with -1 (no piece) getting a spare column of its own
+COLOR_OF = np.array([i // len(SHAPES) for i in range(PIECE_COUNT)] + [len(COLORS)])
+_START = State()
+START_SQUARES = np.array([(_START.ys[i] + 1) * WIDTH + _START.xs[i] for i in range(PIECE_COUNT)])
+
+
+class BatchGames:
+    # n games side by side. pieces are numbered like in core.State (white's
+    # five shapes, then black's), squares too (see core.square_of), and
+    # colors and shapes are their index in COLORS and SHAPES, with -1 for none
+    def __init__(self, n: int, seed: int | None = None):
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        self.games = np.arange(n)
+        self.sq = np.zeros((n, PIECE_COUNT), dtype=np.int64)
+        self.heights = np.zeros((n, PIECE_COUNT), dtype=np.int64)
+        # the piece directly underneath each piece, and the piece on top of
+        # (and number of pieces on) each square, which is all the stacking we need
+        self.below = np.zeros((n, PIECE_COUNT), dtype=np.int64)
+        self.top = np.zeros((n, SQUARE_COUNT), dtype=np.int64)
+        self.counts = np.zeros((n, SQUARE_COUNT), dtype=np.int64)
+        # unburied pieces per color (plus the spare column for "no piece"),
+        # kept up to date as pieces move like core.State.unburied
+        self.unburied = np.zeros((n, len(COLORS) + 1), dtype=np.int64)
+        self.player = np.zeros(n, dtype=np.int64)
+        self.required = np.zeros(n, dtype=np.int64)
+        self.prev = np.zeros(n, dtype=np.int64)
+        self.winner = np.zeros(n, dtype=np.int64)
+        self.plies = np.zeros(n, dtype=np.int64)
+        self.reset(np.ones(n, dtype=bool))
+
+    def reset(self, which) -> None:
+        # put the games picked out by the boolean array `which` back to the start
+        rows = np.nonzero(which)[0]
+        self.sq[rows] = START_SQUARES
+        self.heights[rows] = 1
+        self.below[rows] = -1
+        self.top[rows] = -1
+        self.counts[rows] = 0
+        self.top[rows[:, None], START_SQUARES] = np.arange(PIECE_COUNT)
+        self.counts[rows[:, None], START_SQUARES] = 1
+        self.unburied[rows] = (len(SHAPES),) * len(COLORS) + (0,)
+        self.player[rows] = 0
+        self.required[rows] = -1
+        self.prev[rows] = -1
+        self.winner[rows] = -1
+        self.plies[rows] = 0
+
+    def _on_top(self, g, pieces):
+        # whether each of `pieces` (one row per game in g) is on top of its stack
+        return self.top[g[:, None], self.sq[g[:, None], pieces]] == pieces
+
+    def legal(self):
+        # (n, 5, 4): which of the mover's shapes can go in which direction,
+        # and the squares they'd end up on
+        # (indexing the flattened arrays is quite a bit faster than 2d indexing)
+        pieces = self.player[:, None] * len(SHAPES) + np.arange(len(SHAPES))
+        squares = self.sq.ravel()[self.games[:, None] * PIECE_COUNT + pieces]
+        movable = self.top.ravel()[self.games[:, None] * SQUARE_COUNT + squares] == pieces
+        movable &= SHAPE_OK[self.required + 1, self.prev + 1]
+        dest = DEST.reshape(-1, len(DIRECTIONS))[self.player[:, None] * SQUARE_COUNT + squares]
+        return movable[:, :, None] & (dest >= 0), dest
+
+    def _can_move(self, g):
+        # like core.State._can_move, for the games in g: every square has
+        # somewhere to go, so it's all about what's buried
+        player, required, prev = self.player[g], self.required[g], self.prev[g]
+        first = player * len(SHAPES)
+        shape = np.where(required >= 0, required, np.maximum(prev, 0))
+        shape_on_top = self._on_top(g, (first + shape)[:, None])[:, 0]
+        movable = self.unburied[g, player] - ((prev >= 0) & shape_on_top)
+        return np.where(required >= 0, shape_on_top, movable > 0)
+
+    def choose(self, mask, dest, policies):
+        # policies[color] is "random" (any legal move) or "greedy" (furthest
+        # forward, ties broken randomly), like the built-in bots of those names
+        scores = self.rng.random((self.n, len(SHAPES), len(DIRECTIONS)), dtype=np.float32)
+        greedy = np.array([policy == "greedy" for policy in policies])[self.player]
+        if greedy.any():
+            forward = PROGRESS[self.player[:, None, None], np.maximum(dest, 0)]
+            scores = np.where(greedy[:, None, None], scores + forward, scores)
+        scores = np.where(mask, scores, -1)
+        return scores.reshape(self.n, MOVE_COUNT).argmax(1)
+
+    def step(self, policies) -> tuple:
+        # play one move in every game that isn't over. returns who moved, which
+        # games were still going, the legal moves and the move picked in each,
+        # for checking against core.State
+        mask, dest = self.legal()
+        move = self.choose(mask, dest, policies)
+        player = self.player.copy()
+        active = self.winner < 0
+        g, move_g, player_g = self.games[active], move[active], player[active]
+        shape = move_g // len(DIRECTIONS)
+        piece = player_g * len(SHAPES) + shape
+        to = dest[g, shape, move_g % len(DIRECTIONS)]
+
+        # lift the piece off its stack, uncovering whatever's underneath...
+        start = self.sq[g, piece]
+        under = self.below[g, piece]
+        self.top[g, start] = under
+        self.counts[g, start] -= 1
+        self.unburied[g, COLOR_OF[under]] += 1
+        # ...and drop it on the new one, covering whatever was on top there
+        covered = self.top[g, to]
+        self.unburied[g, COLOR_OF[covered]] -= 1
+        self.below[g, piece] = covered
+        self.top[g, to] = piece
+        self.counts[g, to] += 1
+        self.heights[g, piece] = self.counts[g, to]
+        self.sq[g, piece] = to
+        self.plies[g] += 1
+
+        y = to // WIDTH - 1
+        escaped = (y < 0) | (y >= HEIGHT)
+        self.winner[g[escaped]] = player_g[escaped]
+
+        g, shape = g[~escaped], shape[~escaped]
+        free = g[self.required[g] < 0]
+        responded = g[self.required[g] >= 0]
+        self.prev[g] = shape
+        self.player[free] = 1 - self.player[free]
+        self.required[free] = self.prev[free]
+        self.required[responded] = -1
+
+        # someone with every piece buried loses (white is checked first, like core)
+        unburied = self.unburied[g]
+        self.winner[g[unburied[:, 1] == 0]] = 0
+        self.winner[g[unburied[:, 0] == 0]] = 1
+
+        # skip whoever can't move until someone can. if that skips both
+        # players' free moves, the previous shape is let off (like core)
+        g = g[self.winner[g] < 0]
+        skipped = np.zeros(self.n, dtype=np.int64)
+        for _ in range(2 * len(COLORS)):
+            g = g[~self._can_move(g)]
+            if len(g) == 0:
+                break
+            skip_turn = g[self.required[g] < 0]
+            self.required[g] = -1
+            self.player[skip_turn] = 1 - self.player[skip_turn]
+            skipped[skip_turn] += 1
+            self.prev[skip_turn[skipped[skip_turn] == len(COLORS)]] = -1
+        return player, active, mask, move
+
+    def finished(self, max_plies: int):
+        return (self.winner >= 0) | (self.plies >= max_plies)
+
+
+def run(
+    games: int,
+    batch: int,
+    policies: tuple[str, str],
+    seed: int | None = None,
+    max_plies: int = 1000,
+    history: list | None = None,
+) -> tuple[int, int, int, int]:
+    # play `games` games `batch` at a time, starting a new game in each slot
+    # as soon as the old one finishes. returns (white wins, black wins, games
+    # cut off at max_plies, total plies). with history, every game is
+    # appended to it as ([(player, legal mask, move), ...], winner) for checking
+    sim = BatchGames(min(batch, games), seed)
+    wins = [0, 0]
+    cut_off = 0
+    plies = 0
+    started = sim.n
+    done = 0
+    playing = [[] for _ in range(sim.n)] if history is not None else None
+    live = np.ones(sim.n, dtype=bool)
+    while done < games:
+        player, active, mask, move = sim.step(policies)
+        if playing is not None:
+            for i in np.nonzero(active & live)[0]:
+                playing[i].append((int(player[i]), mask[i].reshape(MOVE_COUNT).copy(), int(move[i])))
+        finished = sim.finished(max_plies) & live
+        if not finished.any():
+            continue
+        for color in range(len(COLORS)):
+            wins[color] += int((finished & (sim.winner == color)).sum())
+        cut_off += int((finished & (sim.winner < 0)).sum())
+        plies += int(sim.plies[finished].sum())
+        done += int(finished.sum())
+        if playing is not None:
+            for i in np.nonzero(finished)[0]:
+                history.append((playing[i], int(sim.winner[i])))
+                playing[i] = []
+        # refill the slots we still need games for, and retire the rest
+        rows = np.nonzero(finished)[0]
+        refill = np.zeros(sim.n, dtype=bool)
+        refill[rows[: max(0, games - started)]] = True
+        retire = finished & ~refill
+        started += int(refill.sum())
+        sim.reset(refill)
+        live &= ~retire
+        # retired slots keep "winning" so step leaves them alone
+        sim.winner[retire] = 0
+    return wins[0], wins[1], cut_off, plies
+
+
+def check_against_core(history: list) -> list[str]:
+    # replay each recorded game through core.State, checking that both agree
+    # on whose turn it is, which moves are legal and who won
+    problems = []
+    for (n, (game, winner)) in enumerate(history):
+        state = State()
+        for (ply, (player, mask, move)) in enumerate(game):
+            if state.next_move[0] != COLORS[player]:
+                problems.append(f"game {n} ply {ply}: batch has {COLORS[player]} to move, core has {state.next_move[0]}")
+                break
+            core_moves = {_move_number(state, m) for m in state.get_valid_moves()}
+            batch_moves = set(np.nonzero(mask)[0].tolist())
+            if core_moves != batch_moves:
+                problems.append(f"game {n} ply {ply}: legal moves differ ({sorted(batch_moves)} vs {sorted(core_moves)})")
+                break
+            shape, (dir_x, dir_y) = SHAPES[move // len(DIRECTIONS)], DIRECTIONS[move % len(DIRECTIONS)]
+            index = player * len(SHAPES) + move // len(DIRECTIONS)
+            state.try_move(Move(COLORS[player], shape, state.xs[index] + dir_x, state.ys[index] + dir_y))
+        else:
+            expected = COLORS[winner] if winner >= 0 else None
+            if state.winner != expected:
+                problems.append(f"game {n}: batch says {expected} won, core says {state.winner}")
+    return problems
+
+
+def _move_number(state: State, move: Move) -> int:
+    index = COLORS.index(move.player) * len(SHAPES) + SHAPES.index(move.shape)
+    direction = DIRECTIONS.index((move.x - state.xs[index], move.y - state.ys[index]))
+    return SHAPES.index(move.shape) * len(DIRECTIONS) + direction
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play lots of games at once with numpy, for statistics.")
+    parser.add_argument("games", nargs="?", type=int, default=100_000)
+    parser.add_argument("--batch", type=int, default=4096, help="how many games to play side by side")
+    parser.add_argument("--white", choices=("random", "greedy"), default="random")
+    parser.add_argument("--black", choices=("random", "greedy"), default="random")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-plies", type=int, default=1000, help="give up on games longer than this")
+    parser.add_argument(
+        "--check", type=int, metavar="N", help="instead, play N games and check them against core.State"
+    )
+    args = parser.parse_args()
+    policies = (args.white, args.black)
+
+    if args.check is not None:
+        history = []
+        run(args.check, args.check, policies, args.seed, args.max_plies, history)
+        problems = check_against_core(history)
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        print(f"checked {len(history)} games ({sum(len(game) for (game, _) in history)} moves), {len(problems)} problems")
+        sys.exit(1 if problems else 0)
+
+    start = time.perf_counter()
+    white_wins, black_wins, cut_off, plies = run(args.games, args.batch, policies, args.seed, args.max_plies)
+    elapsed = time.perf_counter() - start
+    finished = white_wins + black_wins
+    print(f"{args.games} games ({args.white} vs {args.black}) in {elapsed:.2f}s: {args.games / elapsed:,.0f} games/s, {plies / elapsed:,.0f} plies/s")
+    print(f"white won {white_wins} ({white_wins / max(finished, 1):.1%}), black won {black_wins} ({black_wins / max(finished, 1):.1%})")
+    print(f"{plies / args.games:.1f} plies per game on average")
+    if cut_off > 0:
+        print(f"{cut_off} games went past {args.max_plies} plies and weren't counted")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import io
+import itertools
+import random
+import timeit
+from core import State
+from perft import POSITIONS, load_position
+from render import BoardRenderer
+
+# micro-benchmarks for the State methods the referee leans on every turn,
+# run from each of perft's saved positions
+
+
+def random_game(seed: int) -> list:
+    # the moves of one random game, so try_move has something real to chew on
+    rng = random.Random(seed)
+    state = State()
+    moves = []
+    while state.get_who_won() is None:
+        move = rng.choice(state.get_valid_moves())
+        state.make_move(move)
+        moves.append(move)
+    return moves
+
+
+def play_through(moves: list) -> None:
+    state = State()
+    for move in moves:
+        state.try_move(move)
+
+
+def time_per_call(func, number: int) -> float:
+    # best of a few runs, which is the least noisy number timeit gives us
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def report(label: str, seconds: float) -> None:
+    print(f"  {label:<20} {seconds * 1e6:8.2f} µs/call")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the hot State methods.")
+    parser.add_argument("-n", "--number", type=int, default=2000, help="calls per timing run")
+    args = parser.parse_args()
+
+    for name in POSITIONS:
+        state = load_position(name)
+        print(f"{name}:")
+        # the first call in a position generates the moves, the rest come from the cache
+        report("generate moves", time_per_call(state._generate_moves, args.number))
+        report("get_valid_moves", time_per_call(state.get_valid_moves, args.number))
+        report("get_full_board", time_per_call(state.get_full_board, args.number))
+        report("get_board_view", time_per_call(lambda: list(state.get_board_view().items()), args.number))
+        text, data = state.to_text(), state.to_bytes()
+        report("to_text", time_per_call(state.to_text, args.number))
+        report("from_text", time_per_call(lambda: State.from_text(text), args.number))
+        report("to_bytes", time_per_call(state.to_bytes, args.number))
+        report("from_bytes", time_per_call(lambda: State.from_bytes(data), args.number))
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds = time_per_call(state.draw_board, args.number)
+        report("draw_board", seconds)
+        # what render.py does each move instead: rewrite the squares that changed
+        after = State.from_bytes(data)
+        after.make_move(after.get_valid_moves()[0])
+        frames = itertools.cycle((state, after))
+        renderer = BoardRenderer(io.StringIO(), max_fps=None)
+        report("render a move", time_per_call(lambda: renderer.draw(next(frames)), args.number))
+
+    moves = random_game(0)
+    print(f"random game ({len(moves)} moves):")
+    games = max(1, args.number // len(moves))
+    report("try_move", time_per_call(lambda: play_through(moves), games) / len(moves))
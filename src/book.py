@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import argparse
+import mmap
+import random
+import struct
+import sys
+import time
+from collections import deque
+from core import SHAPE_INDEX, SHAPES, Color, Move, State, get_move
+from bots import WIN_SCORE, search
+from transposition import EXACT, TranspositionTable
+
+# opening books and endgame tablebases, both saved as the same kind of file:
+# a hash table of positions keyed by State.get_position_key(), which can be
+# mmapped and probed in O(1) without loading it. the layout is
+#   header: 8 byte magic, u32 log2 of the slot count, u32 entry count
+#   slots:  u64 key (0 for an empty slot), i32 score, u16 move, u8 depth, u8 flag
+# all little-endian. a position goes in slot key % slot count, or the next
+# free one after it. scores are from the point of view of whoever's moving,
+# like bots.alphabeta's, and moves are packed by pack_move
+MAGIC = b"ZENERTB1"
+HEADER = struct.Struct("<8sII")
+SLOT = struct.Struct("<QiHBB")
+NO_MOVE = 0xFFFF
+# depth of an entry that's been solved outright rather than searched
+SOLVED = 255
+
+
+def pack_move(move: Move | None) -> int:
+    # shape, x and y + 1 (so escaping backwards off the bottom still fits);
+    # the player is always whoever's moving
+    if move is None:
+        return NO_MOVE
+    return (SHAPE_INDEX[move.shape] << 7) | (move.x << 4) | (move.y + 1)
+
+
+def unpack_move(player: Color, packed: int) -> Move | None:
+    if packed == NO_MOVE:
+        return None
+    return get_move(player, SHAPES[packed >> 7], (packed >> 4) & 0b111, (packed & 0b1111) - 1)
+
+
+def write_table(path: str, entries: dict[int, tuple[int, Move | None, int, int]]) -> None:
+    # entries maps position key to (score, move, depth, flag). the table is
+    # kept at most half full so probes stay short
+    slot_bits = max(4, (2 * len(entries)).bit_length())
+    mask = (1 << slot_bits) - 1
+    slots = bytearray(SLOT.size << slot_bits)
+    for (key, (score, move, depth, flag)) in entries.items():
+        slot = key & mask
+        while SLOT.unpack_from(slots, slot * SLOT.size)[0] != 0:
+            slot = (slot + 1) & mask
+        SLOT.pack_into(slots, slot * SLOT.size, key or 1, int(score), pack_move(move), depth, flag)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, slot_bits, len(entries)))
+        f.write(slots)
+
+
+class PositionTable:
+    # a table written by write_table, mmapped read-only so any number of
+    # bots (and processes) can share one copy of it
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, slot_bits, self.count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} isn't a position table")
+        self.mask = (1 << slot_bits) - 1
+
+    def probe(self, key: int) -> tuple[int, int, int, int] | None:
+        # (score, packed move, depth, flag) for a position key, or None
+        key = key or 1
+        slot = key & self.mask
+        while True:
+            found, score, move, depth, flag = SLOT.unpack_from(self.data, HEADER.size + slot * SLOT.size)
+            if found == key:
+                return (score, move, depth, flag)
+            if found == 0:
+                return None
+            slot = (slot + 1) & self.mask
+
+    def lookup(self, state: State) -> tuple[Move | None, int, int] | None:
+        # (move, score, depth) for whoever's moving in state, or None if the
+        # table doesn't know the position
+        if (entry := self.probe(state.get_position_key())) is None:
+            return None
+        score, move, depth, _ = entry
+        return (unpack_move(state.next_move[0], move), score, depth)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self) -> None:
+        self.data.close()
+
+
+def build_book(plies: int, depth: int) -> dict[int, tuple[int, Move | None, int, int]]:
+    # search every position up to `plies` moves into the game `depth` moves deep
+    entries = {}
+    tt = TranspositionTable()
+    state = State()
+
+    def visit(ply: int) -> None:
+        key = state.get_position_key()
+        if key in entries or state.winner is not None:
+            return
+        move, score = search(state, depth, tt)
+        entries[key] = (int(score), move, depth, EXACT)
+        if ply < plies:
+            for move in state.get_valid_moves():
+                state.make_move(move)
+                visit(ply + 1)
+                state.unmake_move()
+
+    visit(0)
+    return entries
+
+
+def _explore(state: State, graph: dict, node_limit: int, mobile: int, plies: int) -> None:
+    # add every position up to `plies` moves from state with at most `mobile`
+    # unburied pieces to graph, as key -> [mover, winner, {child key: move}],
+    # until there are node_limit of them. unfinished positions further away,
+    # with more unburied pieces or past the limit are left out, so nothing
+    # that can move to one of them can be proven lost (see solve)
+    key = state.get_position_key()
+    if key in graph or len(graph) >= node_limit:
+        return
+    graph[key] = [state.next_move[0], state.winner, {}]
+    stack = [(key, iter(state.get_valid_moves() if state.winner is None else ()))]
+    while stack:
+        key, moves = stack[-1]
+        if (move := next(moves, None)) is None:
+            stack.pop()
+            if stack:
+                state.unmake_move()
+            continue
+        state.make_move(move)
+        child = state.get_position_key()
+        graph[key][2][child] = move
+        # finished games are always worth having, wherever they are
+        if child in graph or (
+            state.winner is None
+            and (len(graph) >= node_limit or len(stack) > plies or mobile_pieces(state) > mobile)
+        ):
+            state.unmake_move()
+            continue
+        graph[child] = [state.next_move[0], state.winner, {}]
+        stack.append((child, iter(state.get_valid_moves() if state.winner is None else ())))
+
+
+def solve(graph: dict) -> dict[int, tuple[int, Move | None, int, int]]:
+    # retrograde analysis: start from finished games and work backwards. a
+    # position is won for whoever's moving as soon as one move leads to a
+    # position they've won, and lost once every move leads to one the other
+    # player has won. going through positions in the order they're solved
+    # means wins are found by the fastest route and losses by the slowest.
+    # positions that never get solved (they can reach something outside the
+    # graph, or go round in circles) aren't in the result
+    parents: dict[int, list[int]] = {key: [] for key in graph}
+    unsolved = {}
+    for (key, (_, _, children)) in graph.items():
+        unsolved[key] = len(children)
+        for child in children:
+            if child in parents:
+                parents[child].append(key)
+
+    # key -> (winner, moves until the game's over, best move)
+    solved: dict[int, tuple[Color, int, Move | None]] = {}
+    queue = deque()
+    for (key, (_, winner, _)) in graph.items():
+        if winner is not None:
+            solved[key] = (winner, 0, None)
+            queue.append(key)
+    while queue:
+        child = queue.popleft()
+        winner, distance, _ = solved[child]
+        for parent in parents[child]:
+            if parent in solved:
+                continue
+            mover, _, children = graph[parent]
+            if mover == winner:
+                solved[parent] = (winner, distance + 1, children[child])
+                queue.append(parent)
+            else:
+                unsolved[parent] -= 1
+                if unsolved[parent] == 0:
+                    solved[parent] = (winner, distance + 1, children[child])
+                    queue.append(parent)
+
+    entries = {}
+    for (key, (winner, distance, move)) in solved.items():
+        score = WIN_SCORE - distance if winner == graph[key][0] else distance - WIN_SCORE
+        entries[key] = (score, move, SOLVED, EXACT)
+    return entries
+
+
+def mobile_pieces(state: State) -> int:
+    return sum(state.unburied)
+
+
+def build_tablebase(
+    mobile: int, games: int, plies: int, node_limit: int, seed: int | None = None
+) -> dict[int, tuple[int, Move | None, int, int]]:
+    # find positions with at most `mobile` unburied pieces by playing random
+    # games, map out everything within `plies` moves of them that stays that
+    # way, then solve the lot. games that never get there are just skipped
+    rng = random.Random(seed)
+    graph = {}
+    for _ in range(games):
+        state = State()
+        while state.winner is None and len(graph) < node_limit:
+            if mobile_pieces(state) <= mobile:
+                _explore(state, graph, node_limit, mobile, plies)
+                break
+            state.make_move(rng.choice(state.get_valid_moves()))
+    solved = solve(graph)
+    keep = {key for (key, (_, winner, _)) in graph.items() if winner is None}
+    return {key: entry for (key, entry) in solved.items() if key in keep}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build opening books and endgame tablebases.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    book_parser = commands.add_parser("book", help="search every position near the start")
+    book_parser.add_argument("file")
+    book_parser.add_argument("--plies", type=int, default=4, help="how many moves into the game to go")
+    book_parser.add_argument("--depth", type=int, default=5, help="how deep to search each position")
+    tablebase_parser = commands.add_parser("tablebase", help="solve positions with few pieces left to move")
+    tablebase_parser.add_argument("file")
+    tablebase_parser.add_argument("--mobile", type=int, default=4, help="most unburied pieces (both colors) to keep")
+    tablebase_parser.add_argument("--games", type=int, default=1000, help="random games to look for positions in")
+    tablebase_parser.add_argument("--plies", type=int, default=8, help="how far to look from each position found")
+    tablebase_parser.add_argument("--nodes", type=int, default=1_000_000, help="most positions to map out")
+    tablebase_parser.add_argument("--seed", type=int, default=None)
+    info_parser = commands.add_parser("info", help="show how many positions a table has")
+    info_parser.add_argument("file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "book":
+        entries = build_book(args.plies, args.depth)
+    elif args.command == "tablebase":
+        entries = build_tablebase(args.mobile, args.games, args.plies, args.nodes, args.seed)
+    else:
+        table = PositionTable(args.file)
+        print(f"{args.file}: {len(table)} positions in {table.mask + 1} slots")
+        sys.exit(0)
+    write_table(args.file, entries)
+    print(f"wrote {len(entries)} positions to {args.file} in {time.perf_counter() - start:.1f}s")
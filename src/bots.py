@@ -0,0 +1,290 @@
+import random
+from collections.abc import Callable, Mapping
+from core import COLOR_INDEX, COLORS, HEIGHT, PIECE_COUNT, SHAPES, Color, Move, Piece, Shape, State, square_of
+from play_game import MoveGetter
+from transposition import EXACT, LOWER, UPPER, TranspositionTable
+
+# built-in players that run inside the referee's process, so they cost a
+# function call per move instead of a process spawn. pick them from the
+# command line with "builtin:<name>[:<arg>...]", e.g. builtin:alphabeta:4
+
+WIN_SCORE = 1_000_000
+
+
+def state_from_getter_args(
+    player: Color,
+    board: Mapping[Color, Mapping[Shape, Piece]],
+    valid: list[Move],
+    responding: bool,
+    prev: Shape | None,
+    required_move: Shape | None,
+) -> State:
+    # MoveGetters aren't told which piece they can't move on a free move, but
+    # it's the only unburied piece of theirs without any valid moves (every
+    # square has somewhere to go). if there isn't one it doesn't matter
+    if responding:
+        prev_piece = prev
+    else:
+        can_move = {move.shape for move in valid}
+        stuck = [
+            shape
+            for (shape, piece) in board[player].items()
+            if shape not in can_move
+            and max(
+                other.height
+                for pieces in board.values()
+                for other in pieces.values()
+                if (other.x, other.y) == (piece.x, piece.y)
+            )
+            == piece.height
+        ]
+        prev_piece = stuck[0] if stuck else None
+    return State.from_board(board, (player, required_move), prev_piece)
+
+
+def progress(color: Color, y: int) -> int:
+    # how many rows a piece has come from its own side
+    return y if color == Color.WHITE else (HEIGHT - 1) - y
+
+
+def can_escape(state: State) -> bool:
+    # whether whoever's moving has an unburied piece on the last row that
+    # they'll get to move before the other player does. if they're
+    # responding, their free move comes right after, so any piece counts
+    mover, required = state.next_move
+    c = COLOR_INDEX[mover]
+    for s in range(len(SHAPES)):
+        i = c * len(SHAPES) + s
+        if required is None and SHAPES[s] == state.prev_piece:
+            continue
+        if (
+            progress(mover, state.ys[i]) == HEIGHT - 1
+            and state.stacks[square_of(state.xs[i], state.ys[i])][-1] == i
+        ):
+            return True
+    return False
+
+
+def evaluate(state: State, player: Color) -> int:
+    # pieces that are further along are worth more, and much more if they
+    # can still move (an unburied piece near the end is a big threat, so it
+    # grows quickly)
+    if can_escape(state):
+        return WIN_SCORE // 2 if state.next_move[0] == player else -WIN_SCORE // 2
+    score = 0
+    for i in range(PIECE_COUNT):
+        c = i // len(SHAPES)
+        p = progress(COLORS[c], state.ys[i])
+        on_top = state.stacks[square_of(state.xs[i], state.ys[i])][-1] == i
+        value = 3**p // 4 if on_top else p
+        score += value if COLORS[c] == player else -value
+    return score
+
+
+def order_moves(moves: list[Move], first: Move | None = None) -> list[Move]:
+    # try the moves that go furthest forward first, so escapes get looked at
+    # right away and alpha-beta cuts off more. a move the transposition
+    # table liked last time goes before all of them
+    return sorted(
+        moves,
+        key=lambda move: (move == first, progress(move.player, move.y)),
+        reverse=True,
+    )
+
+
+# table scores are stored from the point of view of whoever's moving in that
+# position (so they mean the same thing whichever player is searching), and
+# wins are stored as "this many plies from here" rather than from the root
+def _to_table(score: float, ply: int, flip: bool) -> float:
+    if score > WIN_SCORE // 2:
+        score += ply
+    elif score < -WIN_SCORE // 2:
+        score -= ply
+    return -score if flip else score
+
+
+def _from_table(score: float, ply: int, flip: bool) -> float:
+    score = -score if flip else score
+    if score > WIN_SCORE // 2:
+        score -= ply
+    elif score < -WIN_SCORE // 2:
+        score += ply
+    return score
+
+
+def alphabeta(
+    state: State,
+    depth: int,
+    alpha: float,
+    beta: float,
+    player: Color,
+    ply: int = 0,
+    tt: TranspositionTable | None = None,
+) -> float:
+    # plain minimax rather than negamax, since a player often moves twice in a row
+    if state.winner is not None:
+        return WIN_SCORE - ply if state.winner == player else ply - WIN_SCORE
+    if depth == 0:
+        return evaluate(state, player)
+
+    maximizing = state.next_move[0] == player
+    tt_move = None
+    if tt is not None:
+        key = state.get_zobrist()
+        if (entry := tt.get(key)) is not None:
+            tt_depth, tt_score, tt_flag, tt_move = entry
+            if tt_depth >= depth:
+                tt_score = _from_table(tt_score, ply, not maximizing)
+                # bounds swap around when the score is flipped
+                if tt_flag != EXACT and not maximizing:
+                    tt_flag = LOWER if tt_flag == UPPER else UPPER
+                if tt_flag == EXACT:
+                    return tt_score
+                if tt_flag == LOWER:
+                    alpha = max(alpha, tt_score)
+                else:
+                    beta = min(beta, tt_score)
+                if alpha >= beta:
+                    return tt_score
+    alpha_orig, beta_orig = alpha, beta
+
+    best = -float("inf") if maximizing else float("inf")
+    best_move = None
+    for move in order_moves(state.get_valid_moves(), tt_move):
+        state.make_move(move)
+        score = alphabeta(state, depth - 1, alpha, beta, player, ply + 1, tt)
+        state.unmake_move()
+        if (maximizing and score > best) or (not maximizing and score < best):
+            best = score
+            best_move = move
+        if maximizing:
+            alpha = max(alpha, best)
+        else:
+            beta = min(beta, best)
+        if alpha >= beta:
+            break
+
+    if tt is not None:
+        if best <= alpha_orig:
+            flag = UPPER
+        elif best >= beta_orig:
+            flag = LOWER
+        else:
+            flag = EXACT
+        if flag != EXACT and not maximizing:
+            flag = LOWER if flag == UPPER else UPPER
+        tt.put(key, depth, _to_table(best, ply, not maximizing), flag, best_move)
+    return best
+
+
+def search(state: State, depth: int, tt: TranspositionTable | None = None) -> tuple[Move, float]:
+    # the best move for whoever's moving and its score, from their point of view
+    player = state.next_move[0]
+    best_score = -float("inf")
+    best = None
+    if tt is not None:
+        tt.new_search()
+    for move in order_moves(state.get_valid_moves()):
+        state.make_move(move)
+        score = alphabeta(state, depth - 1, best_score, float("inf"), player, 1, tt)
+        state.unmake_move()
+        if best is None or score > best_score:
+            best_score = score
+            best = move
+    return best, best_score
+
+
+def best_move(state: State, depth: int, tt: TranspositionTable | None = None) -> Move:
+    return search(state, depth, tt)[0]
+
+
+def _reseeder(rng: random.Random, seed: str | None) -> Callable[[int | None], None]:
+    # new_game for bots with an rng: a seeded game reseeds it from the
+    # game's seed mixed with the bot's own, so two of the same bot with
+    # different seeds still play differently
+    def new_game(game_seed: int | None) -> None:
+        if game_seed is not None:
+            rng.seed(f"{seed}:{game_seed}")
+
+    return new_game
+
+
+def random_bot(seed: str | None = None) -> MoveGetter:
+    rng = random.Random(seed)
+
+    def f(player, board, valid, responding, prev, required_move) -> Move:
+        return rng.choice(valid)
+
+    f.new_game = _reseeder(rng, seed)
+    return f
+
+
+def greedy_bot(seed: str | None = None) -> MoveGetter:
+    # take whichever move goes furthest toward the far edge (which includes
+    # escaping), breaking ties randomly
+    rng = random.Random(seed)
+
+    def f(player, board, valid, responding, prev, required_move) -> Move:
+        furthest = max(progress(player, move.y) for move in valid)
+        return rng.choice([move for move in valid if progress(player, move.y) == furthest])
+
+    f.new_game = _reseeder(rng, seed)
+    return f
+
+
+def alphabeta_bot(depth: str = "3", tt: TranspositionTable | None = None) -> MoveGetter:
+    # the transposition table sticks around between moves (and unseeded
+    # games), and can be handed in to share it with other searches. what's
+    # left in it can change which of two equally good moves gets played, so
+    # a seeded game starts from an empty table to play the same every time
+    depth = int(depth)
+    tt = tt if tt is not None else TranspositionTable()
+
+    def f(player, board, valid, responding, prev, required_move) -> Move:
+        state = state_from_getter_args(player, board, valid, responding, prev, required_move)
+        return best_move(state, depth, tt)
+
+    def new_game(game_seed: int | None) -> None:
+        if game_seed is not None:
+            tt.clear()
+
+    f.new_game = new_game
+    return f
+
+
+def parallel_bot(*args: str) -> MoveGetter:
+    # lives in parallel.py, which imports this module, so it's only
+    # imported once someone asks for it
+    from parallel import parallel_bot
+
+    return parallel_bot(*args)
+
+
+def learned_bot(*args: str) -> MoveGetter:
+    # lives in learn.py, which needs numpy, so that's only imported once
+    # someone asks for it
+    from learn import learned_bot
+
+    return learned_bot(*args)
+
+
+BUILTIN_BOTS: dict[str, Callable[..., MoveGetter]] = {
+    "random": random_bot,
+    "greedy": greedy_bot,
+    "alphabeta": alphabeta_bot,
+    "parallel": parallel_bot,
+    "learned": learned_bot,
+}
+BUILTIN_PREFIX = "builtin:"
+# built-in bots whose moves depend on more than the position and the game's
+# seed (like how the search gets split between processes), so a seeded game
+# with one of them can't be played again the same way and is never cached
+NONDETERMINISTIC_BOTS = {"parallel"}
+
+
+def get_builtin(spec: str) -> MoveGetter:
+    # spec is everything after "builtin:", e.g. "alphabeta:4"
+    name, *args = spec.split(":")
+    if name not in BUILTIN_BOTS:
+        raise ValueError(f"no built-in bot called {name!r}, try one of {', '.join(BUILTIN_BOTS)}")
+    return BUILTIN_BOTS[name](*args)
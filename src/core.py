@@ -1,6 +1,6 @@
-from copy import deepcopy
-from functools import reduce
-from itertools import chain
+import logging
+import random
+from collections.abc import Iterator, Mapping
 from enum import StrEnum, auto
 from typing import Self
 
@@ -9,6 +9,8 @@ WIDTH = 5
 HEIGHT = 7
 RESET_ANSI_CODE = "\033[0m"
 
+logger = logging.getLogger(__name__)
+
 
 class Shape(StrEnum):
     CIRCLE = auto()
@@ -31,6 +33,28 @@ class Shape(StrEnum):
             case Shape.STAR:
                 return "*"
 
+    @property
+    def letter(self):
+        # plain ascii stand-in for writing moves and positions down
+        match self:
+            case Shape.CIRCLE:
+                return "c"
+            case Shape.PLUS:
+                return "p"
+            case Shape.WAVE:
+                return "w"
+            case Shape.SQUARE:
+                return "q"
+            case Shape.STAR:
+                return "s"
+
+    @classmethod
+    def from_letter(cls, letter: str) -> Self:
+        for shape in cls:
+            if shape.letter == letter:
+                return shape
+        raise ValueError(f"{letter!r} isn't a shape letter")
+
 
 class Color(StrEnum):
     WHITE = auto()
@@ -56,15 +80,31 @@ class MoveResult(StrEnum):
         return cls(f"win_{player.value}")
 
 
+# Moves and Pieces can't be changed once made, so the same one can be
+# handed to anyone: every move that can happen in a game is made once up
+# front (see get_move) and so is every piece (see State._piece)
 class Move:
+    __slots__ = ("player", "shape", "x", "y", "_hash")
+
     def __init__(self, player: Color, shape: Shape, x: int, y: int):
-        self.player = player
-        self.shape = shape
-        self.x = x
-        self.y = y
+        object.__setattr__(self, "player", player)
+        object.__setattr__(self, "shape", shape)
+        object.__setattr__(self, "x", x)
+        object.__setattr__(self, "y", y)
+        object.__setattr__(self, "_hash", hash((player, shape, x, y)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"can't change a Move's {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"can't change a Move's {name}")
+
+    def __reduce__(self):
+        # so pickled moves (e.g. sent to worker processes) come back as the shared ones
+        return (get_move, (self.player, self.shape, self.x, self.y))
 
     def __eq__(self, other):
-        return (
+        return self is other or (
             isinstance(other, Move)
             and self.player == other.player
             and self.shape == other.shape
@@ -72,20 +112,57 @@ class Move:
             and self.y == other.y
         )
 
+    def __hash__(self):
+        return self._hash
+
+    # short text form like "w1-1" (shape letter, x, y), used by game records
+    # and saved positions. the player isn't included since it's always
+    # whoever's turn it is
+    def to_token(self) -> str:
+        return f"{self.shape.letter}{self.x}{self.y}"
+
+    @classmethod
+    def from_token(cls, player: Color, token: str) -> Self:
+        return get_move(player, Shape.from_letter(token[0]), int(token[1]), int(token[2:]))
+
     def __repr__(self):
         return f"<moving the {self.player.value} {self.shape.value} to ({self.x}, {self.y})>"
 
 
 class Piece:
+    __slots__ = ("x", "y", "shape", "height", "color", "_hash")
+
     def __init__(self, shape: Shape, x_pos: int, y_pos: int, height: int, color: Color):
-        self.x = x_pos
-        self.y = y_pos
-        self.shape = shape
+        object.__setattr__(self, "x", x_pos)
+        object.__setattr__(self, "y", y_pos)
+        object.__setattr__(self, "shape", shape)
         # note: height starts at 1, because it's easier to
         # think of an empty square as having height 0
-        self.height = height
+        object.__setattr__(self, "height", height)
+        object.__setattr__(self, "color", color)
+        object.__setattr__(self, "_hash", hash((color, shape, x_pos, y_pos, height)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"can't change a Piece's {name}")
 
-        self.color = color
+    def __delattr__(self, name):
+        raise AttributeError(f"can't change a Piece's {name}")
+
+    def __reduce__(self):
+        return (Piece, (self.shape, self.x, self.y, self.height, self.color))
+
+    def __eq__(self, other):
+        return self is other or (
+            isinstance(other, Piece)
+            and self.color == other.color
+            and self.shape == other.shape
+            and self.x == other.x
+            and self.y == other.y
+            and self.height == other.height
+        )
+
+    def __hash__(self):
+        return self._hash
 
     def __repr__(self):
         return f"<{self.color.value} {self.shape.value} at ({self.x}, {self.y}) with height {self.height}>"
@@ -95,24 +172,421 @@ class Piece:
         return self.shape.icon
 
 
+# pieces are stored by index: white's shapes are 0-4 and black's are 5-9,
+# both in the same order as the Shape enum
+COLORS = (Color.WHITE, Color.BLACK)
+SHAPES = tuple(Shape)
+SHAPE_INDEX = {shape: i for (i, shape) in enumerate(SHAPES)}
+COLOR_INDEX = {color: i for (i, color) in enumerate(COLORS)}
+PIECE_COUNT = len(COLORS) * len(SHAPES)
+
+# squares also include the row just off each side of the board (y == -1 and
+# y == HEIGHT) so an escaped piece still has somewhere to live
+SQUARE_COUNT = (HEIGHT + 2) * WIDTH
+
+
+def square_of(x: int, y: int) -> int:
+    return (y + 1) * WIDTH + x
+
+
+def _make_destinations(color: Color) -> tuple[tuple[tuple[int, int], ...], ...]:
+    # have to only let players move off the board on the other side
+    range_offset = 0 if color == Color.WHITE else -1
+    y_range = range(0 + range_offset, HEIGHT + 1 + range_offset)
+    ret = [() for _ in range(SQUARE_COUNT)]
+    for y in range(HEIGHT):
+        for x in range(WIDTH):
+            ret[square_of(x, y)] = tuple(
+                (final_x, final_y)
+                for (dir_x, dir_y) in [(-1, 0), (1, 0), (0, -1), (0, 1)]
+                if (final_x := x + dir_x) in range(WIDTH)
+                and (final_y := y + dir_y) in y_range
+            )
+    return tuple(ret)
+
+
+# DESTINATIONS[color index][square] is every (x, y) a piece on that square can move to
+DESTINATIONS = tuple(_make_destinations(color) for color in COLORS)
+
+# every move there could ever be, made once up front so move generation
+# never has to allocate. a move's code is its piece index times
+# SQUARE_COUNT plus the square it lands on (see move_code), and
+# MOVE_TABLE[code] is the Move itself (None for squares that piece can never
+# reach in one step)
+MOVE_TABLE: tuple[Move | None, ...] = tuple(
+    Move(COLORS[index // len(SHAPES)], SHAPES[index % len(SHAPES)], x, y)
+    if any((x, y) in destinations for destinations in DESTINATIONS[index // len(SHAPES)])
+    else None
+    for index in range(PIECE_COUNT)
+    for square in range(SQUARE_COUNT)
+    for (x, y) in [(square % WIDTH, square // WIDTH - 1)]
+)
+
+
+# (player, shape, x, y) -> the Move in MOVE_TABLE
+_MOVES = {(move.player, move.shape, move.x, move.y): move for move in MOVE_TABLE if move is not None}
+
+
+def get_move(player: Color, shape: Shape, x: int, y: int) -> Move:
+    # the shared Move for these, if it's one that can happen at all. anything
+    # else (say, a bot asking for a square nothing can reach) gets a new one,
+    # which the rules will turn down
+    return _MOVES.get((player, shape, x, y)) or Move(player, shape, x, y)
+
+
+def move_code(move: Move) -> int:
+    index = COLOR_INDEX[move.player] * len(SHAPES) + SHAPE_INDEX[move.shape]
+    return index * SQUARE_COUNT + (move.y + 1) * WIDTH + move.x
+
+
+# PIECE_MOVES[piece index][square] is every move that piece has from square,
+# in the same order as DESTINATIONS
+PIECE_MOVES: tuple[tuple[tuple[Move, ...], ...], ...] = tuple(
+    tuple(
+        tuple(
+            MOVE_TABLE[index * SQUARE_COUNT + square_of(x, y)]
+            for (x, y) in DESTINATIONS[index // len(SHAPES)][square]
+        )
+        for square in range(SQUARE_COUNT)
+    )
+    for index in range(PIECE_COUNT)
+)
+
+# every piece there could ever be, by piece index, square and height (see piece_code)
+PIECE_TABLE: tuple[Piece, ...] = tuple(
+    Piece(SHAPES[index % len(SHAPES)], square % WIDTH, square // WIDTH - 1, height, COLORS[index // len(SHAPES)])
+    for index in range(PIECE_COUNT)
+    for square in range(SQUARE_COUNT)
+    for height in range(PIECE_COUNT + 1)
+)
+
+
+def piece_code(index: int, square: int, height: int) -> int:
+    return (index * SQUARE_COUNT + square) * (PIECE_COUNT + 1) + height
+
+
+# random keys for zobrist hashing, xor'd together to identify a position.
+# seeded so hashes are the same between runs (and processes)
+_zobrist_rng = random.Random(0x2E4E5)
+# ZOBRIST_PIECES[piece][square][height]
+ZOBRIST_PIECES = tuple(
+    tuple(
+        tuple(_zobrist_rng.getrandbits(64) for _ in range(PIECE_COUNT + 1))
+        for _ in range(SQUARE_COUNT)
+    )
+    for _ in range(PIECE_COUNT)
+)
+# ZOBRIST_TURN[player][required piece][prev piece], where shape 0 means None
+_SHAPE_OR_NONE = {None: 0} | {shape: i + 1 for (i, shape) in enumerate(SHAPES)}
+_SHAPE_FROM_NUMBER = (None, *SHAPES)
+ZOBRIST_TURN = tuple(
+    tuple(
+        tuple(_zobrist_rng.getrandbits(64) for _ in range(len(SHAPES) + 1))
+        for _ in range(len(SHAPES) + 1)
+    )
+    for _ in COLORS
+)
+
+
+# bytes in State.to_bytes(): 10 bits per piece plus 7 for whose turn it is
+POSITION_BYTES = (PIECE_COUNT * 10 + 7 + 7) // 8
+
+
+# read-only views shaped like get_full_board(), but reading straight from
+# the state instead of copying it. Piece objects are only made when asked for
+class BoardView(Mapping):
+    def __init__(self, state: "State"):
+        self._state = state
+        self._colors = {color: ColorView(state, c) for (c, color) in enumerate(COLORS)}
+
+    def __getitem__(self, color: Color) -> "ColorView":
+        return self._colors[color]
+
+    def __iter__(self) -> Iterator[Color]:
+        return iter(COLORS)
+
+    def __len__(self) -> int:
+        return len(COLORS)
+
+    # x, y and height of every piece in index order, without building Pieces
+    def flat(self) -> list[int]:
+        state = self._state
+        return [
+            value
+            for i in range(PIECE_COUNT)
+            for value in (state.xs[i], state.ys[i], state.heights[i])
+        ]
+
+    def __repr__(self):
+        return repr({color: dict(pieces) for (color, pieces) in self.items()})
+
+
+class ColorView(Mapping):
+    def __init__(self, state: "State", color_index: int):
+        self._state = state
+        self._first = color_index * len(SHAPES)
+
+    def __getitem__(self, shape: Shape) -> Piece:
+        return self._state._piece(self._first + SHAPE_INDEX[shape])
+
+    def __iter__(self) -> Iterator[Shape]:
+        return iter(SHAPES)
+
+    def __len__(self) -> int:
+        return len(SHAPES)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class State:
     def __init__(self):
         # initialize to starting board
-        white_pieces = {
-            shape: Piece(shape, i, 0, 1, Color.WHITE) for (i, shape) in enumerate(Shape)
-        }
-        black_pieces = {
-            shape: Piece(shape, (WIDTH - 1) - i, HEIGHT - 1, 1, Color.BLACK)
-            for (i, shape) in enumerate(Shape)
-        }
-        self.state = {Color.WHITE: white_pieces, Color.BLACK: black_pieces}
+        self._clear()
+        for i in range(len(SHAPES)):
+            self._place(i, i, 0)
+            self._place(len(SHAPES) + i, (WIDTH - 1) - i, HEIGHT - 1)
+
+    @classmethod
+    def from_board(
+        cls,
+        board: Mapping[Color, Mapping[Shape, Piece]],
+        next_move: tuple[Color, Shape | None],
+        prev_piece: Shape | None = None,
+    ) -> Self:
+        # rebuild a state from something shaped like get_full_board(), e.g.
+        # what a MoveGetter is handed. pieces go down lowest first so the
+        # stacks come out in the right order
+        state = cls.__new__(cls)
+        state._clear()
+        pieces = sorted(
+            (piece for colored_pieces in board.values() for piece in colored_pieces.values()),
+            key=lambda piece: piece.height,
+        )
+        for piece in pieces:
+            index = COLOR_INDEX[piece.color] * len(SHAPES) + SHAPE_INDEX[piece.shape]
+            state._place(index, piece.x, piece.y)
+            if state.heights[index] != piece.height:
+                raise ValueError(f"{piece} isn't sitting on a stack of the right height")
+        state._set_turn(next_move, prev_piece)
+        return state
+
+    def _set_turn(self, next_move: tuple[Color, Shape | None], prev_piece: Shape | None) -> None:
+        # finish setting up a position whose pieces are all placed
+        self.next_move = next_move
+        self.prev_piece = prev_piece
+        for i in range(PIECE_COUNT):
+            if self.ys[i] not in range(HEIGHT):
+                self.winner = COLORS[i // len(SHAPES)]
+        if self.winner is None and (loser := self.get_player_cant_move()) is not None:
+            self.winner = loser.other()
+
+    # positions written down without the moves that led to them. the text
+    # form is like chess's FEN: the rows from the far end of black's side
+    # (y == HEIGHT, where white's escaped pieces go) down to y == -1, split
+    # by "/", each square a piece letter (white's upper case, see
+    # Shape.letter) or a digit for that many empty squares, with stacks of
+    # more than one piece in brackets bottom first, e.g. "(Cq)". then who's
+    # moving ("w" or "b"), the piece they have to move and the piece they
+    # moved last ("-" for none). the start is
+    #   5/sqwpc/5/5/5/5/5/CPWQS/5 w - -
+    def to_text(self) -> str:
+        rows = []
+        for y in range(HEIGHT, -2, -1):
+            row = ""
+            empty = 0
+            for x in range(WIDTH):
+                stack = self.stacks[square_of(x, y)]
+                if not stack:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                letters = "".join(
+                    SHAPES[i % len(SHAPES)].letter.upper() if i < len(SHAPES) else SHAPES[i % len(SHAPES)].letter
+                    for i in stack
+                )
+                row += letters if len(stack) == 1 else f"({letters})"
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        player, piece_to_move = self.next_move
+        return " ".join(
+            (
+                "/".join(rows),
+                player.value[0],
+                piece_to_move.letter if piece_to_move is not None else "-",
+                self.prev_piece.letter if self.prev_piece is not None else "-",
+            )
+        )
+
+    @classmethod
+    def from_text(cls, text: str) -> Self:
+        try:
+            board, player, piece_to_move, prev_piece = text.split()
+            rows = board.split("/")
+            if len(rows) != HEIGHT + 2:
+                raise ValueError(f"expected {HEIGHT + 2} rows, got {len(rows)}")
+            state = cls.__new__(cls)
+            state._clear()
+            placed = set()
+            for (row, y) in zip(rows, range(HEIGHT, -2, -1)):
+                x = 0
+                i = 0
+                while i < len(row):
+                    if row[i].isdigit():
+                        x += int(row[i])
+                        i += 1
+                        continue
+                    if row[i] == "(":
+                        end = row.index(")", i)
+                        letters = row[i + 1 : end]
+                        i = end + 1
+                    else:
+                        letters = row[i]
+                        i += 1
+                    if x >= WIDTH:
+                        raise ValueError(f"row {y} is too long")
+                    for letter in letters:
+                        index = (0 if letter.isupper() else len(SHAPES)) + SHAPE_INDEX[
+                            Shape.from_letter(letter.lower())
+                        ]
+                        if index in placed:
+                            raise ValueError(f"{letter} is on the board twice")
+                        placed.add(index)
+                        state._place(index, x, y)
+                    x += 1
+                if x != WIDTH:
+                    raise ValueError(f"row {y} should be {WIDTH} squares, not {x}")
+            if len(placed) != PIECE_COUNT:
+                raise ValueError(f"expected {PIECE_COUNT} pieces, got {len(placed)}")
+            player = {color.value[0]: color for color in COLORS}[player]
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"{text!r} isn't a position: {e}") from None
+        state._set_turn(
+            (player, Shape.from_letter(piece_to_move) if piece_to_move != "-" else None),
+            Shape.from_letter(prev_piece) if prev_piece != "-" else None,
+        )
+        return state
+
+    # the binary form is always POSITION_BYTES long: a little-endian number
+    # with 6 bits of square and 4 of height for each piece (by index), then
+    # 1 bit for who's moving and 3 each for the piece they have to move and
+    # the one moved last (0 for none, otherwise 1 + its index in SHAPES)
+    def to_bytes(self) -> bytes:
+        player, piece_to_move = self.next_move
+        packed = (
+            (_SHAPE_OR_NONE[self.prev_piece] << 4)
+            | (_SHAPE_OR_NONE[piece_to_move] << 1)
+            | COLOR_INDEX[player]
+        )
+        for i in range(PIECE_COUNT - 1, -1, -1):
+            packed = (packed << 10) | (square_of(self.xs[i], self.ys[i]) << 4) | self.heights[i]
+        return packed.to_bytes(POSITION_BYTES, "little")
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Self:
+        if len(data) != POSITION_BYTES:
+            raise ValueError(f"a position is {POSITION_BYTES} bytes, not {len(data)}")
+        packed = int.from_bytes(data, "little")
+        pieces = []
+        for i in range(PIECE_COUNT):
+            pieces.append((packed & 0xF, packed >> 4 & 0x3F, i))
+            packed >>= 10
+        state = cls.__new__(cls)
+        state._clear()
+        # lowest first, so the stacks come out in the right order
+        for (height, square, i) in sorted(pieces):
+            if square >= SQUARE_COUNT:
+                raise ValueError(f"piece {i} is on square {square}, which doesn't exist")
+            state._place(i, square % WIDTH, square // WIDTH - 1)
+            if state.heights[i] != height:
+                raise ValueError(f"piece {i} isn't sitting on a stack of the right height")
+        piece_to_move = packed >> 1 & 0x7
+        prev_piece = packed >> 4 & 0x7
+        if piece_to_move >= len(_SHAPE_FROM_NUMBER) or prev_piece >= len(_SHAPE_FROM_NUMBER):
+            raise ValueError(f"shapes are numbered 0 to {len(SHAPES)}, not {piece_to_move} and {prev_piece}")
+        # whoever's responding is responding to the piece that was moved last
+        if piece_to_move != 0 and prev_piece == 0:
+            raise ValueError("the player to move is responding, but no piece was moved last")
+        if packed >> 7:
+            raise ValueError("bits past the end of the position are set")
+        state._set_turn(
+            (COLORS[packed & 1], _SHAPE_FROM_NUMBER[piece_to_move]),
+            _SHAPE_FROM_NUMBER[prev_piece],
+        )
+        return state
+
+    def _clear(self) -> None:
+        # everything lives in flat lists indexed by piece, plus a stack of
+        # piece indices per square (bottom first) so "who's on top" is just stack[-1]
+        self.xs = [0] * PIECE_COUNT
+        self.ys = [0] * PIECE_COUNT
+        self.heights = [1] * PIECE_COUNT
+        self.stacks: list[list[int]] = [[] for _ in range(SQUARE_COUNT)]
+        # per color (by index into COLORS): how many pieces aren't buried, and
+        # how many destinations those pieces have between them. kept up to
+        # date by _place/_lift so we never have to regenerate moves just to
+        # find out whether someone is stuck
+        self.unburied = [0, 0]
+        self.destination_counts = [0, 0]
+        # zobrist hash of just the pieces; see get_zobrist for the rest
+        self.pieces_hash = 0
         # specifies next valid move; first element is who goes next,
         # second is what piece they need to move as a string (or None)
         self.next_move = (Color.WHITE, None)
         self.prev_piece = None  # so we can't double-move
         self.winner = None
+        # the player who lost by running out of time or breaking, if anyone
+        self.forfeited = None
         # not currently used but it's nice to have when needed
         self.logged_moves = []
+        # how many times try_move had to skip a turn, by kind (see _make_move)
+        self.skips = {"response": 0, "free": 0, "deadlock": 0}
+        # one record per applied move, popped by unmake_move
+        self._undo = []
+        # the last get_valid_moves result and the get_zobrist it was for
+        self._moves_key = None
+        self._moves: list[Move] = []
+        self._view: BoardView | None = None
+
+    def _place(self, index: int, x: int, y: int) -> None:
+        square = (y + 1) * WIDTH + x
+        stack = self.stacks[square]
+        if stack:
+            # whatever was on top is now buried
+            self._count(stack[-1], square, -1)
+        stack.append(index)
+        self._count(index, square, 1)
+        self.xs[index] = x
+        self.ys[index] = y
+        self.heights[index] = len(stack)
+        self.pieces_hash ^= ZOBRIST_PIECES[index][square][len(stack)]
+
+    # take a piece off the top of its stack (the opposite of _place)
+    def _lift(self, index: int) -> None:
+        square = (self.ys[index] + 1) * WIDTH + self.xs[index]
+        stack = self.stacks[square]
+        self.pieces_hash ^= ZOBRIST_PIECES[index][square][len(stack)]
+        stack.pop()
+        self._count(index, square, -1)
+        if stack:
+            # whatever was under it can move again
+            self._count(stack[-1], square, 1)
+
+    def _count(self, index: int, square: int, sign: int) -> None:
+        c = index // len(SHAPES)
+        self.unburied[c] += sign
+        self.destination_counts[c] += sign * len(DESTINATIONS[c][square])
+
+    def _piece(self, index: int) -> Piece:
+        return PIECE_TABLE[
+            piece_code(index, (self.ys[index] + 1) * WIDTH + self.xs[index], self.heights[index])
+        ]
+
+    def is_buried(self, color: Color, shape: Shape) -> bool:
+        return not self._on_top(COLOR_INDEX[color] * len(SHAPES) + SHAPE_INDEX[shape])
 
     def get_next_move_new(self) -> tuple[Color, bool, Piece | None]:
         player, req_piece = self.next_move
@@ -124,29 +598,26 @@ class State:
             prev = self.prev_piece
         return player, responding, prev
 
-    def draw_board(self) -> None:
-        all_pieces = list(self.state[Color.WHITE].values()) + list(
-            self.state[Color.BLACK].values()
+    def draw_cell(self, square: int) -> str:
+        # what the board shows on a square: the top piece in its color, with
+        # the stack's height next to it if there's more than one piece
+        stack = self.stacks[square]
+        if not stack:
+            return "  "
+        top = stack[-1]
+        height = len(stack)
+        return (
+            COLORS[top // len(SHAPES)].ansi
+            + SHAPES[top % len(SHAPES)].icon
+            + RESET_ANSI_CODE
+            + (chr(0x2080 + height) if height > 1 else " ")
         )
+
+    def board_text(self) -> str:
         # marginally faster than reversed(range(WIDTH)) even though Range.__reversed__ is special-cased in C
         lines = []
         for y in range(HEIGHT - 1, -1, -1):
-            row = ["  " for _ in range(5)]
-            for x in range(WIDTH):
-                pieces_at_pos = list(
-                    filter(lambda piece: piece.x == x and piece.y == y, all_pieces)
-                )
-                if len(pieces_at_pos) == 0:
-                    continue
-                highest_piece = max(pieces_at_pos, key=lambda piece: piece.height)
-                row[x] = (
-                    highest_piece.color.ansi
-                    + highest_piece.icon
-                    + RESET_ANSI_CODE
-                    + (
-                        chr(0x2080 + highest_piece.height) if highest_piece.height > 1 else " "
-                    )
-                )
+            row = [self.draw_cell(square_of(x, y)) for x in range(WIDTH)]
             lines.append("║ " + "│ ".join(row) + "║\n")
 
         board_str = ""
@@ -157,75 +628,131 @@ class State:
         board_str += "╠═══╧═══╧═══╧═══╧═══╣\n"
         board_str += "║                   ║\n"
         board_str += "╚═══════════════════╝"
-        print(board_str)
+        return board_str
+
+    def draw_board(self) -> None:
+        # see render.py for drawing a game as it goes without redrawing everything
+        print(self.board_text())
 
     def get_who_won(self) -> Color | None:
         return self.winner
 
+    def get_zobrist(self) -> int:
+        # 64 bit hash of the position: every piece's square and height, plus
+        # whose move it is, what they have to move and what they can't
+        player, piece_to_move = self.next_move
+        return (
+            self.pieces_hash
+            ^ ZOBRIST_TURN[COLOR_INDEX[player]][_SHAPE_OR_NONE[piece_to_move]][
+                _SHAPE_OR_NONE[self.prev_piece]
+            ]
+        )
+
+    def get_position_key(self) -> int:
+        # like get_zobrist, but a prev_piece that's buried (so it can't be
+        # moved anyway) counts as None. that way a position rebuilt from
+        # what a MoveGetter is told (see bots.state_from_getter_args) gets
+        # the same key, which is what saved tables like book.py's are keyed by
+        player, piece_to_move = self.next_move
+        prev_piece = self.prev_piece
+        if piece_to_move is None and prev_piece is not None and self.is_buried(player, prev_piece):
+            prev_piece = None
+        return (
+            self.pieces_hash
+            ^ ZOBRIST_TURN[COLOR_INDEX[player]][_SHAPE_OR_NONE[piece_to_move]][_SHAPE_OR_NONE[prev_piece]]
+        )
+
     def get_next_move(self) -> tuple[Color, Piece | None]:
         return self.next_move
 
     def get_full_board(self) -> dict[Color, dict[Shape, Piece]]:
-        return deepcopy(self.state)  # copy so they can't modify it
+        # built fresh every time, so they can't modify our copy (the Pieces
+        # themselves can't be changed, so they're the shared ones)
+        return {
+            color: {
+                shape: self._piece(c * len(SHAPES) + s) for (s, shape) in enumerate(SHAPES)
+            }
+            for (c, color) in enumerate(COLORS)
+        }
+
+    def get_board_view(self) -> BoardView:
+        # cheaper than get_full_board, but it changes along with the game.
+        # since it's live, the same one does for the whole game
+        if self._view is None:
+            self._view = BoardView(self)
+        return self._view
 
     def get_valid_moves(self) -> list[Move]:
-        # return list of valid moves, taking into account self.next_move
+        # return list of valid moves, taking into account self.next_move.
+        # the moves are the shared ones from MOVE_TABLE, and the last list
+        # made is kept until the position changes, since the referee and
+        # the bot usually both ask for the same one
+        key = self.get_zobrist()
+        if key != self._moves_key:
+            self._moves = self._generate_moves()
+            self._moves_key = key
+        return list(self._moves)
+
+    def get_valid_move_codes(self) -> list[int]:
+        # the same moves as move_code()s, for code that would rather deal in ints
+        return [move_code(move) for move in self.get_valid_moves()]
+
+    def _generate_moves(self) -> list[Move]:
         player, piece_to_move = self.next_move
-        colored_pieces = self.state[player]
+        c = COLOR_INDEX[player]
+        first = c * len(SHAPES)
 
-        # do a flat map over everything we're allowed to move
         if piece_to_move is not None:
-            pieces = [colored_pieces[piece_to_move]]
+            indices = (first + SHAPE_INDEX[piece_to_move],)
         else:
-            pieces = colored_pieces.values()
+            indices = range(first, first + len(SHAPES))
+            # make sure we can't double-move
+            if self.prev_piece is not None:
+                blocked = first + SHAPE_INDEX[self.prev_piece]
+                indices = [i for i in indices if i != blocked]
 
+        xs, ys, stacks = self.xs, self.ys, self.stacks
         ret = []
-        for moving_piece in pieces:
-            # make sure we can't double-move
-            if moving_piece.shape == self.prev_piece and piece_to_move is None:
-                continue
-            # find out if piece is under something
-            all_pieces = chain.from_iterable(
-                map(lambda y: y.values(), self.state.values())
-            )
-            under = False
-            for p in all_pieces:  # note that this includes self
-                if (p.x, p.y) == (
-                    moving_piece.x,
-                    moving_piece.y,
-                ) and p.height > moving_piece.height:
-                    under = True
-                    break
-            if under:
-                continue
-
-            # now we can move, so find all in-bounds moves and extend ret with them
-            x_range = range(5)
-            # have to only let players move off the board on the other side
-            range_offset = 0 if player == Color.WHITE else -1
-            y_range = range(0 + range_offset, 8 + range_offset)
-            # we do this cursed thing because we want to filter AFTER mapping,
-            # which normal python comprehensions don't do
-            legal_moves = (
-                Move(player, moving_piece.shape, final_x, final_y)
-                for (dir_x, dir_y) in [(-1, 0), (1, 0), (0, -1), (0, 1)]
-                if (final_x := moving_piece.x + dir_x) in x_range
-                and (final_y := moving_piece.y + dir_y) in y_range
-            )
-            ret.extend(legal_moves)
+        for i in indices:
+            square = (ys[i] + 1) * WIDTH + xs[i]
+            # pieces that are under something can't move
+            if stacks[square][-1] == i:
+                ret += PIECE_MOVES[i][square]
         return ret
 
+    def _on_top(self, index: int) -> bool:
+        return self.stacks[(self.ys[index] + 1) * WIDTH + self.xs[index]][-1] == index
+
+    def _can_move(self, player: Color, piece_to_move: Shape | None, prev_piece: Shape | None) -> bool:
+        # same rules as get_valid_moves, but without building the list. every
+        # square on the board has somewhere to go, so "not buried" is enough
+        c = COLOR_INDEX[player]
+        first = c * len(SHAPES)
+        if piece_to_move is not None:
+            return self._on_top(first + SHAPE_INDEX[piece_to_move])
+        movable = self.unburied[c]
+        if prev_piece is not None and self._on_top(first + SHAPE_INDEX[prev_piece]):
+            movable -= 1
+        return movable > 0
+
+    def _is_valid_move(self, move: Move) -> bool:
+        player, piece_to_move = self.next_move
+        if move.player != player:
+            return False
+        if piece_to_move is not None:
+            if move.shape != piece_to_move:
+                return False
+        elif move.shape == self.prev_piece:
+            return False
+        c = COLOR_INDEX[player]
+        index = c * len(SHAPES) + SHAPE_INDEX[move.shape]
+        square = (self.ys[index] + 1) * WIDTH + self.xs[index]
+        return self.stacks[square][-1] == index and (move.x, move.y) in DESTINATIONS[c][square]
+
     def get_player_cant_move(self) -> Color | None:
-        # horrendous and cursed, avert ye eyes
-        for player in Color:
-            old_next = self.next_move
-            old_prev = self.prev_piece
-            self.next_move = (player, None)
-            self.prev_piece = None
-            if self.get_valid_moves() == []:
+        for (c, player) in enumerate(COLORS):
+            if self.unburied[c] == 0:
                 return player
-            self.next_move = old_next
-            self.prev_piece = old_prev
         return None
 
     def _try_move(self, move: Move) -> tuple[MoveResult, str]:
@@ -235,33 +762,52 @@ class State:
                 f"Game has already finished! Team {self.winner} won",
             )
 
-        if move not in self.get_valid_moves():
+        if not self._is_valid_move(move):
             return (MoveResult.MOVE_FAILURE, "not a valid move!")
 
+        result = self._make_move(move, log=True)
+        if result == MoveResult.MOVE_SUCCESS:
+            # if nothing else triggers, we return boring success
+            return (result, "")
+        if move.y not in range(HEIGHT):
+            return (result, f"team {self.winner} has won by moving a piece off the board!")
+        return (result, f"Team {self.winner} has won by blocking the other team from moving!")
+
+    # apply a move in place and remember how to take it back with unmake_move.
+    # unlike try_move this doesn't check that the move is valid or that the
+    # game is still going, and doesn't log anything, so it's meant for search
+    # code that got its moves straight from get_valid_moves
+    def make_move(self, move: Move) -> MoveResult:
+        return self._make_move(move, log=False)
+
+    # undo the most recent make_move (or try_move that went through)
+    def unmake_move(self) -> None:
+        index, old_x, old_y, next_move, prev_piece, winner = self._undo.pop()
+        self._lift(index)
+        self._place(index, old_x, old_y)
+        self.next_move = next_move
+        self.prev_piece = prev_piece
+        self.winner = winner
+
+    def _make_move(self, move: Move, log: bool) -> MoveResult:
         player = move.player
         shape = move.shape
-        x = move.x
-        y = move.y
-        piece = self.state[player][shape]
-        piece.x = x
-        piece.y = y
-        # add 1 to final height for each other piece that's in the new position
-        # (including self because a piece being "unstacked" is treated as height 1)
-        # mwahahahaha I love iterators
-        piece.height = reduce(
-            lambda acc, new: acc + 1 if (new.x, new.y) == (piece.x, piece.y) else acc,
-            chain.from_iterable(map(lambda y: y.values(), self.state.values())),
-            0,
+        index = COLOR_INDEX[player] * len(SHAPES) + SHAPE_INDEX[shape]
+        # the old height doesn't need saving: putting the piece back on top
+        # of its old stack gives it the same height again
+        self._undo.append(
+            (index, self.xs[index], self.ys[index], self.next_move, self.prev_piece, self.winner)
         )
+        # only the top piece of a stack can move, so it's always the one we pop.
+        # the new height is just how tall the destination stack ends up
+        self._lift(index)
+        self._place(index, move.x, move.y)
 
-        if piece.y not in range(HEIGHT):
+        if move.y not in range(HEIGHT):
             # escaped board! we assume it's a valid escape (not backwards or
             # sideways) because we only allow valid moves to get this far
             self.winner = player
-            return (
-                MoveResult.win_for_player(self.winner),
-                f"team {self.winner} has won by moving a piece off the board!",
-            )
+            return MoveResult.win_for_player(player)
 
         # increment move tracker
         self.prev_piece = shape
@@ -275,22 +821,44 @@ class State:
         # check if someone loses by not moving
         if (loser := self.get_player_cant_move()) is not None:
             self.winner = loser.other()
-            return (
-                MoveResult.win_for_player(self.winner),
-                f"Team {self.winner} has won by blocking the other team from moving!",
-            )
+            return MoveResult.win_for_player(self.winner)
 
         # continue until someone can move
-        while self.get_valid_moves() == []:
+        skipped = 0
+        while not self._can_move(self.next_move[0], self.next_move[1], self.prev_piece):
             if self.next_move[1] is not None:
-                print(f"LOG: skipping response move of {self.next_move[0]}")
+                if log:
+                    logger.info(f"LOG: skipping response move of {self.next_move[0]}")
+                    self.skips["response"] += 1
                 self.next_move = (self.next_move[0], None)
             else:
-                print(f"LOG: skipping free move (and response) of {self.next_move[0]}")
+                if log:
+                    logger.info(f"LOG: skipping free move (and response) of {self.next_move[0]}")
+                    self.skips["free"] += 1
                 self.next_move = (self.next_move[0].other(), None)
-
-        # if nothing else triggers, we return boring success
-        return (MoveResult.MOVE_SUCCESS, "")
+                skipped += 1
+                if skipped == len(COLORS):
+                    # both players' only unburied piece has the shape that was
+                    # just moved, so skipping would go round forever. this is
+                    # a rule of our own (see the README): the restriction is
+                    # lifted and the player whose turn it is moves it after all
+                    self.prev_piece = None
+                    if log:
+                        self.skips["deadlock"] += 1
+
+        return MoveResult.MOVE_SUCCESS
+
+    # end the game with `player` losing without making a move, e.g. because
+    # their bot ran out of time. can't be undone with unmake_move
+    def forfeit(self, player: Color) -> tuple[MoveResult, str]:
+        if self.winner is not None:
+            return (
+                MoveResult.ALREADY_OVER,
+                f"Game has already finished! Team {self.winner} won",
+            )
+        self.winner = player.other()
+        self.forfeited = player
+        return (MoveResult.win_for_player(self.winner), f"team {player} forfeits, team {self.winner} wins!")
 
     # simple logging wrapper
     def try_move(self, move: Move) -> tuple[MoveResult, str]:
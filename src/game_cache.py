@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+from bots import BUILTIN_PREFIX, NONDETERMINISTIC_BOTS
+from records import RECORD_FIELDS, GameRecord
+
+# records of seeded games, so a run that asks for a game that's already
+# been played with the same bots and seed gets the old record instead of
+# playing it again. a game is identified by a hash of the bots' contents,
+# the seed and any opening books or tablebases, so changing a bot (or the
+# referee, for built-in bots) means its games get played again. only games
+# that finished normally are kept: crashes and forfeits depend on timing
+# rather than the seed, and so do games with a bot that can't promise to
+# play the same way twice (see bots.NONDETERMINISTIC_BOTS). the file is json
+# lines, one record per line plus its "key"
+
+# everything a built-in bot's moves can depend on
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_hashes: dict[str, str | None] = {}
+
+
+def _file_hash(path: str, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 16):
+            digest.update(chunk)
+    return digest
+
+
+def bot_hash(spec: str) -> str | None:
+    # None for bots we can't tell have changed or that don't play the same
+    # way every time, which are never cached
+    if spec not in _hashes:
+        if spec.startswith(BUILTIN_PREFIX):
+            name, *args = spec.removeprefix(BUILTIN_PREFIX).split(":")
+            if name in NONDETERMINISTIC_BOTS:
+                _hashes[spec] = None
+                return None
+            digest = hashlib.sha256(spec.encode())
+            for source in sorted(os.listdir(SOURCE_DIR)):
+                if source.endswith(".py"):
+                    _file_hash(os.path.join(SOURCE_DIR, source), digest)
+            # and whatever files it was given, like builtin:learned's model
+            for arg in args:
+                if os.path.isfile(arg):
+                    _file_hash(arg, digest)
+            _hashes[spec] = digest.hexdigest()
+        elif os.path.isfile(spec):
+            _hashes[spec] = _file_hash(spec).hexdigest()
+        else:
+            _hashes[spec] = None
+    return _hashes[spec]
+
+
+class GameCache:
+    def __init__(self, path: str, tables: list[str] = ()):
+        self.path = path
+        self.tables = [_file_hash(table).hexdigest() for table in tables]
+        self.records: dict[str, GameRecord] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[record["key"]] = record
+        self.file = open(path, "a")
+        self.hits = 0
+
+    def key(self, white: str, black: str, seed: int | None) -> str | None:
+        if seed is None or (white_hash := bot_hash(white)) is None or (black_hash := bot_hash(black)) is None:
+            return None
+        return hashlib.sha256(json.dumps([white_hash, black_hash, seed, self.tables]).encode()).hexdigest()
+
+    def get(self, white: str, black: str, seed: int | None) -> GameRecord | None:
+        if (key := self.key(white, black, seed)) is None or key not in self.records:
+            return None
+        self.hits += 1
+        # the names might not be the same as last time (e.g. a bot that moved)
+        return {field: value for (field, value) in self.records[key].items() if field in RECORD_FIELDS} | {
+            "white": white,
+            "black": black,
+        }
+
+    def put(self, record: GameRecord) -> None:
+        if record["error"] is not None or record["forfeit"] is not None:
+            return
+        if (key := self.key(record["white"], record["black"], record["seed"])) is None:
+            return
+        record = {field: record.get(field) for field in RECORD_FIELDS} | {"key": key}
+        self.records[key] = record
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from bots import can_escape, progress, state_from_getter_args
+from core import COLOR_INDEX, HEIGHT, PIECE_COUNT, SHAPES, SQUARE_COUNT, WIDTH, Move, State
+from play_game import MoveGetter
+
+# a learned evaluation: self-play games are cut up into (position, did the
+# player to move go on to win) samples, saved in shards of numpy arrays,
+# and a logistic regression or small neural net is trained on them to give
+# the chance the player to move wins from a position. builtin:learned:<FILE>
+# plays whichever move its model likes best, scoring all of them in one go.
+# numpy is only needed for this (and batch_sim.py)
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("learn.py needs numpy (pip install numpy)")
+
+DEFAULT_MODEL = "model.npz"
+
+# positions are saved compactly as RAW_SIZE small ints and only turned into
+# features when they're used, so shards stay small:
+#   0-9:   each piece's square, in index order (see core.State)
+#   10-19: whether each piece is on top of its stack
+#   20:    the player to move (0 white, 1 black)
+#   21:    whether they're responding
+#   22:    whether they can escape right away (see bots.can_escape)
+#   23-24: unburied pieces per color
+#   25-26: moves available per color, counting each unburied piece's squares
+RAW_SIZE = 27
+BOARD_SQUARES = WIDTH * HEIGHT
+
+# features are from the point of view of the player to move: their pieces
+# first, and black sees the board turned around so both move "up". each
+# side's pieces are counted on every square, separately for the ones on
+# top and the buried ones, followed by the numbers at the end of the raw
+# position scaled down to around 1
+FEATURE_COUNT = 4 * BOARD_SQUARES + 6
+
+# ROTATED[square] is the same square seen from the other side of the board
+ROTATED = np.array(
+    [(SQUARE_COUNT - 1) - square for square in range(SQUARE_COUNT)],
+    dtype=np.int64,
+)
+# piece indices with each color's own first
+PIECE_ORDER = np.array(
+    [list(range(PIECE_COUNT)), [(i + len(SHAPES)) % PIECE_COUNT for i in range(PIECE_COUNT)]],
+    dtype=np.int64,
+)
+
+
+def encode(state: State) -> list[int]:
+    mover, required = state.next_move
+    return [
+        *((state.ys[i] + 1) * WIDTH + state.xs[i] for i in range(PIECE_COUNT)),
+        *(int(state.stacks[(state.ys[i] + 1) * WIDTH + state.xs[i]][-1] == i) for i in range(PIECE_COUNT)),
+        COLOR_INDEX[mover],
+        int(required is not None),
+        int(can_escape(state)),
+        *state.unburied,
+        *state.destination_counts,
+    ]
+
+
+def features(raw: np.ndarray) -> np.ndarray:
+    # (n, RAW_SIZE) raw positions -> (n, FEATURE_COUNT) float32 features
+    n = len(raw)
+    mover = raw[:, 20].astype(np.int64)
+    order = PIECE_ORDER[mover]
+    squares = np.take_along_axis(raw[:, :10].astype(np.int64), order, 1)
+    squares = np.where(mover[:, None] == 1, ROTATED[squares], squares)
+    on_top = np.take_along_axis(raw[:, 10:20].astype(np.int64), order, 1)
+    side = np.arange(PIECE_COUNT) // len(SHAPES)
+    # escaped pieces only turn up in finished games, which aren't saved
+    board = np.clip(squares - WIDTH, 0, BOARD_SQUARES - 1)
+    columns = ((side * 2 + (1 - on_top)) * BOARD_SQUARES) + board
+    flat = (np.arange(n)[:, None] * FEATURE_COUNT + columns).ravel()
+    x = np.bincount(flat, minlength=n * FEATURE_COUNT).reshape(n, FEATURE_COUNT).astype(np.float32)
+
+    # the per-color numbers, the mover's first
+    mine, theirs = mover, 1 - mover
+    rows = np.arange(n)
+    x[:, -6] = raw[:, 21]
+    x[:, -5] = raw[:, 22]
+    x[:, -4] = raw[rows, 23 + mine] / len(SHAPES)
+    x[:, -3] = raw[rows, 23 + theirs] / len(SHAPES)
+    x[:, -2] = raw[rows, 25 + mine] / (4 * len(SHAPES))
+    x[:, -1] = raw[rows, 25 + theirs] / (4 * len(SHAPES))
+    return x
+
+
+class Evaluator:
+    # the chance the player to move wins, as logistic regression on the
+    # features (hidden == 0) or with one layer of hidden relu units first
+    def __init__(self, weights: dict[str, np.ndarray]):
+        self.weights = weights
+
+    @classmethod
+    def new(cls, hidden: int = 0, seed: int | None = None):
+        rng = np.random.default_rng(seed)
+        inputs = FEATURE_COUNT
+        weights = {}
+        if hidden:
+            weights["w1"] = (rng.standard_normal((FEATURE_COUNT, hidden)) * math.sqrt(2 / FEATURE_COUNT)).astype(np.float32)
+            weights["b1"] = np.zeros(hidden, dtype=np.float32)
+            inputs = hidden
+        weights["w2"] = np.zeros(inputs, dtype=np.float32)
+        weights["b2"] = np.zeros(1, dtype=np.float32)
+        return cls(weights)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+    def save(self, path: str) -> None:
+        np.savez(path, **self.weights)
+
+    @property
+    def hidden(self) -> int:
+        return len(self.weights["b1"]) if "b1" in self.weights else 0
+
+    def _forward(self, x: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # (logits, what goes into the last layer)
+        h = x
+        if "w1" in self.weights:
+            h = np.maximum(x @ self.weights["w1"] + self.weights["b1"], 0)
+        return h @ self.weights["w2"] + self.weights["b2"], h
+
+    def predict(self, raw: np.ndarray) -> np.ndarray:
+        logits, _ = self._forward(features(raw))
+        return 1 / (1 + np.exp(-logits))
+
+    def gradients(self, x: np.ndarray, y: np.ndarray) -> tuple[float, dict[str, np.ndarray]]:
+        # mean log loss over the batch and its gradient for every weight
+        logits, h = self._forward(x)
+        p = 1 / (1 + np.exp(-logits))
+        loss = float(np.mean(np.logaddexp(0, logits) - y * logits))
+        error = (p - y) / len(y)
+        grads = {"w2": h.T @ error, "b2": np.array([error.sum()], dtype=np.float32)}
+        if "w1" in self.weights:
+            back = np.outer(error, self.weights["w2"]) * (h > 0)
+            grads["w1"] = x.T @ back
+            grads["b1"] = back.sum(axis=0)
+        return loss, grads
+
+
+def score_moves(state: State, evaluator: Evaluator) -> tuple[list[Move], list[float]]:
+    # every valid move and the chance it leaves the player to move winning,
+    # with all the positions they lead to evaluated in one batch
+    player = state.next_move[0]
+    moves = state.get_valid_moves()
+    scores = [0.0] * len(moves)
+    raws = []
+    # (index into moves, whether the same player moves next)
+    waiting = []
+    for (i, move) in enumerate(moves):
+        state.make_move(move)
+        if state.winner is not None:
+            scores[i] = 1.0 if state.winner == player else 0.0
+        else:
+            raws.append(encode(state))
+            waiting.append((i, state.next_move[0] == player))
+        state.unmake_move()
+    if raws:
+        for ((i, same), p) in zip(waiting, evaluator.predict(np.array(raws, dtype=np.int8))):
+            scores[i] = float(p) if same else 1 - float(p)
+    return moves, scores
+
+
+def learned_bot(path: str = DEFAULT_MODEL) -> MoveGetter:
+    # builtin:learned[:<model file>]
+    evaluator = Evaluator.load(path)
+
+    def f(player, board, valid, responding, prev, required_move) -> Move:
+        state = state_from_getter_args(player, board, valid, responding, prev, required_move)
+        moves, scores = score_moves(state, evaluator)
+        return moves[scores.index(max(scores))]
+
+    return f
+
+
+def selfplay_game(rng: random.Random, epsilon: float, evaluator: Evaluator | None) -> tuple[list[list[int]], list[int]]:
+    # the raw positions of one game and whether the player to move in each
+    # went on to win. moves are random epsilon of the time, otherwise the
+    # evaluator's favourite, or without one the furthest forward (like
+    # builtin:greedy)
+    state = State()
+    raws = []
+    movers = []
+    while state.winner is None:
+        raws.append(encode(state))
+        player = state.next_move[0]
+        movers.append(player)
+        if rng.random() < epsilon:
+            move = rng.choice(state.get_valid_moves())
+        elif evaluator is not None:
+            moves, scores = score_moves(state, evaluator)
+            best = max(scores)
+            move = rng.choice([move for (move, score) in zip(moves, scores) if score == best])
+        else:
+            valid = state.get_valid_moves()
+            furthest = max(progress(player, move.y) for move in valid)
+            move = rng.choice([move for move in valid if progress(player, move.y) == furthest])
+        state.make_move(move)
+    return raws, [int(mover == state.winner) for mover in movers]
+
+
+def shard_paths(directory: str, index: int) -> tuple[str, str]:
+    return (
+        os.path.join(directory, f"shard-{index:05d}-positions.npy"),
+        os.path.join(directory, f"shard-{index:05d}-outcomes.npy"),
+    )
+
+
+def selfplay_shard(
+    directory: str, index: int, size: int, seed: int, epsilon: float, model: str | None
+) -> tuple[int, int]:
+    # fill shard number index with size positions, straight into
+    # memory-mapped .npy files. returns (positions, games)
+    rng = random.Random(seed)
+    evaluator = Evaluator.load(model) if model else None
+    positions_path, outcomes_path = shard_paths(directory, index)
+    positions = np.lib.format.open_memmap(positions_path + ".tmp", mode="w+", dtype=np.int8, shape=(size, RAW_SIZE))
+    outcomes = np.lib.format.open_memmap(outcomes_path + ".tmp", mode="w+", dtype=np.int8, shape=(size,))
+    filled = 0
+    games = 0
+    while filled < size:
+        raws, won = selfplay_game(rng, epsilon, evaluator)
+        games += 1
+        count = min(len(raws), size - filled)
+        positions[filled : filled + count] = raws[:count]
+        outcomes[filled : filled + count] = won[:count]
+        filled += count
+    positions.flush()
+    outcomes.flush()
+    del positions, outcomes
+    # only whole shards ever have the final names
+    os.replace(positions_path + ".tmp", positions_path)
+    os.replace(outcomes_path + ".tmp", outcomes_path)
+    return size, games
+
+
+def selfplay(
+    directory: str,
+    positions: int,
+    shard_size: int = 100_000,
+    jobs: int = 1,
+    seed: int = 0,
+    epsilon: float = 0.2,
+    model: str | None = None,
+) -> None:
+    # shards are numbered after the ones already in directory, so more
+    # self-play adds to what's there
+    os.makedirs(directory, exist_ok=True)
+    first = len(find_shards(directory))
+    sizes = [min(shard_size, positions - start) for start in range(0, positions, shard_size)]
+    work = [(directory, first + i, size, seed + first + i, epsilon, model) for (i, size) in enumerate(sizes)]
+    start = time.perf_counter()
+    if jobs <= 1:
+        results = [selfplay_shard(*shard) for shard in work]
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(selfplay_shard, *zip(*work)))
+    elapsed = time.perf_counter() - start
+    total = sum(n for (n, _) in results)
+    games = sum(g for (_, g) in results)
+    print(f"{total} positions from {games} games in {len(work)} shards, {total / elapsed:,.0f} positions/s")
+
+
+def find_shards(directory: str) -> list[tuple[str, str]]:
+    return [
+        (path, path.replace("-positions.npy", "-outcomes.npy"))
+        for path in sorted(glob.glob(os.path.join(directory, "shard-*-positions.npy")))
+    ]
+
+
+def _batches(shards: list[tuple[str, str]], batch_size: int, rng: np.random.Generator):
+    # (features, outcomes) batches from shards in a random order, shuffled
+    # within each shard. only one shard's worth of rows is read at a time
+    for i in rng.permutation(len(shards)):
+        positions_path, outcomes_path = shards[i]
+        positions = np.load(positions_path, mmap_mode="r")
+        outcomes = np.load(outcomes_path, mmap_mode="r")
+        order = rng.permutation(len(outcomes))
+        for start in range(0, len(order), batch_size):
+            rows = np.sort(order[start : start + batch_size])
+            yield features(positions[rows]), outcomes[rows].astype(np.float32)
+
+
+def evaluate_on(evaluator: Evaluator, shards: list[tuple[str, str]], batch_size: int = 65536) -> tuple[float, float]:
+    # mean log loss and how often the more likely winner is the real one
+    loss_sum, correct, total = 0.0, 0, 0
+    for (positions_path, outcomes_path) in shards:
+        positions = np.load(positions_path, mmap_mode="r")
+        outcomes = np.load(outcomes_path, mmap_mode="r")
+        for start in range(0, len(outcomes), batch_size):
+            x = features(positions[start : start + batch_size])
+            y = outcomes[start : start + batch_size].astype(np.float32)
+            logits, _ = evaluator._forward(x)
+            loss_sum += float(np.sum(np.logaddexp(0, logits) - y * logits))
+            correct += int(np.sum((logits > 0) == (y > 0.5)))
+            total += len(y)
+    return loss_sum / max(total, 1), correct / max(total, 1)
+
+
+def train(
+    directory: str,
+    model: str,
+    hidden: int = 0,
+    epochs: int = 5,
+    batch_size: int = 1024,
+    learning_rate: float = 0.003,
+    weight_decay: float = 1e-5,
+    seed: int = 0,
+    init: str | None = None,
+) -> Evaluator:
+    # adam on minibatches, holding the last shard out (when there's more
+    # than one) to see how well it does on positions it hasn't seen
+    shards = find_shards(directory)
+    if not shards:
+        sys.exit(f"no shards in {directory}, make some with `learn.py selfplay {directory}`")
+    held_out = shards[-1:] if len(shards) > 1 else []
+    training = shards[:-1] if held_out else shards
+    evaluator = Evaluator.load(init) if init else Evaluator.new(hidden, seed)
+    rng = np.random.default_rng(seed)
+    moments = {name: np.zeros_like(w) for (name, w) in evaluator.weights.items()}
+    squares = {name: np.zeros_like(w) for (name, w) in evaluator.weights.items()}
+    beta1, beta2 = 0.9, 0.999
+    step = 0
+    kind = f"{evaluator.hidden} hidden units" if evaluator.hidden else "linear"
+    print(f"training a {kind} model on {len(training)} shards, {len(held_out)} held out")
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        losses = []
+        for (x, y) in _batches(training, batch_size, rng):
+            loss, grads = evaluator.gradients(x, y)
+            losses.append(loss)
+            step += 1
+            for (name, grad) in grads.items():
+                grad = grad + weight_decay * evaluator.weights[name]
+                moments[name] = beta1 * moments[name] + (1 - beta1) * grad
+                squares[name] = beta2 * squares[name] + (1 - beta2) * grad**2
+                m = moments[name] / (1 - beta1**step)
+                v = squares[name] / (1 - beta2**step)
+                evaluator.weights[name] -= (learning_rate * m / (np.sqrt(v) + 1e-8)).astype(np.float32)
+        line = f"epoch {epoch + 1}: training loss {np.mean(losses):.4f}"
+        if held_out:
+            loss, accuracy = evaluate_on(evaluator, held_out)
+            line += f", held out loss {loss:.4f} (picks the winner {accuracy:.1%} of the time)"
+        print(f"{line} [{time.perf_counter() - start:.1f}s]")
+    evaluator.save(model)
+    print(f"saved to {model}")
+    return evaluator
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train an evaluation for builtin:learned from self-play.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    selfplay_parser = commands.add_parser("selfplay", help="play games against itself and save the positions")
+    selfplay_parser.add_argument("directory")
+    train_parser = commands.add_parser("train", help="fit a model to the positions saved in a directory")
+    train_parser.add_argument("directory")
+    loop_parser = commands.add_parser(
+        "loop", help="alternate self-play with the latest model and training on everything so far"
+    )
+    loop_parser.add_argument("directory")
+    loop_parser.add_argument("--rounds", type=int, default=3)
+    for subparser in (selfplay_parser, loop_parser):
+        subparser.add_argument("--positions", type=int, default=500_000, help="positions to save (per round)")
+        subparser.add_argument("--shard-size", type=int, default=100_000, help="positions per shard")
+        subparser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="processes playing games")
+        subparser.add_argument("--epsilon", type=float, default=0.2, help="how often to play a random move")
+    selfplay_parser.add_argument("--model", help="pick moves with this model instead of like builtin:greedy")
+    for subparser in (train_parser, loop_parser):
+        subparser.add_argument("--model", default=DEFAULT_MODEL, help=f"where to save it (default: {DEFAULT_MODEL})")
+        subparser.add_argument("--hidden", type=int, default=0, help="hidden units (0 for a linear model)")
+        subparser.add_argument("--epochs", type=int, default=5)
+        subparser.add_argument("--batch-size", type=int, default=1024)
+        subparser.add_argument("--learning-rate", type=float, default=0.003)
+    train_parser.add_argument("--init", metavar="MODEL", help="start from this model rather than from scratch")
+    for subparser in (selfplay_parser, train_parser, loop_parser):
+        subparser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "selfplay":
+        selfplay(args.directory, args.positions, args.shard_size, args.jobs, args.seed, args.epsilon, args.model)
+    elif args.command == "train":
+        train(
+            args.directory,
+            args.model,
+            args.hidden,
+            args.epochs,
+            args.batch_size,
+            args.learning_rate,
+            seed=args.seed,
+            init=args.init,
+        )
+    else:
+        model = None
+        for i in range(args.rounds):
+            print(f"ROUND {i + 1}:")
+            selfplay(
+                args.directory,
+                args.positions,
+                args.shard_size,
+                args.jobs,
+                args.seed + i * 1000,
+                args.epsilon,
+                model,
+            )
+            train(
+                args.directory,
+                args.model,
+                args.hidden,
+                args.epochs,
+                args.batch_size,
+                args.learning_rate,
+                seed=args.seed + i,
+                init=model,
+            )
+            model = args.model
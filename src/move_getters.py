@@ -1,13 +1,27 @@
+import atexit
 import json
+import logging
+import os
+import queue
 import subprocess
-from core import Color, Move, Piece, Shape
-from play_game import MoveGetter
+import threading
+import time
+from collections.abc import Callable, Mapping
+from book import PositionTable
+from bots import BUILTIN_PREFIX, get_builtin, state_from_getter_args
+from core import Color, Move, Piece, Shape, get_move
+from play_game import BotError, MoveGetter
 from pprint import pp
+from wire import FORMAT_DELTA, FORMAT_JSON, FORMATS, decode_compact, decode_json, encode_compact, encode_json, flat_pieces
+
+# bot chatter goes through logging so batch runs can keep the console quiet;
+# the interactive scripts turn it on with logging.basicConfig
+logger = logging.getLogger(__name__)
 
 
 def get_from_human(
     player: Color,
-    board: dict[Color, dict[Shape, Piece]],
+    board: Mapping[Color, Mapping[Shape, Piece]],
     valid: list[Move],
     responding: bool,
     prev: Piece | None,
@@ -30,7 +44,7 @@ def get_from_human(
         in_y = input("y (e.g. 1): ")
 
         try:
-            move = Move(player, Shape(in_shape), int(in_x), int(in_y))
+            move = get_move(player, Shape(in_shape), int(in_x), int(in_y))
         except ValueError:
             print('ERROR: Invalid input type (e.g. "wave" for x)')
             continue
@@ -44,72 +58,324 @@ def get_from_human(
     return move
 
 
-def get_from_bot(bot_path: str) -> MoveGetter:
+# environment variable a bot sees when we'd like it to stay alive between moves
+PERSISTENT_ENV_VAR = "ZENER_PROTOCOL"
+PERSISTENT_PROTOCOL = "persistent"
+# lists the formats a persistent bot can pick from in its handshake (see wire.py)
+FORMATS_ENV_VAR = "ZENER_FORMATS"
+HANDSHAKE_TIMEOUT = 5.0
+
+
+# persistent bots that are running, so none of them outlive us. it's one
+# exit hook for all of them rather than one each, and close takes a bot off
+# again, so nothing's kept around once it's done with
+_running: set["BotProcess"] = set()
+
+
+@atexit.register
+def _close_running() -> None:
+    for bot in list(_running):
+        bot.close()
+
+
+def _pump(stream, lines: queue.Queue) -> None:
+    # runs in a background thread so we can wait on the bot with a timeout
+    for line in stream:
+        lines.put(line)
+    lines.put(None)
+
+
+# a bot that's launched once and then sent one line of json per move,
+# answering with one line of json each time. bots opt in by printing
+# {"protocol": "persistent"} as soon as they start when the ZENER_PROTOCOL
+# environment variable is set to "persistent"; anything else means they're
+# a normal one-shot bot. the handshake can also ask for one of the faster
+# formats in wire.py, e.g. {"protocol": "persistent", "format": "delta"}
+class BotProcess:
+    def __init__(
+        self,
+        bot_path: str,
+        move_timeout: float | None = None,
+        handshake_timeout: float = HANDSHAKE_TIMEOUT,
+        max_restarts: int = 2,
+    ):
+        self.bot_path = bot_path
+        self.move_timeout = move_timeout
+        self.handshake_timeout = handshake_timeout
+        self.max_restarts = max_restarts
+        self.proc = None
+        # seconds lost to restarts since the last take_restart_time: waiting
+        # on the attempts that failed and starting the bot again
+        self.restart_time = 0.0
+        self.format = FORMAT_JSON
+        # whether the bot hasn't been sent anything since it (re)started
+        self.fresh = True
+        self.persistent = self._start()
+
+    def _start(self) -> bool:
+        self.proc = subprocess.Popen(
+            [self.bot_path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=dict(
+                os.environ,
+                **{PERSISTENT_ENV_VAR: PERSISTENT_PROTOCOL, FORMATS_ENV_VAR: ",".join(FORMATS)},
+            ),
+            text=True,
+            bufsize=1,
+        )
+        _running.add(self)
+        self.lines = queue.Queue()
+        self.errors = queue.Queue()
+        threading.Thread(target=_pump, args=(self.proc.stdout, self.lines), daemon=True).start()
+        threading.Thread(target=_pump, args=(self.proc.stderr, self.errors), daemon=True).start()
+
+        hello = self._read_line(self.handshake_timeout)
+        try:
+            hello = json.loads(hello)
+            ok = hello["protocol"] == PERSISTENT_PROTOCOL
+            self.format = hello.get("format", FORMAT_JSON)
+        except (TypeError, ValueError, KeyError, AttributeError):
+            ok = False
+        if self.format not in FORMATS:
+            logger.warning(f"WARN: {self.bot_path} asked for unknown format {self.format!r}, sending json")
+            self.format = FORMAT_JSON
+        if not ok:
+            self.close()
+        self.fresh = True
+        return ok
+
+    def take_restart_time(self) -> float:
+        restart_time = self.restart_time
+        self.restart_time = 0.0
+        return restart_time
+
+    def _read_line(self, timeout: float | None) -> str | None:
+        try:
+            return self.lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _log_stderr(self) -> None:
+        err = []
+        while not self.errors.empty():
+            line = self.errors.get()
+            if line is not None:
+                err.append(line)
+        if err:
+            logger.info("Bot stderr:\n%s", "".join(err).rstrip("\n"))
+
+    # send one line, get one line back. encode makes the line to send, and is
+    # told whether the bot is fresh, e.g. because it was just restarted and
+    # needs the whole board rather than what's changed. only the attempt
+    # that gets answered is the bot's move: anything before it goes in
+    # restart_time, which isn't charged to the bot's clock
+    def request(self, encode: Callable[[bool], str]) -> str:
+        start = time.perf_counter()
+        for attempt in range(self.max_restarts + 1):
+            if attempt > 0 or self.proc is None or self.proc.poll() is not None:
+                self.close()
+                if not self._start():
+                    break
+            attempt_start = time.perf_counter()
+            try:
+                self.proc.stdin.write(encode(self.fresh) + "\n")
+                self.proc.stdin.flush()
+                self.fresh = False
+            except OSError:
+                logger.warning(f"WARN: couldn't write to {self.bot_path}, restarting it")
+                continue
+
+            answer = self._read_line(self.move_timeout)
+            self._log_stderr()
+            if answer is None:
+                if self.move_timeout is not None and self.proc.poll() is None:
+                    logger.warning(f"WARN: {self.bot_path} took longer than {self.move_timeout}s, restarting it")
+                else:
+                    logger.warning(f"WARN: {self.bot_path} exited with code {self.proc.returncode}, restarting it")
+                continue
+            self.restart_time += attempt_start - start
+            return answer
+
+        raise BotError(f"{self.bot_path} didn't produce a move after {self.max_restarts} restarts")
+
+    def close(self) -> None:
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        for stream in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+            stream.close()
+        self.proc = None
+        _running.discard(self)
+
+
+def known_move(
+    tables: list[PositionTable],
+    player: Color,
+    board: Mapping[Color, Mapping[Shape, Piece]],
+    valid: list[Move],
+    responding: bool,
+    prev: Piece | None,
+    required_move: Piece | None,
+) -> tuple[Move, int, int] | None:
+    # (move, score, depth) from the first table that knows this position
+    if not tables:
+        return None
+    state = state_from_getter_args(player, board, valid, responding, prev, required_move)
+    for table in tables:
+        if (known := table.lookup(state)) is not None and known[0] in valid:
+            return known
+    return None
+
+
+def run_once(bot_path: str, player: Color, line: str, move_timeout: float | None) -> bytes:
+    # start the bot, send it one move's input and wait for it to exit
+    proc = subprocess.Popen(
+        [bot_path],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    try:
+        answer, stderr = proc.communicate(line.encode(), timeout=move_timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise BotError(f"{bot_path} took longer than {move_timeout}s to move")
+
+    if proc.returncode != 0:
+        logger.warning(
+            f"WARN: {player.value}'s bot returned exit code {proc.returncode}\n"
+            "This could indicate a problem with the bot."
+        )
+    if stderr != b"":
+        logger.info(f"Bot stderr:\n{stderr}")
+    return answer
+
+
+def get_from_bot(
+    bot_path: str,
+    persistent: bool = False,
+    move_timeout: float | None = None,
+    tables: list[PositionTable] = (),
+) -> MoveGetter:
+    # in persistent mode the bot is started right away and reused for every
+    # move this getter is asked for; bots that don't speak the protocol just
+    # fall back to being run once per move. if any of tables (opening books
+    # or tablebases) know the position, the bot is told what they say
+    bot = None
+    if persistent:
+        bot = BotProcess(bot_path, move_timeout)
+        if not bot.persistent:
+            logger.warning(f"WARN: {bot_path} didn't answer the persistent handshake, running it once per move")
+            bot = None
+    phase_times = {}
+    # the pieces as of the last message a delta bot was sent
+    last_pieces = None
+    # the seed of the game being played, if it has one (see new_game)
+    seed = None
+
     def f(
         player: Color,
-        board: dict[Color, dict[Shape, Piece]],
+        board: Mapping[Color, Mapping[Shape, Piece]],
         valid: list[Move],
         responding: bool,
         prev: Piece | None,
         next: Piece | None,
     ) -> Move:
-        def get_board_json(board_state: dict[Color, dict[Shape, Piece]]):
-            # do a bunch of dict mapping to convert the internal Piece
-            # representations into normal json that other programs can read
-            return {
-                color: {
-                    shape: {
-                        "x": piece_obj.x,
-                        "y": piece_obj.y,
-                        "height": piece_obj.height,
-                    }
-                    for (shape, piece_obj) in colored_pieces.items()
-                }
-                for (color, colored_pieces) in board_state.items()
-            }
-
-        board = get_board_json(board)
-
-        def get_moves_json(valid_moves: list[Move]):
-            # quickndirty wrapper of above func for new json-oriented api
-            lst = valid_moves
-            ret = {shape: [] for shape in Shape}
-            for move in lst:
-                ret[move.shape].append({"x": move.x, "y": move.y})
-            return ret
-
-        valid = get_moves_json(valid)
-
-        # run the relevant process
-        combined_input = {
-            "board": board,
-            "player": player,
-            "valid": valid,
-            "responding": responding,
-            "prev": prev,
-        }
-        bot_ret = subprocess.run(
-            [bot_path],
-            input=json.dumps(combined_input).encode(),
-            capture_output=True,
-        )
+        start = time.perf_counter()
+        wire_format = bot.format if bot is not None else FORMAT_JSON
+        known = known_move(tables, player, board, valid, responding, prev, next)
+        phase_times["encode"] = time.perf_counter() - start
+
+        def encode(fresh: bool) -> str:
+            nonlocal last_pieces
+            encode_start = time.perf_counter()
+            if wire_format == FORMAT_JSON:
+                line = encode_json(player, board, valid, responding, prev, known, seed)
+            else:
+                pieces = flat_pieces(board)
+                line = encode_compact(
+                    player, pieces, valid, responding, prev, None if fresh else last_pieces, known, seed
+                )
+                if wire_format == FORMAT_DELTA:
+                    last_pieces = pieces
+            phase_times["encode"] += time.perf_counter() - encode_start
+            return line
+
+        # run the relevant process. a persistent bot is only (re)started
+        # when something went wrong, which play_game doesn't hold against it.
+        # from outside, a bot run once per move starting up (its interpreter,
+        # its imports) looks the same as it thinking, so that's one phase
+        if bot is not None:
+            answer = bot.request(encode)
+            phase_times["restart"] = bot.take_restart_time()
+            answered_at = time.perf_counter()
+            phase_times["think"] = answered_at - start - phase_times["encode"] - phase_times["restart"]
+        else:
+            line = encode(True)
+            run_start = time.perf_counter()
+            answer = run_once(bot_path, player, line, move_timeout)
+            answered_at = time.perf_counter()
+            phase_times["spawn+think"] = answered_at - run_start
 
-        if bot_ret.returncode != 0:
-            print(f"WARN: {player.value}'s bot returned exit code {bot_ret.returncode}")
-            print("This could indicate a problem with the bot.")
         # parse the bot's response
-        bot_ret_json = json.loads(bot_ret.stdout.decode())
-        print(f"Move attempt: {bot_ret_json}")
-        if bot_ret.stderr != b"":
-            print("Bot stderr:")
-            print(bot_ret.stderr)
-        # expect bot_ret's response to be
-        # {"shape": "wave", "x": 2, "y": 1}
-        return Move(
-            player,
-            Shape(bot_ret_json["shape"]),
-            bot_ret_json["x"],
-            bot_ret_json["y"],
-        )
+        try:
+            if wire_format == FORMAT_JSON:
+                move = decode_json(player, answer)
+            else:
+                move = decode_compact(player, answer)
+        except (ValueError, KeyError, TypeError, IndexError):
+            raise BotError(f"{bot_path} answered with something that isn't a move: {answer!r}")
+        phase_times["decode"] = time.perf_counter() - answered_at
+        logger.info(f"Move attempt: {move}")
+        return move
+
+    def new_game(game_seed: int | None) -> None:
+        nonlocal seed
+        seed = game_seed
 
+    # how long each phase of the last move took (see timing.py)
+    f.phase_times = phase_times
+    # called by play_game before each game with that game's seed
+    f.new_game = new_game
+    # lets callers shut a persistent bot down once they're done with it
+    f.close = bot.close if bot is not None else lambda: None
     return f
+
+
+def with_tables(getter: MoveGetter, tables: list[PositionTable]) -> MoveGetter:
+    # play whatever the tables say when they know the position, and only ask
+    # getter when they don't
+    def f(player, board, valid, responding, prev, required_move) -> Move:
+        if (known := known_move(tables, player, board, valid, responding, prev, required_move)) is not None:
+            return known[0]
+        return getter(player, board, valid, responding, prev, required_move)
+
+    if hasattr(getter, "new_game"):
+        f.new_game = getter.new_game
+    return f
+
+
+def get_from_spec(
+    spec: str,
+    persistent: bool = False,
+    move_timeout: float | None = None,
+    tables: list[PositionTable] = (),
+) -> MoveGetter:
+    # "builtin:<name>[:<args>]" picks one of the in-process bots from bots.py,
+    # anything else is a path to an executable. built-in bots play straight
+    # from tables when they can, other bots are told what the tables say
+    if spec.startswith(BUILTIN_PREFIX):
+        getter = get_builtin(spec.removeprefix(BUILTIN_PREFIX))
+        # most built-in bots have nothing to shut down, but some keep
+        # worker processes around
+        close = getattr(getter, "close", lambda: None)
+        if tables:
+            getter = with_tables(getter, tables)
+        getter.close = close
+        return getter
+    return get_from_bot(spec, persistent, move_timeout, tables)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+import argparse
+import atexit
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from book import NO_MOVE, pack_move, unpack_move
+from bots import alphabeta, order_moves, state_from_getter_args
+from core import COLOR_INDEX, COLORS, Move, State
+from perft import POSITIONS, load_position
+from play_game import MoveGetter
+
+# alpha-beta spread over a pool of processes. the moves at the root are
+# handed out to workers one at a time, each searched with the best score
+# found so far as its lower bound, and every worker reads and writes one
+# transposition table kept in shared memory so they don't repeat each
+# other's work. the first move of each iteration is searched on its own
+# before the rest are handed out, since it's usually the best and gives the
+# others a bound to cut off against
+
+
+class SharedTranspositionTable:
+    # same interface as transposition.TranspositionTable, but kept in a
+    # multiprocessing.shared_memory block that other processes can attach to
+    # by name. each slot is two u64s: the data (score, move, depth, flag,
+    # age packed together) and the key xor'd with the data. nothing is
+    # locked, so a slot two processes write at once can come out mixed up,
+    # but then the xor doesn't match the key and it just reads as empty
+    def __init__(self, size_bits: int = 20, name: str | None = None):
+        self.size = 1 << size_bits
+        self.mask = self.size - 1
+        self.owner = name is None
+        # workers share the resource tracker of the process that made the
+        # block, so only that one needs to unlink it
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=16 * self.size)
+        self.name = self.shm.name
+        self.slots = self.shm.buf.cast("Q")
+        self.age = 0
+
+    def new_search(self) -> None:
+        self.age = (self.age + 1) & 0x3F
+
+    def get(self, key: int) -> tuple[int, int, int, Move | None] | None:
+        slot = (key & self.mask) << 1
+        data = self.slots[slot + 1]
+        if self.slots[slot] ^ data != key:
+            return None
+        packed = (data >> 32) & 0xFFFF
+        move = unpack_move(COLORS[packed >> 10], packed & 0x3FF) if packed != NO_MOVE else None
+        return ((data >> 48) & 0xFF, (data & 0xFFFFFFFF) - (1 << 31), (data >> 56) & 0x3, move)
+
+    def put(self, key: int, depth: int, score: int, flag: int, move: Move | None) -> None:
+        slot = (key & self.mask) << 1
+        old = self.slots[slot + 1]
+        if (
+            self.slots[slot] ^ old != key
+            and old != 0
+            and (old >> 58) == self.age
+            and ((old >> 48) & 0xFF) > depth
+        ):
+            return
+        packed = NO_MOVE if move is None else (COLOR_INDEX[move.player] << 10) | pack_move(move)
+        score = int(max(-(1 << 31), min((1 << 31) - 1, score)))
+        data = (score + (1 << 31)) | (packed << 32) | (min(depth, 0xFF) << 48) | (flag << 56) | (self.age << 58)
+        self.slots[slot] = key ^ data
+        self.slots[slot + 1] = data
+
+    def clear(self) -> None:
+        self.shm.buf[:] = bytes(len(self.shm.buf))
+
+    def close(self) -> None:
+        if self.shm is None:
+            return
+        self.slots.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
+
+
+class CountingState(State):
+    # counts every position the search visits, for nodes per second
+    def make_move(self, move: Move):
+        self.nodes += 1
+        return super().make_move(move)
+
+
+# the table each worker process attached to in _init_worker
+_tt: SharedTranspositionTable | None = None
+
+
+def _init_worker(name: str, size_bits: int) -> None:
+    global _tt
+    _tt = SharedTranspositionTable(size_bits, name)
+
+
+def _search_move(
+    position: tuple, move: Move, depth: int, alpha: float, age: int, tt: SharedTranspositionTable | None = None
+) -> tuple[float, int]:
+    # score one root move (from the mover's point of view) and how many
+    # positions that took. position is (board, next move, prev piece)
+    tt = tt if tt is not None else _tt
+    tt.age = age
+    state = CountingState.from_board(*position)
+    state.nodes = 1
+    player = state.next_move[0]
+    state.make_move(move)
+    score = alphabeta(state, depth - 1, alpha, float("inf"), player, 1, tt)
+    return score, state.nodes
+
+
+# searches that haven't been closed, so their pools and shared memory are
+# cleaned up when we exit. one exit hook does for all of them, and close
+# takes a search off again, so a server making one per game doesn't keep
+# them all around
+_open: set["ParallelSearch"] = set()
+
+
+@atexit.register
+def _close_open() -> None:
+    for engine in list(_open):
+        engine.close()
+
+
+class ParallelSearch:
+    def __init__(self, workers: int | None = None, size_bits: int = 20):
+        self.workers = workers or os.cpu_count() or 1
+        self.tt = SharedTranspositionTable(size_bits)
+        # with one worker everything happens in this process, which makes it
+        # a fair baseline for the others
+        self.pool = None
+        if self.workers > 1:
+            self.pool = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker, initargs=(self.tt.name, size_bits)
+            )
+        # positions searched and seconds taken for each depth of the last search
+        self.stats: list[tuple[int, int, float]] = []
+        _open.add(self)
+
+    def _run(self, position: tuple, moves: list[Move], depth: int) -> tuple[Move, float, int]:
+        # best of moves and its score, searching the first on its own
+        age = self.tt.age
+        if self.pool is None:
+            best, best_score, nodes = None, -float("inf"), 0
+            for move in moves:
+                score, n = _search_move(position, move, depth, best_score, age, self.tt)
+                nodes += n
+                if best is None or score > best_score:
+                    best, best_score = move, score
+            return best, best_score, nodes
+
+        best_score, nodes = self.pool.submit(_search_move, position, moves[0], depth, -float("inf"), age).result()
+        best = moves[0]
+        waiting = list(moves[1:])
+        running = {}
+        while waiting or running:
+            while waiting and len(running) < self.workers:
+                move = waiting.pop(0)
+                running[self.pool.submit(_search_move, position, move, depth, best_score, age)] = move
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                move = running.pop(future)
+                score, n = future.result()
+                nodes += n
+                # ties go to whichever came first in the list, like a plain search
+                if score > best_score or (score == best_score and moves.index(move) < moves.index(best)):
+                    best, best_score = move, score
+        return best, best_score, nodes
+
+    def search(self, state: State, depth: int, time_limit: float | None = None) -> tuple[Move, float]:
+        # iterative deepening: each depth orders the root moves by how well
+        # they did at the one before. with a time limit, no new depth is
+        # started once it's run out (the one in progress still finishes)
+        self.tt.new_search()
+        self.stats = []
+        position = (state.get_full_board(), state.next_move, state.prev_piece)
+        moves = order_moves(state.get_valid_moves())
+        start = time.perf_counter()
+        best, best_score = moves[0], -float("inf")
+        for d in range(1, depth + 1):
+            best, best_score, nodes = self._run(position, moves, d)
+            self.stats.append((d, nodes, time.perf_counter() - start))
+            moves = [best] + [move for move in moves if move != best]
+            if time_limit is not None and time.perf_counter() - start > time_limit:
+                break
+        return best, best_score
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        self.tt.close()
+        _open.discard(self)
+
+
+def parallel_bot(depth: str = "4", workers: str | None = None, time_limit: str | None = None) -> MoveGetter:
+    # builtin:parallel:<depth>[:<workers>[:<seconds>]]; workers defaults to
+    # one per cpu. the pool and table last as long as the getter does
+    engine = ParallelSearch(int(workers) if workers else None)
+    depth = int(depth)
+    time_limit = float(time_limit) if time_limit else None
+
+    def f(player, board, valid, responding, prev, required_move) -> Move:
+        state = state_from_getter_args(player, board, valid, responding, prev, required_move)
+        return engine.search(state, depth, time_limit)[0]
+
+    f.close = engine.close
+    return f
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="See how the parallel search scales with more workers.")
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--position", choices=POSITIONS, default="midgame")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cpus, searching {args.position} to depth {args.depth}")
+    baseline = None
+    for workers in args.workers:
+        engine = ParallelSearch(workers)
+        # spin the pool up before timing anything
+        engine.search(load_position(args.position), 1)
+        move, score = engine.search(load_position(args.position), args.depth)
+        engine.close()
+        _, nodes, elapsed = engine.stats[-1]
+        total = sum(n for (_, n, _) in engine.stats)
+        baseline = baseline or elapsed
+        depths = ", ".join(f"{d}: {t:.2f}s" for (d, _, t) in engine.stats)
+        print(
+            f"{workers} workers: {move.to_token()} ({score:g}) in {elapsed:.2f}s, {total / elapsed:,.0f} nodes/s,"
+            f" {baseline / elapsed:.2f}x  [time to depth {depths}]"
+        )
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+import time
+from core import Move, State
+
+# positions to count from, each written as the moves that lead to it from
+# the start (see Move.to_token)
+POSITIONS: dict[str, str] = {
+    "start": "",
+    "midgame": "w10 w16 p46 c10 p36 c20 c45 p26 q31 p16 c10 c35 s16 s41 c00 c45 s06 s42 q41 c35 c10 q40 c25 c11",
+    "crowded": (
+        "q40 q26 c36 c10 w10 c35 w11 p35 c11 s05 c21 s06 p00 p45 c45 c31 w12 c44 c21 p10 p46 q16 q41"
+        " w13 w25 q26 q40 w03 w26 c45 c20 w13 w16 p36 p00 w23 w15 q36 q41 w22 w14 c44 c10 q42 q46"
+    ),
+    "responding": (
+        "p00 p46 w25 w30 s41 s16 w26 w20 s31 s26 q06 q31 w30 s16 q30 q16 p36 p01 s30 q15 c01 c36 q25"
+        " s31 s15 q35 q40 s21 s14 c26 c00 w31 c25 c10 q30 q25 w16 w30 c11 s24 s31 p02 p46 s14 s21 c10"
+        " q24 w20 w15 p36 p12 q20 q23 s04 s22 p11 p35 s05 s23 p01 p45 c35 c00 p02 p35 s04 s33 c10 w16"
+        " s23 s14 p34 p01 c00 c45 w15 s13 s13 w14 q10"
+    ),
+    # a few moves from the end, so some lines finish the game
+    "endgame": (
+        "w21 w25 q15 q40 w22 w35 p26 p11 q41 q25 c45 c01 w12 w45 p36 p01 q42 q26 p35 p02 c11 q36 q32"
+        " c01 p25 p12 q22 q35 p15 p13 w11 w44 q34 q32 w21 w34 p25 p14 c11 c46 p35 p15 q31 p34 p16 q21"
+        " c45 c10 q31 p24 p15 c00 c35 s05 s30 w11 w24 q24 q32 c01 c25 s06 s31 c11 c35 q34 q22 p16 w23"
+        " s21 s05 c34 c21 q21 p14 p15 w21 w22 p24 p05 w22 c44 p06 p34 s06 w32 w12 c34 q22 w13 w42 c22"
+        " c35 s16 s31 c21 c36 s15 s32 c31 c46 w12 w32 c21 c45 s25 p16 p24 w02 w42 s22 s15"
+    ),
+}
+
+# known-good leaf counts for depths 1, 2, 3, ... from each position. up to
+# depth 5 these were checked against the original dict-of-Pieces version of
+# State, so if a change to move generation makes them come out different,
+# it's the change that's wrong
+KNOWN_COUNTS: dict[str, list[int]] = {
+    "start": [13, 35, 298, 1062, 6810, 32820, 196362],
+    "midgame": [8, 51, 280, 2028, 12325, 75812],
+    "crowded": [12, 35, 364, 1055, 10830, 41610],
+    "responding": [4, 56, 168, 1360, 6138, 65274],
+    "endgame": [14, 97, 582, 3998, 32593],
+}
+
+
+def load_position(name: str) -> State:
+    state = State()
+    for token in POSITIONS[name].split():
+        state.make_move(Move.from_token(state.next_move[0], token))
+    return state
+
+
+def perft(state: State, depth: int) -> int:
+    # how many move sequences of exactly `depth` moves there are from here.
+    # a finished game has no moves left, so it doesn't count unless depth is 0
+    if depth == 0:
+        return 1
+    if state.winner is not None:
+        return 0
+    nodes = 0
+    for move in state.get_valid_moves():
+        state.make_move(move)
+        nodes += perft(state, depth - 1)
+        state.unmake_move()
+    return nodes
+
+
+def divide(state: State, depth: int) -> dict[Move, int]:
+    # perft split up by first move, for tracking down where counts differ
+    ret = {}
+    for move in state.get_valid_moves():
+        state.make_move(move)
+        ret[move] = perft(state, depth - 1)
+        state.unmake_move()
+    return ret
+
+
+def check() -> bool:
+    all_ok = True
+    for (name, counts) in KNOWN_COUNTS.items():
+        state = load_position(name)
+        ok = True
+        for (depth, expected) in enumerate(counts, start=1):
+            got = perft(state, depth)
+            if got != expected:
+                print(f"FAIL: {name} depth {depth}: expected {expected}, got {got}")
+                ok = False
+        if ok:
+            print(f"ok: {name} (depths 1-{len(counts)})")
+        all_ok = all_ok and ok
+    return all_ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count move sequences to benchmark and check move generation.")
+    parser.add_argument("depth", nargs="?", type=int, default=5)
+    parser.add_argument("--position", choices=POSITIONS, default="start")
+    parser.add_argument("--from", dest="text", metavar="POSITION", help="count from a position string instead (see State.to_text)")
+    parser.add_argument("--divide", action="store_true", help="break the count down by first move")
+    parser.add_argument("--check", action="store_true", help="compare every position against the known counts")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(0 if check() else 1)
+
+    state = State.from_text(args.text) if args.text else load_position(args.position)
+    if args.divide:
+        for (move, nodes) in divide(state, args.depth).items():
+            print(f"{move}: {nodes}")
+    for depth in range(1, args.depth + 1):
+        start = time.perf_counter()
+        nodes = perft(state, depth)
+        elapsed = time.perf_counter() - start
+        print(f"depth {depth}: {nodes} nodes in {elapsed:.3f}s ({nodes / max(elapsed, 1e-9):,.0f} nodes/s)")
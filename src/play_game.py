@@ -1,12 +1,17 @@
 import core
+import logging
 import time
-from collections.abc import Callable
+from collections.abc import Callable, Mapping
 from core import MoveResult, Color, Move, Piece, Shape
+from render import DEFAULT_MAX_FPS, BoardRenderer
+from timing import MoveTimer
+
+logger = logging.getLogger(__name__)
 
 type MoveGetter = Callable[
     [
         Color,
-        dict[Color, dict[Shape, Piece]],
+        Mapping[Color, Mapping[Shape, Piece]],
         list[Move],
         bool,
         Piece | None,
@@ -16,6 +21,13 @@ type MoveGetter = Callable[
 ]
 
 
+# raised by a MoveGetter whose player can't come up with a move at all (a bot
+# that hangs, keeps crashing or answers with garbage); play_game counts it as
+# a forfeit
+class BotError(Exception):
+    pass
+
+
 def play_game(
     get_white_move: MoveGetter,
     get_black_move: MoveGetter,
@@ -24,12 +36,40 @@ def play_game(
     draw_over: bool = True,
     above_board_text: str | None = None,
     end_of_turn_hook: Callable[[], None] | None = None,
+    headless: bool = False,
+    end_of_game_hook: Callable[[core.State, list[float]], None] | None = None,
+    timer: MoveTimer | None = None,
+    move_time_limit: float | None = None,
+    game_time_limit: float | None = None,
+    seed: int | None = None,
+    max_fps: float | None = DEFAULT_MAX_FPS,
 ) -> Color:
+    # headless skips all the drawing, sleeping and printing, for batch runs
+    # where nobody's watching; anything worth saying goes to the logger.
+    # a player forfeits if a single move takes longer than move_time_limit
+    # seconds, or all their moves together take longer than game_time_limit.
+    # timer, if given, collects how long each phase of each move took under
+    # the color's name. getters with a new_game attribute get called with
+    # seed before the game starts, so they can play it reproducibly.
+    # with draw_over the board is redrawn in place, at most max_fps times a
+    # second (see render.py); otherwise every position is printed in turn
     def vp(*args, **kwargs):
-        if verbose:
+        if verbose and not headless:
             print(args, kwargs)
+        else:
+            logger.debug("%s %s", args, kwargs)
+
+    for getter in (get_white_move, get_black_move):
+        if hasattr(getter, "new_game"):
+            getter.new_game(seed)
 
     game = core.State()
+    renderer = BoardRenderer(max_fps=max_fps) if draw_over and not headless else None
+    # seconds each player took to come up with each move that went through
+    # (including any invalid attempts before it)
+    move_times = []
+    thinking_time = 0.0
+    clocks = {color: 0.0 for color in Color}
 
     response, extra_info = ("filler", "")
 
@@ -39,31 +79,67 @@ def play_game(
         MoveResult.ALREADY_OVER,
     ]:
         # Draw the board state
-        if sleep_time is not None:
-            time.sleep(sleep_time)
-        if draw_over:
-            print("\033[2J\033[H", end='')  # clear screen, return to terminal position 0,0
-        if above_board_text is not None:
-            print(above_board_text)
-        game.draw_board()
-
-        # Get the board state
-        board = game.get_full_board()
+        if not headless:
+            if sleep_time is not None:
+                time.sleep(sleep_time)
+            if renderer is not None:
+                renderer.draw(game, above_board_text)
+            else:
+                if above_board_text is not None:
+                    print(above_board_text)
+                game.draw_board()
+
+        # Get the board state (a read-only view, not a copy)
+        board = game.get_board_view()
         valid = game.get_valid_moves()
         player, responding, prev = game.get_next_move_new()
         _, required_move = game.get_next_move()
 
         # Ask the player for their move
-        if player == Color.WHITE:
-            move = get_white_move(player, board, valid, responding, prev, required_move)
-        else:
-            move = get_black_move(player, board, valid, responding, prev, required_move)
+        getter = get_white_move if player == Color.WHITE else get_black_move
+        start = time.perf_counter()
+        try:
+            move = getter(player, board, valid, responding, prev, required_move)
+        except BotError as e:
+            logger.warning(f"WARN: {e}")
+            move = None
+        elapsed = time.perf_counter() - start
+        thinking_time += elapsed
+        # restarting a bot that crashed or hung (see BotProcess.request)
+        # doesn't count against its time limits
+        charged = elapsed - getattr(getter, "phase_times", {}).get("restart", 0.0)
+        clocks[player] += charged
 
-        # Apply it to the game
-        response, extra_info = game.try_move(move)
+        if move is None:
+            response, extra_info = game.forfeit(player)
+        elif move_time_limit is not None and charged > move_time_limit:
+            response, extra_info = game.forfeit(player)
+            extra_info += f" (took {charged:.3f}s for one move, limit is {move_time_limit}s)"
+        elif game_time_limit is not None and clocks[player] > game_time_limit:
+            response, extra_info = game.forfeit(player)
+            extra_info += f" (out of time, used {clocks[player]:.3f}s of {game_time_limit}s)"
+        else:
+            # Apply it to the game
+            start = time.perf_counter()
+            response, extra_info = game.try_move(move)
+            if timer is not None:
+                timer.add(player.value, "referee", time.perf_counter() - start)
+                timer.add(player.value, "total", elapsed)
+                for (phase, seconds) in getattr(getter, "phase_times", {}).items():
+                    timer.add(player.value, phase, seconds)
         vp(f"{response}: {extra_info}")
+        if game.forfeited is not None:
+            logger.info(extra_info)
+        if response != MoveResult.MOVE_FAILURE and game.forfeited is None:
+            move_times.append(thinking_time)
+            thinking_time = 0.0
 
         if end_of_turn_hook is not None:
             end_of_turn_hook()
 
+    if renderer is not None:
+        renderer.close(game, above_board_text)
+    if end_of_game_hook is not None:
+        end_of_game_hook(game, move_times)
+
     return game.get_who_won()
@@ -0,0 +1,179 @@
+import cProfile
+import functools
+import importlib
+import os
+import pstats
+import time
+
+# opt-in counters for where the referee's time goes, for when a run is slow
+# and it isn't clear whether it's us or the bots. turning them on wraps each
+# of HOT_PATHS in a function that counts its calls and adds up how long they
+# took (including anything they call); until then nothing is wrapped, so
+# they cost nothing. set ZENER_PROFILE=1 (or pass --profile) to turn them on,
+# and ZENER_PROFILE=cprofile (or --profile-dump FILE) to also run every game
+# under cProfile. the environment variable is how worker processes find out
+ENV_VAR = "ZENER_PROFILE"
+CPROFILE = "cprofile"
+
+# (module, class or None for a plain function, function)
+HOT_PATHS = (
+    ("core", "State", "get_valid_moves"),
+    ("core", "State", "get_player_cant_move"),
+    ("core", "State", "_try_move"),
+    ("core", "State", "get_full_board"),
+    ("core", "State", "get_board_view"),
+    ("core", "State", "draw_board"),
+    ("render", "BoardRenderer", "draw"),
+    ("move_getters", None, "known_move"),
+    # talking to bots: starting a persistent one, one request and answer
+    # with it, and a whole run of a one-shot bot
+    ("move_getters", "BotProcess", "_start"),
+    ("move_getters", "BotProcess", "request"),
+    ("move_getters", None, "run_once"),
+)
+
+# calls and seconds per hot path since the last take()
+_calls: dict[str, int] = {}
+_seconds: dict[str, float] = {}
+_enabled = False
+_cprofile = False
+
+
+def _label(module: str, owner: str | None, name: str) -> str:
+    return f"{owner}.{name}" if owner is not None else f"{module}.{name}"
+
+
+def _counted(label: str, f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            _calls[label] += 1
+            _seconds[label] += time.perf_counter() - start
+
+    return wrapper
+
+
+def enable(cprofile: bool = False) -> None:
+    global _enabled, _cprofile
+    os.environ[ENV_VAR] = CPROFILE if cprofile else "1"
+    _cprofile = _cprofile or cprofile
+    if _enabled:
+        return
+    _enabled = True
+    for (module, owner, name) in HOT_PATHS:
+        label = _label(module, owner, name)
+        _calls[label] = 0
+        _seconds[label] = 0.0
+        target = importlib.import_module(module)
+        if owner is not None:
+            target = getattr(target, owner)
+        setattr(target, name, _counted(label, getattr(target, name)))
+
+
+def enable_from_env() -> None:
+    if (setting := os.environ.get(ENV_VAR, "")) not in ("", "0"):
+        enable(cprofile=setting == CPROFILE)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def take() -> dict[str, tuple[int, float]]:
+    # (calls, seconds) per hot path since the last take
+    taken = {label: (_calls[label], _seconds[label]) for label in _calls if _calls[label]}
+    for label in _calls:
+        _calls[label] = 0
+        _seconds[label] = 0.0
+    return taken
+
+
+def start_game() -> cProfile.Profile | None:
+    # call before a game and hand what it gives back to finish_game after
+    if not _cprofile:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def finish_game(profiler: cProfile.Profile | None) -> dict | None:
+    # the counters (and cProfile's stats) for the game, in a form that can
+    # be sent back from a worker process, for RunProfile.merge
+    if not _enabled:
+        return None
+    stats = None
+    if profiler is not None:
+        profiler.disable()
+        profiler.create_stats()
+        stats = profiler.stats
+    return {"counters": take(), "cprofile": stats}
+
+
+class _Finished:
+    # looks enough like a cProfile.Profile for pstats to load stats that
+    # were collected somewhere else
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class RunProfile:
+    # everything finish_game handed back over a run, added together
+    def __init__(self):
+        self.calls: dict[str, int] = {}
+        self.seconds: dict[str, float] = {}
+        self.stats: pstats.Stats | None = None
+
+    def merge(self, profile: dict | None) -> None:
+        if profile is None:
+            return
+        for (label, (calls, seconds)) in profile["counters"].items():
+            self.calls[label] = self.calls.get(label, 0) + calls
+            self.seconds[label] = self.seconds.get(label, 0.0) + seconds
+        if profile["cprofile"] is not None:
+            if self.stats is None:
+                self.stats = pstats.Stats(_Finished(profile["cprofile"]))
+            else:
+                self.stats.add(_Finished(profile["cprofile"]))
+
+    def summary(self) -> list[str]:
+        lines = []
+        for label in sorted(self.calls, key=lambda label: self.seconds[label], reverse=True):
+            calls, seconds = self.calls[label], self.seconds[label]
+            lines.append(f"  {label:<28} {calls:>10} calls {seconds:10.3f}s {seconds / calls * 1e6:10.2f} µs/call")
+        return lines
+
+    def dump(self, path: str) -> None:
+        # pstats' format, which snakeviz, flameprof, gprof2dot and friends
+        # can all turn into flame graphs
+        if self.stats is not None:
+            self.stats.dump_stats(path)
+
+
+def print_report(
+    run_profile: RunProfile,
+    dump_path: str | None = None,
+    timer=None,
+    profiler: cProfile.Profile | None = None,
+) -> None:
+    # the TIMING and PROFILE sections every script ends with. timer is a
+    # timing.MoveTimer when --timing was given, and profiler this process's
+    # own from start_game if it played a game itself; whatever else was
+    # counted in this process outside of a game is added in too
+    if timer is not None:
+        print("TIMING:")
+        print("\n".join(timer.summary()))
+    if not _enabled:
+        return
+    print("PROFILE:")
+    run_profile.merge(finish_game(profiler))
+    print("\n".join(run_profile.summary()))
+    if dump_path:
+        run_profile.dump(dump_path)
+        print(f"cProfile stats written to {dump_path}")
@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 
+import logging
 import sys
-from move_getters import get_from_human, get_from_bot
+from move_getters import get_from_human, get_from_spec
 from play_game import play_game
 
+logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
 
 winner = play_game(
     get_white_move=get_from_human,
-    get_black_move=get_from_bot(sys.argv[1]),
+    get_black_move=get_from_spec(sys.argv[1]),
     verbose=True,
     sleep_time=0.25,
     draw_over=True,
@@ -0,0 +1,276 @@
+import math
+from collections.abc import Iterator
+from core import Color
+
+# glicko-2 ratings (see Glickman, "Example of the Glicko-2 system") for
+# deciding which bots are stronger without playing every pairing to death,
+# plus a sequential probability ratio test for head-to-head series
+GLICKO_SCALE = 173.7178
+DEFAULT_RATING = 1500.0
+DEFAULT_DEVIATION = 350.0
+DEFAULT_VOLATILITY = 0.06
+# how much the volatility is allowed to change; glickman suggests 0.3-1.2
+TAU = 0.5
+
+
+def _g(phi: float) -> float:
+    return 1 / math.sqrt(1 + 3 * phi**2 / math.pi**2)
+
+
+def _expected(mu: float, other_mu: float, other_phi: float) -> float:
+    return 1 / (1 + math.exp(-_g(other_phi) * (mu - other_mu)))
+
+
+class Rating:
+    # kept on the glicko-2 scale internally; rating and deviation are on the
+    # usual elo-like one
+    def __init__(
+        self,
+        rating: float = DEFAULT_RATING,
+        deviation: float = DEFAULT_DEVIATION,
+        volatility: float = DEFAULT_VOLATILITY,
+    ):
+        self.mu = (rating - DEFAULT_RATING) / GLICKO_SCALE
+        self.phi = deviation / GLICKO_SCALE
+        self.sigma = volatility
+        self.games = 0
+
+    @property
+    def rating(self) -> float:
+        return self.mu * GLICKO_SCALE + DEFAULT_RATING
+
+    @property
+    def deviation(self) -> float:
+        return self.phi * GLICKO_SCALE
+
+    def interval(self) -> tuple[float, float]:
+        # roughly 95% sure the real rating is in here
+        return (self.rating - 1.96 * self.deviation, self.rating + 1.96 * self.deviation)
+
+    def expected_score(self, other: "Rating") -> float:
+        return _expected(self.mu, other.mu, other.phi)
+
+    def updated(self, games: list[tuple["Rating", float]]) -> tuple[float, float, float]:
+        # (mu, phi, sigma) after one rating period of games, each against
+        # another rating with a score of 1 for a win and 0 for a loss.
+        # steps 3-7 of the paper
+        if not games:
+            return (self.mu, math.sqrt(self.phi**2 + self.sigma**2), self.sigma)
+        v_inverse = 0.0
+        improvement = 0.0
+        for (other, score) in games:
+            g = _g(other.phi)
+            e = _expected(self.mu, other.mu, other.phi)
+            v_inverse += g**2 * e * (1 - e)
+            improvement += g * (score - e)
+        v = 1 / v_inverse
+        delta = v * improvement
+
+        # new volatility, by the illinois method (step 5)
+        a = math.log(self.sigma**2)
+
+        def f(x: float) -> float:
+            ex = math.exp(x)
+            return ex * (delta**2 - self.phi**2 - v - ex) / (2 * (self.phi**2 + v + ex) ** 2) - (x - a) / TAU**2
+
+        low = a
+        if delta**2 > self.phi**2 + v:
+            high = math.log(delta**2 - self.phi**2 - v)
+        else:
+            k = 1
+            while f(a - k * TAU) < 0:
+                k += 1
+            high = a - k * TAU
+        f_low, f_high = f(low), f(high)
+        while abs(high - low) > 1e-6:
+            mid = low + (low - high) * f_low / (f_high - f_low)
+            f_mid = f(mid)
+            if f_mid * f_high <= 0:
+                low, f_low = high, f_high
+            else:
+                f_low /= 2
+            high, f_high = mid, f_mid
+        sigma = math.exp(low / 2)
+
+        phi_star = math.sqrt(self.phi**2 + sigma**2)
+        phi = 1 / math.sqrt(1 / phi_star**2 + 1 / v)
+        mu = self.mu + phi**2 * improvement
+        return (mu, phi, sigma)
+
+
+class RatingScheduler:
+    # picks each game to play by how much it's expected to shrink the two
+    # bots' rating deviations: bots we're unsure about and pairings that are
+    # close to even come first, and lopsided ones whose result is a foregone
+    # conclusion last. finishes once every bot's deviation is below
+    # target_deviation, or after max_games (by default, as many games as
+    # MAX_ROUNDS round robins). results have to be fed back with add_result,
+    # and are applied a rating period (period_games results, five per bot by
+    # default) at a time, as glicko-2 expects. deviations grow a little every
+    # period, so there's a floor below which they can't get; more games per
+    # period lowers it. if the target's below that floor it also finishes
+    # once the largest deviation hasn't shrunk for STALL_PERIODS periods in
+    # a row. a pairing that's crashed MAX_CRASHES times in a row isn't
+    # scheduled again, and a bot left with no pairings at all doesn't count
+    # towards finishing
+    MAX_ROUNDS = 50
+    STALL_PERIODS = 3
+    MAX_CRASHES = 3
+
+    def __init__(
+        self,
+        bots: list[str],
+        target_deviation: float = 75.0,
+        max_games: int | None = None,
+        period_games: int | None = None,
+    ):
+        self.bots = bots
+        self.ratings = {bot: Rating() for bot in bots}
+        self.target_deviation = target_deviation
+        if max_games is None:
+            max_games = self.MAX_ROUNDS * len(bots) * (len(bots) - 1)
+        self.max_games = max_games
+        self.period_games = period_games or 5 * len(bots)
+        # games handed out, and results fed back for games that didn't crash
+        self.scheduled = 0
+        self.rated = 0
+        # (white, black, white's score) for results not applied yet
+        self.period: list[tuple[str, str, float]] = []
+        # games handed out whose results haven't been applied yet, by
+        # unordered pair, so a batch of games handed out at once isn't all
+        # the same one
+        self.unrated: dict[frozenset[str], int] = {}
+        # games each bot has had white against each other one, so colors alternate
+        self.white_games: dict[tuple[str, str], int] = {}
+        # crashes in a row by unordered pair; ones that reach MAX_CRASHES are dropped
+        self.crashes: dict[frozenset[str], int] = {}
+        # the lowest the largest deviation has been at the end of a period,
+        # and how many periods it's been since that went down
+        self.lowest_deviation = math.inf
+        self.stalled_periods = 0
+
+    def _pairs(self) -> list[tuple[str, str]]:
+        return [
+            (a, b)
+            for (i, a) in enumerate(self.bots)
+            for b in self.bots[i + 1 :]
+            if self.crashes.get(frozenset((a, b)), 0) < self.MAX_CRASHES
+        ]
+
+    def dropped(self) -> list[tuple[str, str]]:
+        # the pairings given up on for crashing
+        return [
+            (a, b)
+            for (i, a) in enumerate(self.bots)
+            for b in self.bots[i + 1 :]
+            if self.crashes.get(frozenset((a, b)), 0) >= self.MAX_CRASHES
+        ]
+
+    def converged(self) -> bool:
+        playing = {bot for pair in self._pairs() for bot in pair}
+        return all(self.ratings[bot].deviation < self.target_deviation for bot in playing)
+
+    def stalled(self) -> bool:
+        return self.stalled_periods >= self.STALL_PERIODS
+
+    def _information(self, a: str, b: str) -> float:
+        # how much one more game between a and b shrinks their variances,
+        # counting the games between them we're still waiting on
+        n = self.unrated.get(frozenset((a, b)), 0)
+        gain = 0.0
+        for (me, other) in ((self.ratings[a], self.ratings[b]), (self.ratings[b], self.ratings[a])):
+            e = me.expected_score(other)
+            per_game = _g(other.phi) ** 2 * e * (1 - e)
+            precision = 1 / me.phi**2
+            gain += 1 / (precision + n * per_game) - 1 / (precision + (n + 1) * per_game)
+        return gain
+
+    def next_matchup(self) -> tuple[str, str] | None:
+        pairs = self._pairs()
+        if not pairs or self.converged() or self.stalled() or self.scheduled >= self.max_games:
+            return None
+        a, b = max(pairs, key=lambda pair: self._information(*pair))
+        # whoever's had white less often in this pairing gets it
+        if self.white_games.get((a, b), 0) > self.white_games.get((b, a), 0):
+            a, b = b, a
+        self.white_games[(a, b)] = self.white_games.get((a, b), 0) + 1
+        pair = frozenset((a, b))
+        self.unrated[pair] = self.unrated.get(pair, 0) + 1
+        self.scheduled += 1
+        return (a, b)
+
+    def matchups(self) -> Iterator[tuple[str, str]]:
+        # for scheduler.run_games, which reads it lazily
+        while (matchup := self.next_matchup()) is not None:
+            yield matchup
+
+    def add_result(self, white: str, black: str, winner: Color | None) -> None:
+        # winner None means the game crashed, so it doesn't count
+        pair = frozenset((white, black))
+        if winner is None:
+            self.unrated[pair] -= 1
+            self.crashes[pair] = self.crashes.get(pair, 0) + 1
+            return
+        self.crashes[pair] = 0
+        self.rated += 1
+        self.period.append((white, black, 1.0 if winner == Color.WHITE else 0.0))
+        if len(self.period) >= self.period_games:
+            self.end_period()
+
+    def end_period(self) -> None:
+        # apply every result since the last period. call it once more after
+        # the last result so none are left over
+        if not self.period:
+            return
+        games: dict[str, list[tuple[Rating, float]]] = {bot: [] for bot in self.bots}
+        for (white, black, score) in self.period:
+            games[white].append((self.ratings[black], score))
+            games[black].append((self.ratings[white], 1 - score))
+            self.unrated[frozenset((white, black))] -= 1
+        # everyone's new rating is worked out from the old ones before any change
+        updated = {bot: self.ratings[bot].updated(games[bot]) for bot in self.bots}
+        for (bot, (mu, phi, sigma)) in updated.items():
+            rating = self.ratings[bot]
+            rating.mu, rating.phi, rating.sigma = mu, phi, sigma
+            rating.games += len(games[bot])
+        self.period = []
+        # the floor deviations can't get below shows up as the largest one
+        # going up and down around it instead of shrinking
+        playing = {bot for pair in self._pairs() for bot in pair}
+        largest = max((self.ratings[bot].deviation for bot in playing), default=0.0)
+        if largest < self.lowest_deviation:
+            self.lowest_deviation = largest
+            self.stalled_periods = 0
+        else:
+            self.stalled_periods += 1
+
+
+def _win_probability(elo: float) -> float:
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+class SPRT:
+    # sequential probability ratio test between "bot 1 is elo0 stronger than
+    # bot 2" (h0) and "it's elo1 stronger" (h1). alpha and beta are the
+    # chances of wrongly accepting h1 and h0. games here can't be drawn, so
+    # each one is a plain win or loss
+    def __init__(self, elo0: float, elo1: float, alpha: float = 0.05, beta: float = 0.05):
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+        p0, p1 = _win_probability(elo0), _win_probability(elo1)
+        self.win_llr = math.log(p1 / p0)
+        self.loss_llr = math.log((1 - p1) / (1 - p0))
+        self.llr = 0.0
+
+    def add_result(self, won: bool) -> None:
+        self.llr += self.win_llr if won else self.loss_llr
+
+    def decision(self) -> str | None:
+        # "h1", "h0", or None if it's too early to tell
+        if self.llr >= self.upper:
+            return "h1"
+        if self.llr <= self.lower:
+            return "h0"
+        return None
@@ -0,0 +1,73 @@
+import json
+from collections.abc import Iterator
+from core import MoveResult, State
+
+# game records are stored one per line as json, so a file can be appended
+# to as games finish and read back a game at a time however big it gets:
+#   {"white": "bot_a", "black": "bot_b", "seed": null,
+#    "moves": "c01 c15 ...", "result": "white", "times": [0.0123, ...],
+#    "forfeit": null, "error": null}
+# "moves" are the moves that went through, in order (see Move.to_token),
+# "times" are the seconds each one took, and "result" is the winner (null
+# if the game crashed, in which case "error" says why). "forfeit" is the
+# color that lost by running out of time or breaking, if that's how it ended
+type GameRecord = dict
+
+# what gets written out; anything else callers hang on a record stays in memory
+RECORD_FIELDS = ("white", "black", "seed", "moves", "result", "times", "forfeit", "error")
+
+
+def make_record(
+    white: str,
+    black: str,
+    game: State | None = None,
+    times: list[float] | None = None,
+    seed: int | None = None,
+    error: str | None = None,
+) -> GameRecord:
+    moves = []
+    if game is not None:
+        moves = [
+            move.to_token()
+            for (move, (result, _)) in game.logged_moves
+            if result not in (MoveResult.MOVE_FAILURE, MoveResult.ALREADY_OVER)
+        ]
+    return {
+        "white": white,
+        "black": black,
+        "seed": seed,
+        "moves": " ".join(moves),
+        "result": game.get_who_won() if game is not None else None,
+        # microseconds are plenty, and keep the lines short
+        "times": [round(t, 6) for t in times or []],
+        "forfeit": game.forfeited if game is not None else None,
+        "error": error,
+    }
+
+
+class RecordWriter:
+    # appends records to a file as they come in, flushing each one so
+    # nothing's lost if the run gets interrupted
+    def __init__(self, path: str):
+        self.file = open(path, "a")
+
+    def write(self, record: GameRecord) -> None:
+        record = {key: record.get(key) for key in RECORD_FIELDS}
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_records(path: str) -> Iterator[GameRecord]:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,125 @@
+import atexit
+import shutil
+import sys
+import time
+from typing import TextIO
+from core import HEIGHT, WIDTH, State, square_of
+
+# draws a game as it's played without redrawing the whole screen every
+# move. the first frame is drawn in full at the top of the screen; after
+# that only the squares whose top piece changed are rewritten, by moving
+# the cursor straight to them. the lines below the board are made into
+# their own scrolling region, so whatever else gets printed during the game
+# (bot output, prompts) scrolls under the board instead of pushing it off
+# screen. frames that come in faster than max_fps are skipped, so a fast
+# game over ssh doesn't spend all its time waiting on the terminal
+
+DEFAULT_MAX_FPS = 30.0
+
+# lines of State.board_text above the top row of squares, and in all
+_BOARD_TOP = 3
+_BOARD_LINES = 2 * HEIGHT + 5
+
+# the squares in the order they're drawn, with the (line, column) of each
+# counting from the top left of the board (as terminals do, from 1)
+_CELLS = [
+    (square_of(x, y), _BOARD_TOP + 1 + 2 * (HEIGHT - 1 - y), 3 + 4 * x)
+    for y in range(HEIGHT - 1, -1, -1)
+    for x in range(WIDTH)
+]
+
+
+# renderers that have set a scrolling region and not given it back yet, so
+# the terminal doesn't keep it after a ctrl-c. one exit hook does for all
+# of them, and close takes a renderer off again, so watching game after
+# game doesn't pile them up
+_drawing: set["BoardRenderer"] = set()
+
+
+@atexit.register
+def _close_drawing() -> None:
+    for renderer in list(_drawing):
+        renderer.close()
+
+
+class BoardRenderer:
+    def __init__(self, out: TextIO = sys.stdout, max_fps: float | None = DEFAULT_MAX_FPS):
+        self.out = out
+        self.min_interval = 1 / max_fps if max_fps else 0.0
+        self.last_frame = -float("inf")
+        # (top piece, stack height) last drawn on each square, or None before
+        # the first frame
+        self.drawn: dict[int, tuple[int, int] | None] | None = None
+        self.text = None
+        # whether a frame was skipped since the last one drawn
+        self.pending = False
+        self.frames = 0
+        self.cells_drawn = 0
+
+    def draw(self, state: State, text: str | None = None, force: bool = False) -> bool:
+        # show state (with text above it), unless the last frame was too
+        # recent. returns whether anything was drawn
+        now = time.perf_counter()
+        if not force and now - self.last_frame < self.min_interval:
+            self.pending = True
+            return False
+        self.last_frame = now
+        self.pending = False
+        self.frames += 1
+
+        if self.drawn is None or text != self.text:
+            self._draw_full(state, text)
+        else:
+            self._draw_changes(state)
+        self.out.flush()
+        return True
+
+    def _top(self) -> int:
+        # the board's first line on screen
+        return 1 + (len(self.text.split("\n")) if self.text is not None else 0)
+
+    def _draw_full(self, state: State, text: str | None) -> None:
+        _drawing.add(self)
+        self.text = text
+        self.drawn = {}
+        for (square, _, _) in _CELLS:
+            stack = state.stacks[square]
+            self.drawn[square] = (stack[-1], len(stack)) if stack else None
+        self.cells_drawn += len(_CELLS)
+        below = self._top() + _BOARD_LINES
+        # reset the scrolling region, clear the screen and go home
+        frame = ["\033[r\033[2J\033[H"]
+        if text is not None:
+            frame.append(text + "\n")
+        frame.append(state.board_text() + "\n")
+        # everything from the line under the board down scrolls on its own
+        # (on a terminal too short for that, it'll just have to scroll)
+        lines = shutil.get_terminal_size().lines
+        if below < lines:
+            frame.append(f"\033[{below};{lines}r\033[{below};1H")
+        self.out.write("".join(frame))
+
+    def _draw_changes(self, state: State) -> None:
+        top = self._top() - 1
+        frame = ["\0337"]  # save the cursor, wherever the last output left it
+        for (square, line, column) in _CELLS:
+            stack = state.stacks[square]
+            shown = (stack[-1], len(stack)) if stack else None
+            if shown != self.drawn[square]:
+                self.drawn[square] = shown
+                frame.append(f"\033[{top + line};{column}H{state.draw_cell(square)}")
+        self.cells_drawn += len(frame) - 1
+        frame.append("\0338")
+        self.out.write("".join(frame))
+
+    def close(self, state: State | None = None, text: str | None = None) -> None:
+        # draw state (usually the final position, which mustn't be skipped),
+        # then give the whole screen back to normal output below the board
+        if state is not None:
+            self.draw(state, text, force=True)
+        if self.drawn is not None:
+            # resetting the region moves the cursor, so put it back after
+            self.out.write("\0337\033[r\0338")
+            self.out.flush()
+            self.drawn = None
+            _drawing.discard(self)
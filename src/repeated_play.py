@@ -1,40 +1,241 @@
 #!/usr/bin/env python3
 
+import argparse
+import itertools
+import logging
+import os
 import sys
-from move_getters import get_from_bot
-from play_game import play_game
+import profiling
+from game_cache import GameCache
+from ratings import SPRT
+from records import RecordWriter, read_records
+from timing import MoveTimer
+from scheduler import run_games
 from core import Color
 
+parser = argparse.ArgumentParser(description="Play two bots against each other many times.")
+parser.add_argument("bot1")
+parser.add_argument("bot2")
+parser.add_argument("game_count", nargs="?", type=int, default=1000)
+parser.add_argument(
+    "--persistent",
+    action="store_true",
+    help="start each bot once for the whole series (see the README)",
+)
+parser.add_argument(
+    "--move-timeout",
+    type=float,
+    default=None,
+    help="seconds a bot gets per move before it forfeits the game",
+)
+parser.add_argument(
+    "--game-time-limit",
+    type=float,
+    default=None,
+    help="seconds a bot gets for all its moves in a game before it forfeits",
+)
+parser.add_argument(
+    "--book",
+    action="append",
+    default=[],
+    metavar="FILE",
+    help="an opening book or tablebase from book.py for the bots to use (can be given more than once)",
+)
+parser.add_argument(
+    "--sprt",
+    nargs=2,
+    type=float,
+    metavar=("ELO0", "ELO1"),
+    help="stop as soon as the games show bot1 is ELO0 or ELO1 stronger than bot2 (game_count becomes the most to play)",
+)
+parser.add_argument("--alpha", type=float, default=0.05, help="with --sprt, the chance of wrongly deciding ELO1")
+parser.add_argument("--beta", type=float, default=0.05, help="with --sprt, the chance of wrongly deciding ELO0")
+parser.add_argument(
+    "--timing", action="store_true", help="print how long each bot's moves took, phase by phase"
+)
+parser.add_argument(
+    "-j", "--jobs", type=int, default=1, help="how many games to play at once (default: 1)"
+)
+parser.add_argument(
+    "--records", metavar="FILE", help="append a record of every game to FILE (see records.py)"
+)
+parser.add_argument(
+    "--watch", action="store_true", help="draw every game as it's played (only with --jobs 1)"
+)
+parser.add_argument(
+    "--seed",
+    type=int,
+    default=None,
+    help="seed the games (SEED, SEED + 1, ... with each seed played once with each bot as white) and tell the bots",
+)
+parser.add_argument(
+    "--cache", metavar="FILE", help="with --seed, reuse games already played with the same bots and seeds from FILE"
+)
+parser.add_argument(
+    "--resume", action="store_true", help="carry on from the games already in --records instead of starting over"
+)
+parser.add_argument(
+    "--profile",
+    action="store_true",
+    help="count calls to the referee's hot paths and bot i/o and time them (also on with ZENER_PROFILE=1)",
+)
+parser.add_argument(
+    "--profile-dump",
+    metavar="FILE",
+    help="also run every game under cProfile and save the stats to FILE (pstats format, e.g. for snakeviz or flameprof)",
+)
+args = parser.parse_args()
+if args.profile or args.profile_dump:
+    profiling.enable(cprofile=args.profile_dump is not None)
+profiling.enable_from_env()
+if args.cache and args.seed is None:
+    parser.error("--cache only works for seeded games, so it needs --seed")
+if args.resume and not args.records:
+    parser.error("--resume needs --records to know what's been played")
+if args.watch:
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+
 p1_white_wins = 0
 p1_black_wins = 0
 p2_white_wins = 0
 p2_black_wins = 0
+crashed = 0
+forfeits = 0
+# games each bot had white in, not counting crashes
+p1_white_games = 0
+p2_white_games = 0
 
-GAME_COUNT = 1000
-if len(sys.argv) > 3:
-    GAME_COUNT = int(sys.argv[3])
-
-print(f"Running {GAME_COUNT} games where {sys.argv[1]} is white and {sys.argv[2]} is black")
-for _ in range(GAME_COUNT):
-    winner = play_game(
-        get_white_move=get_from_bot(sys.argv[1]),
-        get_black_move=get_from_bot(sys.argv[2]),
-    )
-    if winner == Color.WHITE:
-        p1_white_wins += 1
-    else:
-        p2_black_wins += 1
-print(f"Running {GAME_COUNT} games where {sys.argv[2]} is white and {sys.argv[1]} is black")
-for _ in range(GAME_COUNT):
-    winner = play_game(
-        get_white_move=get_from_bot(sys.argv[2]),
-        get_black_move=get_from_bot(sys.argv[1]),
-    )
-    if winner == Color.WHITE:
-        p2_white_wins += 1
+GAME_COUNT = args.game_count
+sprt = SPRT(*args.sprt, args.alpha, args.beta) if args.sprt else None
+
+
+def bot1_white_in(i: int) -> bool:
+    # in an SPRT run colors alternate so the test isn't thrown off by who
+    # goes first, otherwise bot1 is white for the first half
+    return i % 2 == 0 if sprt is not None else i < GAME_COUNT
+
+
+def planned(i: int) -> tuple[str, str, int | None]:
+    # the i'th game of the series. each seed is played once each way round
+    pair = i // 2 if sprt is not None else i % GAME_COUNT
+    seed = args.seed + pair if args.seed is not None else None
+    return (args.bot1, args.bot2, seed) if bot1_white_in(i) else (args.bot2, args.bot1, seed)
+
+
+# records from an earlier run of this series that got interrupted: as many
+# as line up with what we'd have played
+previous = []
+if args.resume and os.path.exists(args.records):
+    ignored = 0
+    for record in read_records(args.records):
+        if ignored or len(previous) == 2 * GAME_COUNT or (record["white"], record["black"], record["seed"]) != planned(len(previous)):
+            ignored += 1
+        else:
+            previous.append(record)
+    print(f"Resuming after the {len(previous)} games already in {args.records}")
+    if ignored:
+        print(f"WARN: {ignored} more records in {args.records} aren't part of this series and were ignored")
+
+
+def sprt_matchups():
+    # nothing new is started once the test has decided
+    for i in range(len(previous), 2 * GAME_COUNT):
+        if sprt.decision() is not None:
+            return
+        yield planned(i)
+
+
+if sprt is not None:
+    matchups = sprt_matchups()
+else:
+    # every game is independent, so queue the rest of the series up front
+    matchups = [planned(i) for i in range(len(previous), 2 * GAME_COUNT)]
+cache = GameCache(args.cache, args.book) if args.cache else None
+results = itertools.chain(
+    previous,
+    run_games(
+        matchups,
+        args.jobs,
+        args.persistent,
+        args.move_timeout,
+        args.watch,
+        args.game_time_limit,
+        args.book,
+        cache,
+    ),
+)
+timer = MoveTimer()
+run_profile = profiling.RunProfile()
+# (white, black, moves) of every game, to spot bots playing the same game over and over
+distinct = set()
+
+if sprt is not None:
+    print(f"Running up to {2 * GAME_COUNT} games, alternating colors, until the SPRT decides")
+else:
+    print(f"Running {GAME_COUNT} games where {args.bot1} is white and {args.bot2} is black")
+writer = RecordWriter(args.records) if args.records else None
+for (i, record) in enumerate(results):
+    if writer is not None and i >= len(previous):
+        writer.write(record)
+    for (color, phases) in record.get("phases", {}).items():
+        timer.merge(record[color], phases)
+    run_profile.merge(record.get("profile"))
+    winner, error = record["result"], record["error"]
+    bot1_white = bot1_white_in(i)
+    if i == GAME_COUNT and sprt is None:
+        print(f"Running {GAME_COUNT} games where {args.bot2} is white and {args.bot1} is black")
+    if error is not None:
+        print("A game crashed and won't be counted:")
+        print(error)
+        crashed += 1
+        continue
+    if record.get("forfeit") is not None:
+        forfeits += 1
+    distinct.add((record["white"], record["black"], record["moves"]))
+    if bot1_white:
+        p1_white_games += 1
+        if winner == Color.WHITE:
+            p1_white_wins += 1
+        else:
+            p2_black_wins += 1
     else:
-        p1_black_wins += 1
+        p2_white_games += 1
+        if winner == Color.WHITE:
+            p2_white_wins += 1
+        else:
+            p1_black_wins += 1
+    if sprt is not None:
+        sprt.add_result((winner == Color.WHITE) == bot1_white)
+if writer is not None:
+    writer.close()
+if cache is not None:
+    cache.close()
 
 print("RESULTS:")
-print(f"{sys.argv[1]} won {p1_white_wins} games as white ({p1_white_wins/GAME_COUNT:.0%}) and {p1_black_wins} as black ({p1_black_wins/GAME_COUNT:.0%})")
-print(f"{sys.argv[2]} won {p2_white_wins} games as white ({p2_white_wins/GAME_COUNT:.0%}) and {p2_black_wins} as black ({p2_black_wins/GAME_COUNT:.0%})")
+if sprt is not None:
+    # the test stops early, so there aren't GAME_COUNT games of each
+    p1_white_count, p2_white_count = max(p1_white_games, 1), max(p2_white_games, 1)
+else:
+    p1_white_count = p2_white_count = GAME_COUNT
+print(f"{args.bot1} won {p1_white_wins} games as white ({p1_white_wins/p1_white_count:.0%}) and {p1_black_wins} as black ({p1_black_wins/p2_white_count:.0%})")
+print(f"{args.bot2} won {p2_white_wins} games as white ({p2_white_wins/p2_white_count:.0%}) and {p2_black_wins} as black ({p2_black_wins/p1_white_count:.0%})")
+if sprt is not None:
+    games = p1_white_games + p2_white_games
+    if (decision := sprt.decision()) is None:
+        print(f"SPRT: undecided after {games} games (LLR {sprt.llr:.2f}, bounds {sprt.lower:.2f} to {sprt.upper:.2f})")
+    else:
+        elo = args.sprt[1] if decision == "h1" else args.sprt[0]
+        print(f"SPRT: {args.bot1} is {elo:g} elo stronger than {args.bot2}, decided after {games} games (LLR {sprt.llr:.2f})")
+if crashed > 0:
+    print(f"{crashed} games crashed and weren't counted")
+played = p1_white_games + p2_white_games
+if len(distinct) < played:
+    if args.seed is None:
+        print(f"only {len(distinct)} of the {played} games were different (seed the bots with --seed to vary them)")
+    else:
+        print(f"only {len(distinct)} of the {played} games were different (the bots don't use the seed, or not much)")
+if cache is not None and cache.hits > 0:
+    print(f"{cache.hits} games were taken from {args.cache} instead of being played")
+if forfeits > 0:
+    print(f"{forfeits} games were won by forfeit (a bot ran out of time or stopped answering)")
+profiling.print_report(run_profile, args.profile_dump, timer if args.timing else None)
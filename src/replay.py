@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+import time
+from core import Color, Move, MoveResult, State
+from records import GameRecord, read_records
+from render import BoardRenderer
+
+
+def replay(record: GameRecord) -> tuple[State, str | None]:
+    # re-run a record's moves through the rules, returning the final state
+    # and what's wrong with the record (or None if it checks out)
+    state = State()
+    for (i, token) in enumerate(record["moves"].split()):
+        try:
+            move = Move.from_token(state.next_move[0], token)
+        except ValueError:
+            return state, f"can't read move {token!r}"
+        result, _ = state.try_move(move)
+        if result in (MoveResult.MOVE_FAILURE, MoveResult.ALREADY_OVER):
+            return state, f"{move} isn't allowed after {i} moves"
+    if (loser := record.get("forfeit")) is not None:
+        # older records don't have this. the moves stop wherever the loser ran out
+        if state.winner is not None:
+            return state, f"{loser} forfeited a game that was already over"
+        state.forfeit(Color(loser))
+    if state.get_who_won() != record["result"]:
+        return state, f"game should have been won by {record['result']}, but was won by {state.get_who_won()}"
+    if len(record["times"]) != len(state.logged_moves):
+        return state, f"has {len(record['times'])} move times for {len(state.logged_moves)} moves"
+    return state, None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check game records by replaying them.")
+    parser.add_argument("files", nargs="+", help="record files written with --records")
+    parser.add_argument("--show", type=int, metavar="N", help="draw game N (counting from 0) move by move")
+    parser.add_argument("--delay", type=float, default=0.25, help="seconds between moves with --show")
+    args = parser.parse_args()
+
+    checked = 0
+    crashed = 0
+    bad = 0
+    for path in args.files:
+        for (i, record) in enumerate(read_records(path)):
+            if args.show is not None:
+                if i != args.show:
+                    continue
+                state = State()
+                renderer = BoardRenderer()
+                title = f"{record['white']} (white) vs {record['black']} (black)"
+                for token in record["moves"].split():
+                    renderer.draw(state, title)
+                    time.sleep(args.delay)
+                    state.try_move(Move.from_token(state.next_move[0], token))
+                renderer.close(state, title)
+                if record.get("forfeit") is not None:
+                    state.forfeit(Color(record["forfeit"]))
+                    print(f"{record['forfeit']} forfeited")
+                print(f"Winner: {state.get_who_won()}")
+                sys.exit(0)
+
+            if record["error"] is not None:
+                crashed += 1
+                continue
+            _, problem = replay(record)
+            checked += 1
+            if problem is not None:
+                bad += 1
+                print(f"{path}:{i + 1}: {problem}")
+
+    print(f"{checked} games replayed, {bad} didn't match, {crashed} crashed games skipped")
+    sys.exit(1 if bad > 0 else 0)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import sys
+from core import COLORS, DESTINATIONS, HEIGHT, MOVE_TABLE, SHAPES, WIDTH, Color, MoveResult, State, square_of
+
+# plays random games with State and with a frozen copy of the rules as they
+# were before State was rebuilt around flat arrays (the original
+# dict-of-Pieces version, minus the drawing and printing), and checks they
+# agree after every move: the valid moves, what happens to each move tried
+# (random invalid ones too), the pieces, whose turn it is and who won. it
+# also checks State's incrementally kept counts (unburied pieces and their
+# destinations per color) against counting them by hand, and that making
+# and unmaking a few moves at random leaves the position exactly as it was.
+# perft.py --check pins down move generation from a handful of positions;
+# this covers the rest of the rules over as many games as you like
+
+
+class _OldPiece:
+    def __init__(self, shape, x, y, height, color):
+        self.shape = shape
+        self.x = x
+        self.y = y
+        self.height = height
+        self.color = color
+
+
+class OldState:
+    # don't "fix" or speed this up: it's only useful as long as it stays
+    # the way it was. the one addition is the deadlock rule from
+    # State._make_move, where this used to loop forever
+    def __init__(self):
+        self.state = {
+            Color.WHITE: {shape: _OldPiece(shape, i, 0, 1, Color.WHITE) for (i, shape) in enumerate(SHAPES)},
+            Color.BLACK: {
+                shape: _OldPiece(shape, (WIDTH - 1) - i, HEIGHT - 1, 1, Color.BLACK) for (i, shape) in enumerate(SHAPES)
+            },
+        }
+        self.next_move = (Color.WHITE, None)
+        self.prev_piece = None
+        self.winner = None
+
+    def _all_pieces(self):
+        return [piece for colored_pieces in self.state.values() for piece in colored_pieces.values()]
+
+    def get_valid_moves(self) -> list[tuple[Color, str, int, int]]:
+        player, piece_to_move = self.next_move
+        colored_pieces = self.state[player]
+        if piece_to_move is not None:
+            pieces = [colored_pieces[piece_to_move]]
+        else:
+            pieces = colored_pieces.values()
+
+        ret = []
+        for moving_piece in pieces:
+            if moving_piece.shape == self.prev_piece and piece_to_move is None:
+                continue
+            under = False
+            for p in self._all_pieces():
+                if (p.x, p.y) == (moving_piece.x, moving_piece.y) and p.height > moving_piece.height:
+                    under = True
+                    break
+            if under:
+                continue
+            x_range = range(5)
+            range_offset = 0 if player == Color.WHITE else -1
+            y_range = range(0 + range_offset, 8 + range_offset)
+            ret.extend(
+                (player, moving_piece.shape, final_x, final_y)
+                for (dir_x, dir_y) in [(-1, 0), (1, 0), (0, -1), (0, 1)]
+                if (final_x := moving_piece.x + dir_x) in x_range and (final_y := moving_piece.y + dir_y) in y_range
+            )
+        return ret
+
+    def get_player_cant_move(self) -> Color | None:
+        for player in Color:
+            old_next = self.next_move
+            old_prev = self.prev_piece
+            self.next_move = (player, None)
+            self.prev_piece = None
+            if self.get_valid_moves() == []:
+                return player
+            self.next_move = old_next
+            self.prev_piece = old_prev
+        return None
+
+    def try_move(self, move: tuple[Color, str, int, int]) -> MoveResult:
+        if self.winner is not None:
+            return MoveResult.ALREADY_OVER
+        if move not in self.get_valid_moves():
+            return MoveResult.MOVE_FAILURE
+
+        player, shape, x, y = move
+        piece = self.state[player][shape]
+        piece.x = x
+        piece.y = y
+        piece.height = sum(1 for p in self._all_pieces() if (p.x, p.y) == (piece.x, piece.y))
+
+        if piece.y not in range(HEIGHT):
+            self.winner = player
+            return MoveResult.win_for_player(self.winner)
+
+        self.prev_piece = shape
+        if self.next_move[1] is None:
+            self.next_move = (player.other(), shape)
+        else:
+            self.next_move = (self.next_move[0], None)
+
+        if (loser := self.get_player_cant_move()) is not None:
+            self.winner = loser.other()
+            return MoveResult.win_for_player(self.winner)
+
+        skipped = 0
+        while self.get_valid_moves() == []:
+            if self.next_move[1] is not None:
+                self.next_move = (self.next_move[0], None)
+            else:
+                self.next_move = (self.next_move[0].other(), None)
+                skipped += 1
+                if skipped == len(COLORS):
+                    self.prev_piece = None
+        return MoveResult.MOVE_SUCCESS
+
+
+def _as_tuple(move) -> tuple[Color, str, int, int]:
+    return (move.player, move.shape, move.x, move.y)
+
+
+def compare(state: State, old: OldState) -> list[str]:
+    # everything that differs between the two, as readable lines
+    problems = []
+    new_moves = sorted(map(_as_tuple, state.get_valid_moves())) if state.winner is None else []
+    old_moves = sorted(old.get_valid_moves()) if old.winner is None else []
+    if new_moves != old_moves:
+        problems.append(f"valid moves differ: {new_moves} vs {old_moves}")
+    if state.winner != old.winner:
+        problems.append(f"winner is {state.winner}, should be {old.winner}")
+    # the old get_player_cant_move leaves next_move half changed once
+    # someone's lost, so the turn only means something while the game's on
+    if old.winner is None and (state.next_move, state.prev_piece) != (old.next_move, old.prev_piece):
+        problems.append(f"turn is {state.next_move} after {state.prev_piece}, should be {old.next_move} after {old.prev_piece}")
+    board = state.get_full_board()
+    for (color, colored_pieces) in old.state.items():
+        for (shape, piece) in colored_pieces.items():
+            got = board[color][shape]
+            if (got.x, got.y, got.height) != (piece.x, piece.y, piece.height):
+                problems.append(
+                    f"{color} {shape} is at ({got.x}, {got.y}) height {got.height},"
+                    f" should be ({piece.x}, {piece.y}) height {piece.height}"
+                )
+
+    # the counts State keeps up to date as it goes, done the slow way
+    unburied = [0, 0]
+    destinations = [0, 0]
+    for (c, color) in enumerate(COLORS):
+        for piece in old.state[color].values():
+            if all(not ((p.x, p.y) == (piece.x, piece.y) and p.height > piece.height) for p in old._all_pieces()):
+                unburied[c] += 1
+                destinations[c] += len(DESTINATIONS[c][square_of(piece.x, piece.y)])
+    if state.unburied != unburied or state.destination_counts != destinations:
+        problems.append(
+            f"counts are {state.unburied} unburied with {state.destination_counts} destinations,"
+            f" should be {unburied} with {destinations}"
+        )
+    return problems
+
+
+def _try_unmake(state: State, rng: random.Random, depth: int) -> list[str]:
+    # make up to depth random moves and take them all back again
+    before = (state.to_bytes(), state.get_zobrist(), list(state.unburied), list(state.destination_counts))
+    made = []
+    for _ in range(depth):
+        if state.winner is not None or not (moves := state.get_valid_moves()):
+            break
+        move = rng.choice(moves)
+        state.make_move(move)
+        made.append(move.to_token())
+    for _ in made:
+        state.unmake_move()
+    after = (state.to_bytes(), state.get_zobrist(), list(state.unburied), list(state.destination_counts))
+    if after != before:
+        return [f"making and unmaking {' '.join(made)} changed the position"]
+    return []
+
+
+def check_game(rng: random.Random, max_plies: int = 1000) -> tuple[list[str], list[str], int]:
+    # (problems, the moves played so far, moves tried)
+    state = State()
+    old = OldState()
+    tokens = []
+    tried = 0
+    while state.winner is None and len(tokens) < max_plies:
+        if problems := compare(state, old) + _try_unmake(state, rng, rng.randrange(4)):
+            return problems, tokens, tried
+        player = state.next_move[0]
+        if rng.random() < 0.2:
+            # anything at all this player could try, which is usually invalid
+            move = rng.choice([move for move in MOVE_TABLE if move is not None and move.player == player])
+        else:
+            move = rng.choice(state.get_valid_moves())
+        tried += 1
+        result, _ = state.try_move(move)
+        expected = old.try_move(_as_tuple(move))
+        if result != expected:
+            return [f"{move.to_token()} gave {result}, should be {expected}"], tokens, tried
+        if result != MoveResult.MOVE_FAILURE:
+            tokens.append(move.to_token())
+    return compare(state, old), tokens, tried
+
+
+def check(games: int, seed: int) -> bool:
+    tried = 0
+    for game in range(games):
+        problems, tokens, moves = check_game(random.Random(f"{seed}:{game}"))
+        tried += moves
+        if problems:
+            print(f"FAIL: game {game} (seed {seed}) after {' '.join(tokens) or 'no moves'}:")
+            for problem in problems:
+                print(f"  {problem}")
+            return False
+    print(f"ok: {games} games, {tried} moves tried")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check State against a frozen copy of the original rules.")
+    parser.add_argument("games", nargs="?", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.exit(0 if check(args.games, args.seed) else 1)
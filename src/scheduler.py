@@ -0,0 +1,173 @@
+import traceback
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import profiling
+from book import PositionTable
+from game_cache import GameCache
+from move_getters import get_from_spec
+from play_game import MoveGetter, play_game
+from records import GameRecord, make_record
+from timing import MoveTimer
+
+# (white bot, black bot), optionally with the game's seed on the end
+type Matchup = tuple[str, str] | tuple[str, str, int | None]
+
+# getters are kept around per process, so persistent bots only start once
+# per worker rather than once per game
+_getters: dict[str, MoveGetter] = {}
+_options: dict = {}
+
+
+def _init_worker(
+    persistent: bool,
+    move_timeout: float | None,
+    game_time_limit: float | None,
+    watch: bool,
+    tables: list[str],
+) -> None:
+    # tables are opened once per worker; they're mmapped, so the workers
+    # all share the same copy in memory. profiling is passed on through
+    # its environment variable
+    profiling.enable_from_env()
+    _options.update(
+        persistent=persistent,
+        move_timeout=move_timeout,
+        game_time_limit=game_time_limit,
+        watch=watch,
+        tables=[PositionTable(path) for path in tables],
+    )
+
+
+def _get_getter(bot: str) -> MoveGetter:
+    if bot not in _getters:
+        _getters[bot] = get_from_spec(
+            bot, _options["persistent"], _options["move_timeout"], _options["tables"]
+        )
+    return _getters[bot]
+
+
+def _play_one(matchup: Matchup) -> GameRecord:
+    white_bot, black_bot, *rest = matchup
+    seed = rest[0] if rest else None
+    finished = []
+    timer = MoveTimer()
+    profiler = profiling.start_game()
+    try:
+        play_game(
+            _get_getter(white_bot),
+            _get_getter(black_bot),
+            headless=not _options["watch"],
+            end_of_game_hook=lambda game, times: finished.append((game, times)),
+            timer=timer,
+            move_time_limit=_options["move_timeout"],
+            game_time_limit=_options["game_time_limit"],
+            seed=seed,
+        )
+        record = make_record(white_bot, black_bot, *finished[0], seed=seed)
+        # per-phase timings by color, for MoveTimer.merge, and the hot path
+        # counters if profiling's on, for RunProfile.merge. not saved by RecordWriter
+        record["phases"] = timer.samples
+        record["profile"] = profiling.finish_game(profiler)
+        return record
+    except Exception:
+        # one broken bot shouldn't take the rest of the run down with it
+        record = make_record(white_bot, black_bot, seed=seed, error=traceback.format_exc())
+        record["profile"] = profiling.finish_game(profiler)
+        return record
+
+
+def _close_getters() -> None:
+    for getter in _getters.values():
+        getter.close()
+    _getters.clear()
+
+
+def run_games(
+    matchups: Iterable[Matchup],
+    jobs: int = 1,
+    persistent: bool = False,
+    move_timeout: float | None = None,
+    watch: bool = False,
+    game_time_limit: float | None = None,
+    tables: list[str] = (),
+    cache: GameCache | None = None,
+) -> Iterator[GameRecord]:
+    # yields game records (see records.py) in the same order as matchups, no matter which games
+    # actually finish first, so tallies come out the same for any jobs count.
+    # games are only drawn with watch=True, and never when running in parallel.
+    # a bot that takes longer than move_timeout for a move, or game_time_limit
+    # for all of its moves in a game, forfeits that game. tables are paths to
+    # opening books or tablebases for the bots to use (see book.py).
+    # matchups is read lazily, never more than `jobs` games ahead of the
+    # records handed back, so it can pick the next games from the results
+    # so far (see ratings.RatingScheduler). seeded games that are in cache
+    # aren't played again, and the ones that are played go in it
+    def cached(matchup: Matchup) -> GameRecord | None:
+        if cache is None or len(matchup) < 3:
+            return None
+        return cache.get(*matchup)
+
+    def played(record: GameRecord) -> GameRecord:
+        if cache is not None:
+            cache.put(record)
+        return record
+
+    if jobs <= 1:
+        _init_worker(persistent, move_timeout, game_time_limit, watch, tables)
+        try:
+            for matchup in matchups:
+                yield cached(matchup) or played(_play_one(matchup))
+        finally:
+            _close_getters()
+        return
+
+    def open_pool() -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(persistent, move_timeout, game_time_limit, False, tables),
+        )
+
+    # a worker that dies outright (os._exit, a segfault in native code)
+    # instead of raising breaks the whole pool: every game running in it is
+    # counted as crashed, since there's no telling which one did it, and
+    # the games after them get a new pool
+    pool = open_pool()
+
+    # records from the cache go in the queue as they are, in their turn
+    def start(matchup: Matchup) -> Future | GameRecord:
+        nonlocal pool
+        if (record := cached(matchup)) is not None:
+            return record
+        try:
+            return pool.submit(_play_one, matchup)
+        except BrokenProcessPool:
+            pool.shutdown(wait=False)
+            pool = open_pool()
+            return pool.submit(_play_one, matchup)
+
+    def result(matchup: Matchup, game: Future) -> GameRecord:
+        try:
+            return played(game.result())
+        except BrokenProcessPool as e:
+            white_bot, black_bot, *rest = matchup
+            return make_record(
+                white_bot,
+                black_bot,
+                seed=rest[0] if rest else None,
+                error=f"a worker process died while playing this game or one alongside it: {e}",
+            )
+
+    try:
+        matchups = iter(matchups)
+        running = deque((matchup, start(matchup)) for (_, matchup) in zip(range(jobs), matchups))
+        while running:
+            matchup, game = running.popleft()
+            yield result(matchup, game) if isinstance(game, Future) else game
+            if (matchup := next(matchups, None)) is not None:
+                running.append((matchup, start(matchup)))
+    finally:
+        pool.shutdown()
+
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+from collections.abc import Awaitable, Callable
+from bots import BUILTIN_PREFIX, get_builtin
+from core import Color, Move, MoveResult, State
+from move_getters import FORMATS_ENV_VAR, HANDSHAKE_TIMEOUT, PERSISTENT_ENV_VAR, PERSISTENT_PROTOCOL
+from play_game import BotError, MoveGetter
+from records import RECORD_FIELDS, GameRecord, RecordWriter, make_record
+from wire import FORMAT_DELTA, FORMAT_JSON, FORMATS, decode_compact, decode_json, encode_compact, encode_json, flat_pieces
+
+# a referee that runs lots of games at once on one asyncio event loop, so
+# hundreds of matches only cost the bots' own processes rather than a thread
+# (or process) each. it listens for match requests as lines of json, e.g.
+#   {"white": "bots/a.py", "black": "builtin:greedy", "games": 10}
+# queues the games, and streams a record (see records.py) back to whoever
+# asked as each game finishes, in the order they finish, then {"done": 10}.
+# bots are the same specs as everywhere else, plus "tcp:HOST:PORT" and
+# "unix:PATH" for bots that are already running and listening on a socket;
+# those get a fresh connection per game and always speak the persistent
+# protocol (the handshake included). anyone who can reach the server can
+# run any program on it, so it only listens on localhost unless told otherwise
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 7795
+
+type AsyncMoveGetter = Callable[..., Awaitable[Move]]
+
+
+class AsyncBot:
+    # a bot for one game, driven through non-blocking pipes or a socket.
+    # program bots that answer the persistent handshake stay running for
+    # the game, the rest are started once per move. unlike BotProcess a bot
+    # that dies isn't restarted: it just forfeits
+    # whether each program has answered the handshake before, so one-shot
+    # bots don't keep everyone waiting for it every game
+    speaks_persistent: dict[str, bool] = {}
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        self.proc = None
+        self.reader = None
+        self.writer = None
+        self.persistent = False
+        self.format = FORMAT_JSON
+        # the pieces as of the last message a delta bot was sent
+        self.last_pieces = None
+
+    async def start(self) -> None:
+        if self.spec.startswith("tcp:"):
+            host, port = self.spec.removeprefix("tcp:").rsplit(":", 1)
+            self.reader, self.writer = await asyncio.open_connection(host, int(port))
+        elif self.spec.startswith("unix:"):
+            self.reader, self.writer = await asyncio.open_unix_connection(self.spec.removeprefix("unix:"))
+        elif not self.speaks_persistent.get(self.spec, True):
+            return
+        else:
+            self.proc = await self._spawn(
+                env=dict(os.environ, **{PERSISTENT_ENV_VAR: PERSISTENT_PROTOCOL, FORMATS_ENV_VAR: ",".join(FORMATS)})
+            )
+            self.reader, self.writer = self.proc.stdout, self.proc.stdin
+
+        try:
+            hello = json.loads(await asyncio.wait_for(self.reader.readline(), HANDSHAKE_TIMEOUT))
+            self.persistent = hello["protocol"] == PERSISTENT_PROTOCOL
+            self.format = hello.get("format", FORMAT_JSON)
+        except (TimeoutError, TypeError, ValueError, KeyError, AttributeError):
+            self.persistent = False
+        if self.format not in FORMATS:
+            logger.warning(f"WARN: {self.spec} asked for unknown format {self.format!r}, sending json")
+            self.format = FORMAT_JSON
+        if self.proc is None and not self.persistent:
+            raise BotError(f"{self.spec} didn't answer the persistent handshake")
+        if not self.persistent:
+            if self.spec not in self.speaks_persistent:
+                logger.warning(f"WARN: {self.spec} didn't answer the persistent handshake, running it once per move")
+            await self.close()
+        self.speaks_persistent[self.spec] = self.persistent
+
+    async def _spawn(self, env: dict | None = None) -> asyncio.subprocess.Process:
+        proc = await asyncio.create_subprocess_exec(
+            self.spec,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+        )
+        if env is not None:
+            # persistent bots can write to stderr whenever they like, so it's
+            # read as it comes instead of letting the pipe fill up
+            asyncio.create_task(self._log_stderr(proc.stderr))
+        return proc
+
+    async def _log_stderr(self, stream: asyncio.StreamReader) -> None:
+        while line := await stream.readline():
+            logger.info(f"{self.spec} stderr: {line.decode(errors='replace').rstrip()}")
+
+    def _encode(self, player, board, valid, responding, prev) -> str:
+        if self.format == FORMAT_JSON:
+            return encode_json(player, board, valid, responding, prev)
+        pieces = flat_pieces(board)
+        line = encode_compact(player, pieces, valid, responding, prev, self.last_pieces)
+        if self.format == FORMAT_DELTA:
+            self.last_pieces = pieces
+        return line
+
+    async def __call__(self, player, board, valid, responding, prev, required_move) -> Move:
+        line = self._encode(player, board, valid, responding, prev)
+        if self.persistent:
+            try:
+                self.writer.write(line.encode() + b"\n")
+                await self.writer.drain()
+            except (ConnectionError, OSError):
+                raise BotError(f"couldn't send {self.spec} its move")
+            answer = await self.reader.readline()
+            if not answer:
+                raise BotError(f"{self.spec} hung up")
+        else:
+            proc = await self._spawn()
+            try:
+                answer, stderr = await proc.communicate(line.encode())
+            except asyncio.CancelledError:
+                # it ran out of time
+                proc.kill()
+                await proc.wait()
+                raise
+            if stderr:
+                logger.info(f"{self.spec} stderr: {stderr.decode(errors='replace').rstrip()}")
+
+        try:
+            if self.format == FORMAT_JSON:
+                return decode_json(player, answer)
+            return decode_compact(player, answer)
+        except (ValueError, KeyError, TypeError, IndexError):
+            raise BotError(f"{self.spec} answered with something that isn't a move: {answer!r}")
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.proc is not None:
+            if self.proc.returncode is None:
+                self.proc.kill()
+            await self.proc.wait()
+            self.proc = None
+
+
+class ThreadedBot:
+    # a built-in bot, run in the event loop's thread pool so a deep search
+    # doesn't hold up every other game
+    def __init__(self, getter: MoveGetter):
+        self.getter = getter
+
+    async def start(self) -> None:
+        pass
+
+    async def __call__(self, *args) -> Move:
+        return await asyncio.to_thread(self.getter, *args)
+
+    async def close(self) -> None:
+        getattr(self.getter, "close", lambda: None)()
+
+
+def make_bot(spec: str) -> AsyncBot | ThreadedBot:
+    if spec.startswith(BUILTIN_PREFIX):
+        return ThreadedBot(get_builtin(spec.removeprefix(BUILTIN_PREFIX)))
+    return AsyncBot(spec)
+
+
+async def play_game_async(
+    get_white_move: AsyncMoveGetter,
+    get_black_move: AsyncMoveGetter,
+    move_time_limit: float | None = None,
+    game_time_limit: float | None = None,
+) -> tuple[State, list[float]]:
+    # play_game for the event loop, always headless: the finished game and
+    # how long each move that went through took. the same forfeit rules apply
+    game = State()
+    move_times = []
+    thinking_time = 0.0
+    clocks = {color: 0.0 for color in Color}
+    while game.winner is None:
+        board = game.get_board_view()
+        valid = game.get_valid_moves()
+        player, responding, prev = game.get_next_move_new()
+        _, required_move = game.get_next_move()
+        getter = get_white_move if player == Color.WHITE else get_black_move
+
+        limits = [move_time_limit] if move_time_limit is not None else []
+        if game_time_limit is not None:
+            limits.append(max(game_time_limit - clocks[player], 0.0))
+        start = time.perf_counter()
+        try:
+            move = await asyncio.wait_for(
+                getter(player, board, valid, responding, prev, required_move), min(limits, default=None)
+            )
+        except TimeoutError:
+            logger.info(f"{player} ran out of time")
+            move = None
+        except BotError as e:
+            logger.warning(f"WARN: {e}")
+            move = None
+        elapsed = time.perf_counter() - start
+        thinking_time += elapsed
+        clocks[player] += elapsed
+
+        if move is None:
+            game.forfeit(player)
+            break
+        response, _ = game.try_move(move)
+        if response != MoveResult.MOVE_FAILURE:
+            move_times.append(thinking_time)
+            thinking_time = 0.0
+    return game, move_times
+
+
+class MatchServer:
+    # a queue of games and `concurrency` tasks playing them
+    def __init__(
+        self, concurrency: int = 100, move_timeout: float | None = None, game_time_limit: float | None = None
+    ):
+        self.concurrency = concurrency
+        self.move_timeout = move_timeout
+        self.game_time_limit = game_time_limit
+        # (white, black, where to put the record)
+        self.queue: asyncio.Queue[tuple[str, str, asyncio.Queue]] = asyncio.Queue()
+        self.workers = []
+        self.playing = 0
+
+    def start(self) -> None:
+        self.workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    def submit(self, white: str, black: str, games: int = 1) -> asyncio.Queue:
+        # a queue that'll get one record per game as they finish
+        results = asyncio.Queue()
+        for _ in range(games):
+            self.queue.put_nowait((white, black, results))
+        return results
+
+    async def _work(self) -> None:
+        while True:
+            white, black, results = await self.queue.get()
+            self.playing += 1
+            try:
+                results.put_nowait(await self.play(white, black))
+            finally:
+                self.playing -= 1
+
+    async def play(self, white: str, black: str) -> GameRecord:
+        bots = [make_bot(white), make_bot(black)]
+        try:
+            for bot in bots:
+                await bot.start()
+            game, times = await play_game_async(*bots, self.move_timeout, self.game_time_limit)
+            return make_record(white, black, game, times)
+        except Exception:
+            return make_record(white, black, error=traceback.format_exc())
+        finally:
+            for bot in bots:
+                await bot.close()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # one request per line; each one's records are streamed back before
+        # the next request is read
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    white, black, games = request["white"], request["black"], int(request.get("games", 1))
+                except (ValueError, KeyError, TypeError):
+                    writer.write(json.dumps({"error": f"bad request: {line.decode(errors='replace')!r}"}).encode() + b"\n")
+                    await writer.drain()
+                    continue
+                results = self.submit(white, black, games)
+                for _ in range(games):
+                    record = await results.get()
+                    record = {key: record.get(key) for key in RECORD_FIELDS}
+                    writer.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+                    await writer.drain()
+                writer.write(json.dumps({"done": games}).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host: str, port: int, server: MatchServer) -> None:
+    server.start()
+    listener = await asyncio.start_server(server.handle_client, host, port)
+    print(f"listening on {host}:{port}, playing up to {server.concurrency} games at once")
+    async with listener:
+        await listener.serve_forever()
+
+
+def tally(record: GameRecord, wins: dict[str, int]) -> None:
+    if record.get("error") is not None:
+        wins["crashed"] = wins.get("crashed", 0) + 1
+    elif record["result"] is not None:
+        winner = record[record["result"]]
+        wins[winner] = wins.get(winner, 0) + 1
+
+
+async def submit(host: str, port: int, white: str, black: str, games: int, records: str | None) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(json.dumps({"white": white, "black": black, "games": games}).encode() + b"\n")
+    await writer.drain()
+    record_writer = RecordWriter(records) if records else None
+    wins = {}
+    while line := await reader.readline():
+        message = json.loads(line)
+        if "done" in message or ("error" in message and "white" not in message):
+            if "error" in message:
+                print(message["error"])
+            break
+        if record_writer is not None:
+            record_writer.write(message)
+        tally(message, wins)
+        print(f"white: {message['white']}; black: {message['black']}; winner: {message['result']}")
+    writer.close()
+    if record_writer is not None:
+        record_writer.close()
+    print("RESULTS:")
+    for (name, count) in wins.items():
+        print(f"- {count} ({name})")
+
+
+async def play_locally(white: str, black: str, games: int, server: MatchServer) -> None:
+    # no network, just the queue: handy for seeing how many games one
+    # process can keep going at once
+    server.start()
+    start = time.perf_counter()
+    half = games // 2
+    queues = [server.submit(white, black, games - half), server.submit(black, white, half)]
+    wins = {}
+    for (results, count) in zip(queues, (games - half, half)):
+        for _ in range(count):
+            tally(await results.get(), wins)
+    elapsed = time.perf_counter() - start
+    await server.stop()
+    print(f"{games} games in {elapsed:.2f}s ({games / elapsed:.1f} games/s), up to {server.concurrency} at once")
+    for (name, count) in wins.items():
+        print(f"- {count} ({name})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Host lots of games at once on one event loop.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="take match requests over tcp")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    submit_parser = commands.add_parser("submit", help="ask a running server for some games and print the results")
+    submit_parser.add_argument("white")
+    submit_parser.add_argument("black")
+    submit_parser.add_argument("--games", type=int, default=1)
+    submit_parser.add_argument("--host", default="127.0.0.1")
+    submit_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    submit_parser.add_argument("--records", metavar="FILE", help="append a record of every game to FILE")
+    play_parser = commands.add_parser("play", help="play games in this process, half with each bot as white")
+    play_parser.add_argument("white")
+    play_parser.add_argument("black")
+    play_parser.add_argument("--games", type=int, default=100)
+    for subparser in (serve_parser, play_parser):
+        subparser.add_argument("--concurrency", type=int, default=100, help="most games to play at once")
+        subparser.add_argument("--move-timeout", type=float, default=None)
+        subparser.add_argument("--game-time-limit", type=float, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(message)s", stream=sys.stdout)
+
+    if args.command == "submit":
+        asyncio.run(submit(args.host, args.port, args.white, args.black, args.games, args.records))
+    else:
+        match_server = MatchServer(args.concurrency, args.move_timeout, args.game_time_limit)
+        if args.command == "serve":
+            asyncio.run(serve(args.host, args.port, match_server))
+        else:
+            asyncio.run(play_locally(args.white, args.black, args.games, match_server))
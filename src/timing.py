@@ -0,0 +1,50 @@
+# where the time goes in each move. bots run as programs report every
+# phase; built-in bots only have "total" and "referee"
+#   spawn+think: for bots run once per move, starting the bot and waiting
+#            for it to answer and exit. its startup and its thinking can't
+#            be told apart from outside, so they're one phase
+#   restart: time a persistent bot lost to crashing or hanging: waiting on
+#            the attempts that failed and starting it again. it isn't
+#            charged to the bot's clock
+#   encode:  building the json we send
+#   think:   waiting for a persistent bot's answer
+#   decode:  parsing the answer
+#   total:   the whole call to the MoveGetter, all of the above included
+#   referee: checking and applying the move
+PHASES = ("spawn+think", "restart", "encode", "think", "decode", "total", "referee")
+
+
+def percentile(sorted_samples: list[float], fraction: float) -> float:
+    # nearest-rank, which is plenty for a summary table
+    index = min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))
+    return sorted_samples[index]
+
+
+class MoveTimer:
+    # seconds per move, by player and phase
+    def __init__(self):
+        self.samples: dict[str, dict[str, list[float]]] = {}
+
+    def add(self, name: str, phase: str, seconds: float) -> None:
+        self.samples.setdefault(name, {}).setdefault(phase, []).append(seconds)
+
+    def merge(self, name: str, phases: dict[str, list[float]]) -> None:
+        # fold in another timer's samples for one player, e.g. from a game
+        # played in another process, under the name we know them by
+        for (phase, seconds) in phases.items():
+            self.samples.setdefault(name, {}).setdefault(phase, []).extend(seconds)
+
+    def summary(self) -> list[str]:
+        lines = []
+        for name in sorted(self.samples):
+            lines.append(f"{name}:")
+            for phase in PHASES:
+                if not (seconds := sorted(self.samples[name].get(phase, []))):
+                    continue
+                lines.append(
+                    f"  {phase:<11} p50 {percentile(seconds, 0.5) * 1000:9.3f}ms"
+                    f"  p95 {percentile(seconds, 0.95) * 1000:9.3f}ms"
+                    f"  max {seconds[-1] * 1000:9.3f}ms"
+                    f"  ({len(seconds)} moves)"
+                )
+        return lines
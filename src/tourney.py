@@ -1,11 +1,90 @@
 #!/usr/bin/env python3
 
+import argparse
+import logging
 import sys
+import profiling
 from core import Color
-from move_getters import get_from_bot
-from play_game import play_game
+from ratings import RatingScheduler
+from records import RecordWriter
+from timing import MoveTimer
+from scheduler import run_games
 
-PLAYERS = sys.argv[1:]
+parser = argparse.ArgumentParser(description="Play a round robin between bots.")
+parser.add_argument("players", nargs="+", help="paths to the bots' executables, or builtin:<name>")
+parser.add_argument(
+    "--persistent",
+    action="store_true",
+    help="start each bot once for the whole tourney (see the README)",
+)
+parser.add_argument(
+    "--move-timeout",
+    type=float,
+    default=None,
+    help="seconds a bot gets per move before it forfeits the game",
+)
+parser.add_argument(
+    "--game-time-limit",
+    type=float,
+    default=None,
+    help="seconds a bot gets for all its moves in a game before it forfeits",
+)
+parser.add_argument(
+    "--book",
+    action="append",
+    default=[],
+    metavar="FILE",
+    help="an opening book or tablebase from book.py for the bots to use (can be given more than once)",
+)
+parser.add_argument(
+    "--rated",
+    action="store_true",
+    help="instead of a round robin, keep glicko-2 ratings and pick each game to learn the most from it",
+)
+parser.add_argument(
+    "--target-deviation",
+    type=float,
+    default=75.0,
+    help="with --rated, stop once every bot's rating deviation is below this (default: 75)",
+)
+parser.add_argument(
+    "--max-games",
+    type=int,
+    default=None,
+    help=f"with --rated, stop after this many games regardless (default: {RatingScheduler.MAX_ROUNDS} round robins' worth)",
+)
+parser.add_argument(
+    "--timing", action="store_true", help="print how long each bot's moves took, phase by phase"
+)
+parser.add_argument(
+    "-j", "--jobs", type=int, default=1, help="how many games to play at once (default: 1)"
+)
+parser.add_argument(
+    "--records", metavar="FILE", help="append a record of every game to FILE (see records.py)"
+)
+parser.add_argument(
+    "--watch", action="store_true", help="draw every game as it's played (only with --jobs 1)"
+)
+parser.add_argument(
+    "--profile",
+    action="store_true",
+    help="count calls to the referee's hot paths and bot i/o and time them (also on with ZENER_PROFILE=1)",
+)
+parser.add_argument(
+    "--profile-dump",
+    metavar="FILE",
+    help="also run every game under cProfile and save the stats to FILE (pstats format, e.g. for snakeviz or flameprof)",
+)
+args = parser.parse_args()
+if args.profile or args.profile_dump:
+    profiling.enable(cprofile=args.profile_dump is not None)
+profiling.enable_from_env()
+if args.rated and len(args.players) < 2:
+    parser.error("--rated needs at least two bots to pair up")
+if args.watch:
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+
+PLAYERS = args.players
 PLAYER_COUNT = len(PLAYERS)
 
 print("You've passed the following bots as players:")
@@ -14,36 +93,90 @@ print(PLAYERS)
 winners: dict[str, dict[str, Color]] = {bot: {} for bot in PLAYERS}
 stats: dict[str, tuple[float, float, float]] = {}
 
-for white_bot in PLAYERS:
-    for black_bot in PLAYERS:
-        if white_bot == black_bot:
-            continue
-        winner = play_game(get_from_bot(white_bot), get_from_bot(black_bot))
+if args.rated:
+    # games are picked as results come in (see ratings.py), so every bot
+    # gets a rating without playing every pairing both ways
+    rater = RatingScheduler(PLAYERS, args.target_deviation, args.max_games)
+    matchups = rater.matchups()
+else:
+    matchups = [
+        (white_bot, black_bot)
+        for white_bot in PLAYERS
+        for black_bot in PLAYERS
+        if white_bot != black_bot
+    ]
+results = run_games(
+    matchups,
+    args.jobs,
+    args.persistent,
+    args.move_timeout,
+    args.watch,
+    args.game_time_limit,
+    args.book,
+)
+timer = MoveTimer()
+run_profile = profiling.RunProfile()
+writer = RecordWriter(args.records) if args.records else None
+for record in results:
+    white_bot, black_bot = record["white"], record["black"]
+    if writer is not None:
+        writer.write(record)
+    for (color, phases) in record.get("phases", {}).items():
+        timer.merge(record[color], phases)
+    run_profile.merge(record.get("profile"))
+    winner, error = record["result"], record["error"]
+    if error is not None:
+        print(f"white: {white_bot}; black: {black_bot}; game crashed, counting it as a loss for both:")
+        print(error)
+    elif record["forfeit"] is not None:
+        print(f"white: {white_bot}; black: {black_bot}; winner: {winner} ({record['forfeit']} forfeited)")
+    else:
         print(f"white: {white_bot}; black: {black_bot}; winner: {winner}")
+    if args.rated:
+        rater.add_result(white_bot, black_bot, winner if error is None else None)
+    else:
         winners[white_bot][black_bot] = winner
+if writer is not None:
+    writer.close()
+
+if args.rated:
+    rater.end_period()
+    print("\033[2J\033[H")  # clear screen, return to terminal position 0,0
+    print(f"RATINGS (after {rater.rated} games, 95% intervals):")
+    for bot in sorted(PLAYERS, key=lambda bot: rater.ratings[bot].rating, reverse=True):
+        rating = rater.ratings[bot]
+        low, high = rating.interval()
+        print(f"- {rating.rating:.0f} ({low:.0f} to {high:.0f}, {rating.games} games) ({bot})")
+    for (a, b) in rater.dropped():
+        print(f"gave up on {a} vs {b} after {RatingScheduler.MAX_CRASHES} crashes in a row")
+    if not rater.converged() and rater.scheduled >= rater.max_games:
+        print(f"stopped at {rater.max_games} games before every deviation was under {args.target_deviation:g}")
+    elif not rater.converged() and rater.stalled():
+        print(f"stopped once deviations stopped shrinking, at {rater.lowest_deviation:.0f} (over {args.target_deviation:g})")
+else:
+    for bot in PLAYERS:
+        white_wins = sum(
+            1 if winners[bot][other] == Color.WHITE else 0 for other in winners[bot]
+        )
+        black_wins = sum(
+            1 if winners[other][bot] == Color.BLACK else 0 for other in winners[bot]
+        )
+        white_win_rate = white_wins / (PLAYER_COUNT - 1)
+        black_win_rate = black_wins / (PLAYER_COUNT - 1)
+        win_rate = (white_wins + black_wins) / ((PLAYER_COUNT * 2) - 2)
+        stats[bot] = (white_win_rate, black_win_rate, win_rate)
+
+    print("\033[2J\033[H")  # clear screen, return to terminal position 0,0
+    print("OVERALL:")
+    for bot in sorted(stats, key=lambda bot: stats[bot][2], reverse=True):
+        print(f"- {stats[bot][2]:.0%} ({bot})")
+
+    print("WHEN GOING FIRST:")
+    for bot in sorted(stats, key=lambda bot: stats[bot][0], reverse=True):
+        print(f"- {stats[bot][0]:.0%} ({bot})")
 
+    print("WHEN GOING SECOND:")
+    for bot in sorted(stats, key=lambda bot: stats[bot][1], reverse=True):
+        print(f"- {stats[bot][1]:.0%} ({bot})")
 
-for bot in PLAYERS:
-    white_wins = sum(
-        1 if winners[bot][other] == Color.WHITE else 0 for other in winners[bot]
-    )
-    black_wins = sum(
-        1 if winners[other][bot] == Color.BLACK else 0 for other in winners[bot]
-    )
-    white_win_rate = white_wins / (PLAYER_COUNT - 1)
-    black_win_rate = black_wins / (PLAYER_COUNT - 1)
-    win_rate = (white_wins + black_wins) / ((PLAYER_COUNT * 2) - 2)
-    stats[bot] = (white_win_rate, black_win_rate, win_rate)
-
-print("\033[2J\033[H")  # clear screen, return to terminal position 0,0
-print("OVERALL:")
-for bot in sorted(stats, key=lambda bot: stats[bot][2], reverse=True):
-    print(f"- {stats[bot][2]:.0%} ({bot})")
-
-print("WHEN GOING FIRST:")
-for bot in sorted(stats, key=lambda bot: stats[bot][0], reverse=True):
-    print(f"- {stats[bot][0]:.0%} ({bot})")
-
-print("WHEN GOING SECOND:")
-for bot in sorted(stats, key=lambda bot: stats[bot][1], reverse=True):
-    print(f"- {stats[bot][1]:.0%} ({bot})")
+profiling.print_report(run_profile, args.profile_dump, timer if args.timing else None)
@@ -0,0 +1,56 @@
+from core import Move
+
+# what a stored score means: the real value, or just a bound on it because
+# the search that produced it was cut off
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class TranspositionTable:
+    # fixed-size table of search results keyed by State.get_zobrist(), so a
+    # position reached by a different move order isn't searched twice. the
+    # low bits of the hash pick a slot; when two positions want the same
+    # slot, the one searched deeper wins unless it's left over from an
+    # older search. one table can be shared by any number of searches
+    def __init__(self, size_bits: int = 18):
+        self.size = 1 << size_bits
+        self.mask = self.size - 1
+        self.keys: list[int | None] = [None] * self.size
+        self.depths = [0] * self.size
+        self.scores = [0] * self.size
+        self.flags = [EXACT] * self.size
+        self.moves: list[Move | None] = [None] * self.size
+        self.ages = [0] * self.size
+        self.age = 0
+
+    def new_search(self) -> None:
+        # entries from earlier searches are still used, but get replaced first
+        self.age += 1
+
+    def get(self, key: int) -> tuple[int, int, int, Move | None] | None:
+        # (depth, score, flag, best move) or None if we haven't seen it
+        slot = key & self.mask
+        if self.keys[slot] != key:
+            return None
+        return (self.depths[slot], self.scores[slot], self.flags[slot], self.moves[slot])
+
+    def put(self, key: int, depth: int, score: int, flag: int, move: Move | None) -> None:
+        slot = key & self.mask
+        if (
+            self.keys[slot] is not None
+            and self.keys[slot] != key
+            and self.ages[slot] == self.age
+            and self.depths[slot] > depth
+        ):
+            return
+        self.keys[slot] = key
+        self.depths[slot] = depth
+        self.scores[slot] = score
+        self.flags[slot] = flag
+        self.moves[slot] = move
+        self.ages[slot] = self.age
+
+    def clear(self) -> None:
+        self.keys = [None] * self.size
+        self.moves = [None] * self.size
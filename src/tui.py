@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import logging
+import sys
 from move_getters import get_from_human
 from play_game import play_game
 
@@ -11,6 +13,7 @@ def end_of_turn():
         breakpoint()
     print()
 
+logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
 
 winner = play_game(
     get_white_move=get_from_human,
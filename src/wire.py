@@ -0,0 +1,140 @@
+import json
+from collections.abc import Mapping
+from core import COLOR_INDEX, COLORS, SHAPE_INDEX, SHAPES, BoardView, Color, Move, Piece, Shape, get_move
+
+# how positions are sent to bots and how their answers are read back. every
+# bot gets the json described in the README unless it asks for something
+# else in the persistent handshake:
+#   "compact": each move is one line like
+#       {"p":0,"r":false,"v":-1,"b":[x,y,height, ...],"m":[shape,x,y, ...]}
+#     where p is the player (0 white, 1 black), r is whether they're
+#     responding, v is the previous shape (-1 for none), b is x, y and height
+#     for each of the 10 pieces (white's circle, plus, wave, square and star,
+#     then black's) and m is every valid move as shape, x, y. shapes are
+#     numbered in that same order. the bot answers [shape,x,y]
+#   "delta": like compact, but after the first message "b" is replaced by
+#     "d": [piece,x,y,height, ...] for just the pieces that moved since the
+#     last message this bot was sent. a restarted bot starts over with "b"
+# when the referee has an opening book or tablebase that knows the position,
+# json messages get "known": {"shape", "x", "y", "score", "depth"} and
+# compact ones "k": [shape,x,y,score,depth]. in a seeded game every message
+# has "seed" (json) or "s" (compact), the same number all game, for bots
+# to seed their randomness with so the game can be played again exactly
+FORMAT_JSON = "json"
+FORMAT_COMPACT = "compact"
+FORMAT_DELTA = "delta"
+FORMATS = (FORMAT_JSON, FORMAT_COMPACT, FORMAT_DELTA)
+
+
+def get_board_json(board_state: Mapping[Color, Mapping[Shape, Piece]]):
+    # do a bunch of dict mapping to convert the internal Piece
+    # representations into normal json that other programs can read
+    return {
+        color: {
+            shape: {
+                "x": piece_obj.x,
+                "y": piece_obj.y,
+                "height": piece_obj.height,
+            }
+            for (shape, piece_obj) in colored_pieces.items()
+        }
+        for (color, colored_pieces) in board_state.items()
+    }
+
+
+def get_moves_json(valid_moves: list[Move]):
+    # quickndirty wrapper of above func for new json-oriented api
+    ret = {shape: [] for shape in Shape}
+    for move in valid_moves:
+        ret[move.shape].append({"x": move.x, "y": move.y})
+    return ret
+
+
+def encode_json(
+    player: Color,
+    board: Mapping[Color, Mapping[Shape, Piece]],
+    valid: list[Move],
+    responding: bool,
+    prev: Shape | None,
+    known: tuple[Move, int, int] | None = None,
+    seed: int | None = None,
+) -> str:
+    # known is (move, score, depth) from an opening book or tablebase, if
+    # the referee was given one that has this position (see book.py)
+    message = {
+        "board": get_board_json(board),
+        "player": player,
+        "valid": get_moves_json(valid),
+        "responding": responding,
+        "prev": prev,
+    }
+    if known is not None:
+        move, score, depth = known
+        message["known"] = {"shape": move.shape, "x": move.x, "y": move.y, "score": score, "depth": depth}
+    if seed is not None:
+        message["seed"] = seed
+    return json.dumps(message)
+
+
+def decode_json(player: Color, answer: str) -> Move:
+    # expect the answer to be
+    # {"shape": "wave", "x": 2, "y": 1}
+    bot_ret_json = json.loads(answer)
+    return get_move(player, Shape(bot_ret_json["shape"]), bot_ret_json["x"], bot_ret_json["y"])
+
+
+def flat_pieces(board: Mapping[Color, Mapping[Shape, Piece]]) -> list[int]:
+    if isinstance(board, BoardView):
+        return board.flat()
+    return [
+        value
+        for color in COLORS
+        for shape in SHAPES
+        for value in (board[color][shape].x, board[color][shape].y, board[color][shape].height)
+    ]
+
+
+def pieces_delta(old: list[int], new: list[int]) -> list[int]:
+    ret = []
+    for i in range(0, len(new), 3):
+        if old[i] != new[i] or old[i + 1] != new[i + 1] or old[i + 2] != new[i + 2]:
+            ret += (i // 3, new[i], new[i + 1], new[i + 2])
+    return ret
+
+
+def encode_compact(
+    player: Color,
+    pieces: list[int],
+    valid: list[Move],
+    responding: bool,
+    prev: Shape | None,
+    last_pieces: list[int] | None = None,
+    known: tuple[Move, int, int] | None = None,
+    seed: int | None = None,
+) -> str:
+    # pieces is from flat_pieces; pass the pieces from the last message the
+    # bot was sent as last_pieces to only send what changed
+    message = {
+        "p": COLOR_INDEX[player],
+        "r": responding,
+        "v": SHAPE_INDEX[prev] if prev is not None else -1,
+    }
+    if last_pieces is None:
+        message["b"] = pieces
+    else:
+        message["d"] = pieces_delta(last_pieces, pieces)
+    message["m"] = [value for move in valid for value in (SHAPE_INDEX[move.shape], move.x, move.y)]
+    if known is not None:
+        move, score, depth = known
+        message["k"] = [SHAPE_INDEX[move.shape], move.x, move.y, score, depth]
+    if seed is not None:
+        message["s"] = seed
+    return json.dumps(message, separators=(",", ":"))
+
+
+def decode_compact(player: Color, answer: str) -> Move:
+    shape, x, y = json.loads(answer)
+    # an index, but not one counting from the end
+    if not isinstance(shape, int) or not 0 <= shape < len(SHAPES):
+        raise ValueError(f"{shape!r} isn't a shape number")
+    return get_move(player, SHAPES[shape], x, y)